@@ -1,21 +1,32 @@
 import os
 import sys
-import time
 import json
+import time
 import uuid
 import venv
-import queue
+import re
+import shlex
+import hashlib
 import getpass
 import argparse
 import platform
 import subprocess
-import threading
-import itertools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from utils.preinstall import get_scancode
+from utils.downloader import DEFAULT_CACHE_DIR
+from utils.watcher import OutputWatcher
+from utils.capture import OutputCapture, LOG_DIR
+from utils.supervisor import forward_signals, get_supervisor
+from utils.line_endings import normalize_line_endings
+from utils.metrics import RunMetrics
+from utils.stages import STATE_FILE, Pipeline, file_fingerprint, fingerprint, tree_fingerprint
+from utils.incremental import list_repo_projects
+from utils.scan_cache import file_digest
 from utils.logger import log_success, log_error, log_info, YELLOW, RESET, CYAN
 
 password = None
+log_dir = LOG_DIR  # Full stage logs, set from --metrics_dir
 VENV_DIR = "venv"  # Name or path to the virtual environment
 LICT_CMD = "liscopelens"
 SYSTEM_SPC = {
@@ -26,66 +37,139 @@ SYSTEM_SPC = {
 }
 DOCKER_TAG = "3.2"  # Default tag for the Docker image
 DOCKER_URL = "swr.cn-south-1.myhuaweicloud.com/openharmony-docker/"
-
-def convert_line_endings_to_unix(path):
+MANIFEST_URL = "https://gitee.com/openharmony/manifest"
+CCACHE_VOLUME = "oh-ccache"
+PREBUILTS_VOLUME = "oh-prebuilts-cache"
+# prebuilts_download.sh keeps its archives next to the source tree, i.e. here inside the container.
+PREBUILTS_CACHE_DIR = "/home/OpenHarmony_2.0_canary_prebuilts"
+REPO_TOOL_URL = "https://gitee.com/oschina/repo/raw/fork_flow/repo-py3"
+GN_FLAGS = '--gn-flags="--ide=json" --gn-flags="--json-file-name=out.json"'
+# Prebuilts the GN generation step itself needs, relative to the source root.
+GN_PREBUILTS = ["prebuilts/build-tools/linux-x86/bin/gn", "prebuilts/python"]
+# Files GN generation reads, fingerprinted when the source tree has no repo metadata.
+GN_INPUTS = (".gn", ".gni", "bundle.json", "config.json")
+
+def convert_line_endings_to_unix(path, report_path=None):
     """
     Convert line endings in files to Unix format (LF).
     
     If run on windows platform, the CRLF line will lead to error when 
     run build/prebuilts_download.sh in docker. So we need to convert it to LF.
-    This function will recursively walk through the directory and convert all files.
+    Files are checked in parallel and only the text files that contain CRLF are rewritten,
+    so clean files keep their mtimes. Returns the summary, written to report_path if given.
+    """
+    summary = normalize_line_endings(path)
+    for file_path, error in summary["errors"]:
+        log_info(f"Skipping {file_path}: {error}")
+    log_info(
+        f"Line endings: {len(summary['changed'])} of {summary['scanned']} files converted, "
+        f"{summary['bytes_saved']} bytes saved, {summary['binary']} binary files skipped"
+    )
+    if report_path:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def repo_sync_script(workdir, branch=None, manifest_url=MANIFEST_URL, mirror=None, jobs=None, lfs_jobs=None, init=True):
+    """Return the bash script that checks out or updates the repo tree in workdir.
+
+    With a mirror directory the mirror is initialised or refreshed first and the tree is
+    cloned from it, so a second branch only downloads the objects the mirror lacks. The tree
+    copies the objects it needs (--dissociate) and stays usable where the mirror is not mounted.
+    Without init only the existing tree is synced. jobs and lfs_jobs default to the CPU count.
     """
-    for root, _, files in os.walk(path):
-        # pass .repo and .git directories
-        if ".repo" in root or ".git" in root:
-            continue
-        for name in files:
-            file_path = os.path.join(root, name)
-            try:
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                new_content = content.replace(b'\r\n', b'\n')
-                with open(file_path, 'wb') as f:
-                    f.write(new_content)
-            except Exception as e:
-                log_info(f"Skipping {file_path}: {e}")
-
-
-def fetch_openharmony_source(oh_path: Path, branch: str, docker_image: str):
+    q = shlex.quote
+    jobs = str(jobs) if jobs else "$(nproc)"
+    lfs_jobs = str(lfs_jobs) if lfs_jobs else "$(nproc)"
+    branch_opt = f"-b {q(branch)}" if branch else ""
+    lines = [
+        "set -e",
+        f"cd {q(workdir)}",
+        "# Ensure repo tool is present",
+        "if command -v repo >/dev/null 2>&1; then",
+        "    REPO=repo",
+        "else",
+        "    if [ ! -x ./repo ]; then",
+        "        echo 'repo not found inside container – downloading…'",
+        f"        wget -O ./repo {q(REPO_TOOL_URL)}",
+        "        chmod +x ./repo",
+        "    fi",
+        '    REPO="$PWD/repo"',
+        "fi",
+    ]
+    if mirror:
+        lines += [
+            f"mkdir -p {q(mirror)} && cd {q(mirror)}",
+            f'"$REPO" init -u {q(manifest_url)} {branch_opt} --mirror --no-repo-verify',
+            f'"$REPO" sync -j {jobs} --no-tags',
+            f"cd {q(workdir)}",
+        ]
+    if init:
+        reference = f"--reference={q(mirror)} --dissociate" if mirror else ""
+        lines.append(f'"$REPO" init -u {q(manifest_url)} {branch_opt} --no-repo-verify {reference}')
+    lines += [
+        f'"$REPO" sync -c -j {jobs} --no-tags --optimized-fetch',
+        f"\"$REPO\" forall -j {lfs_jobs} -c 'git lfs pull'",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def fetch_openharmony_source(
+    oh_path: Path,
+    branch: str,
+    docker_image: str,
+    manifest_url: str = MANIFEST_URL,
+    mirror: Path = None,
+    jobs: int = None,
+    lfs_jobs: int = None,
+    update: bool = False,
+):
     """Run *repo init/sync/lfs* **inside** docker so host machine stays clean.
     
     Args:
         oh_path: Path to store OpenHarmony source code
         branch: Branch name (e.g., "master", "OpenHarmony-4.0-Release")
         docker_image: Docker image to use for the build environment
+        manifest_url: Manifest repository to initialise from
+        mirror: Shared repo mirror on the host, created on first use and reused across branches
+        jobs: Parallel repo sync jobs, the container's CPU count by default
+        lfs_jobs: Projects pulling LFS objects in parallel, the container's CPU count by default
+        update: Sync an existing tree instead of skipping it
     """
-    if (oh_path / ".repo").exists():
+    exists = (oh_path / ".repo").exists()
+    if exists and not update:
         log_success("Existing source tree detected – skip download.")
         return
 
     oh_path.mkdir(parents=True, exist_ok=True)
     
     # Check if branch exists before fetching
-    log_info(f"Checking if branch exists: {branch}")
-    if not check_branch_exists("https://gitee.com/openharmony/manifest", branch):
-        raise ValueError(f"Branch '{branch}' does not exist in OpenHarmony manifest repository")
+    if branch:
+        log_info(f"Checking if branch exists: {branch}")
+        if not check_branch_exists(manifest_url, branch):
+            raise ValueError(f"Branch '{branch}' does not exist in OpenHarmony manifest repository")
 
     # Shell snippet executed inside the container.
-    script = f"""
-        set -e
-        cd /home/openharmony
-        # Ensure repo tool is present
-        if ! command -v repo >/dev/null 2>&1; then
-            echo 'repo not found inside container – downloading…'
-            wget -O ./repo https://gitee.com/oschina/repo/raw/fork_flow/repo-py3
-            chmod +x ./repo
-        fi
-        ./repo init -u https://gitee.com/openharmony/manifest -b {branch} --no-repo-verify
-        ./repo sync -c --no-tags --optimized-fetch
-        ./repo forall -c 'git lfs pull'
-    """
+    script = repo_sync_script(
+        "/home/openharmony",
+        branch,
+        manifest_url,
+        mirror="/home/mirror" if mirror else None,
+        jobs=jobs,
+        lfs_jobs=lfs_jobs,
+        # An existing tree is only re-initialised to switch branches.
+        init=not exists or bool(branch),
+    )
 
-    log_info(f"Cloning OpenHarmony sources (branch: {branch}) inside Docker – this may take a while...")
+    action = "Updating" if exists else "Cloning"
+    log_info(f"{action} OpenHarmony sources (branch: {branch or 'current'}) inside Docker – this may take a while...")
+
+    mounts = ["-v", f"{oh_path}:/home/openharmony"]
+    if mirror:
+        Path(mirror).mkdir(parents=True, exist_ok=True)
+        mounts += ["-v", f"{Path(mirror).resolve()}:/home/mirror"]
 
     # Use the custom function for better output and process handling
     run_command_with_timeout(
@@ -94,15 +178,15 @@ def fetch_openharmony_source(oh_path: Path, branch: str, docker_image: str):
             "docker",
             "run",
             "--rm",
-            "-v",
-            f"{oh_path}:/home/openharmony",
+            *mounts,
             docker_image,
             "bash",
             "-c",
             script,
         ],
-        description="Cloning OpenHarmony sources",
-        live_output=True  # Show output in real-time
+        description=f"{action} OpenHarmony sources",
+        live_output=True,  # Show output in real-time
+        capture=OutputCapture.for_stage("source-sync", log_dir),
     )
 
     log_success("Source checkout completed.")
@@ -111,40 +195,39 @@ def fetch_openharmony_source(oh_path: Path, branch: str, docker_image: str):
 def check_branch_exists(repo_url: str, branch: str) -> bool:
     """Check if a branch exists in the remote repository using git ls-remote."""
     try:
-        result = subprocess.run(
-            ["git", "ls-remote", "--heads", "--exit-code", repo_url, branch],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        result = get_supervisor().run(
+            ["git", "ls-remote", "--heads", "--exit-code", repo_url, branch], merge_stderr=False
+        ).check()
         return bool(result.stdout.strip())
     except subprocess.CalledProcessError:
         return False
 
-def run_command_with_timeout(command: list[str], description="", timeout=None, live_output=False, abort_condition_callback=None, abort_check_interval=10):
+def run_command_with_timeout(command: list[str], description="", timeout=None, live_output=False, abort_condition_callback=None, abort_check_interval=10, abort_watcher=None, capture=None):
     """
-    Run a command with a timeout, capture its output, and handle exceptions in a separate thread.
-    Optionally display output in real-time.
+    Run a command through the process supervisor with a timeout and capture its output.
+    Optionally display output in real-time. Several threads may run commands at once,
+    their descriptions share one status line.
     If the command contains 'sudo', prompt for the password and provide it securely.
 
     Parameters:
     - command: List[str] - The command and its arguments to execute.
-    - description: str - A description to display alongside the loading spinner.
+    - description: str - A description to display in the status line while the command runs.
     - timeout: float or None - Maximum time in seconds to allow the command to run. If None, no timeout is applied.
     - live_output: bool - If True, display the command output in real-time.
     - abort_condition_callback: callable or None - A callback function that returns True if the process should be aborted.
     - abort_check_interval: int - Interval (in seconds) between abort condition checks.
+    - abort_watcher: OutputWatcher or None - Stop the command as soon as the watched output is complete.
+    - capture: OutputCapture or None - Where the output goes, pass one with a log file to keep the full output.
 
     Returns:
-    - str: The captured output from the command.
+    - str: The last lines of the command output.
 
     Raises:
     - Exception: Any exception raised during the execution of the command.
     - subprocess.TimeoutExpired: If the command exceeds the specified timeout.
     """
     global password
-    output = []  # To capture command output
-    exception_queue = queue.Queue()  # Queue to capture exceptions
+    capture = capture if capture is not None else OutputCapture()
 
     # Check if the command includes 'sudo'
     if "sudo" in command:
@@ -153,100 +236,47 @@ def run_command_with_timeout(command: list[str], description="", timeout=None, l
             # Prompt the user securely for the sudo password
             if not password:
                 password = getpass.getpass("Enter sudo password: ")
-            # Modify the command to include '-S' to read the password from stdin
+            # Modify the command to include '-S' to read the password from stdin, with an empty
+            # prompt, sudo writes it to stderr and it would end up in front of the command's output
             sudo_index = command.index("sudo")
-            command.insert(sudo_index + 1, "-S")
+            command[sudo_index + 1:sudo_index + 1] = ["-S", "-p", ""]
         else:
             # Remove 'sudo' from the command
             command = [cmd for cmd in command if cmd != "sudo"]
             log_info("Removed 'sudo' from the command as the OS is not Linux.")
 
-    # We'll store the process reference in an external variable to allow the abort thread to kill it
-    process_ref = {"proc": None, "finished": False}
-
-    def target():
-        try:
-            # Start the subprocess with pipes for stdin and stdout
-            process = subprocess.Popen(
-                command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                encoding="utf-8",  # 或 "gbk"
-                errors="replace",  # 替换无法解码的字符
-                text=True,
-                bufsize=1,  # Line-buffered
-                universal_newlines=True,
-            )
-            process_ref["proc"] = process
-
-            if live_output:
-                # Read line by line and print in real-time
-                with open(os.devnull, "w") as devnull:
-                    for line in iter(process.stdout.readline, ""):
-                        print(line, end="")  # Print to console
-                        output.append(line)
-                process.stdout.close()
-                process.wait()
-            else:
-                try:
-                    if password:
-                        # Send the password followed by a newline
-                        stdout, _ = process.communicate(password + "\n", timeout=timeout)
-                    else:
-                        stdout, _ = process.communicate(timeout=timeout)
-                    output.append(stdout)
-                except subprocess.TimeoutExpired:
-                    log_error(f"Command timed out after {timeout} seconds.")
-                    process.kill()
-                    stdout, _ = process.communicate()
-                    exception_queue.put(subprocess.TimeoutExpired(process.args, timeout))
-                    return
-
-        except Exception as e:
-            exception_queue.put(e)
-        finally:
-            process_ref["finished"] = True
-
-    # Start the thread to run the command
-    thread = threading.Thread(target=target)
-    thread.start()
-
-    def abort_monitor():
-        # This thread periodically checks if we need to abort
-        while not process_ref["finished"]:
-            time.sleep(abort_check_interval)
-            if abort_condition_callback and abort_condition_callback():
-                proc = process_ref["proc"]
-                if proc and proc.poll() is None:
-                    # Abort the process
-                    log_info("Abort condition met. Terminating the command...")
-                    proc.terminate()
-                break
-
-    if abort_condition_callback:
-        monitor_thread = threading.Thread(target=abort_monitor, daemon=True)
-        monitor_thread.start()
-
-    # Loading effect
-    spinner = itertools.cycle(["|", "/", "-", "\\"])
-    while thread.is_alive():
-        sys.stdout.write(f"\r{description} ... {next(spinner)} ")
-        sys.stdout.flush()
-        time.sleep(0.1)
-
-    sys.stdout.write("\r" + " " * 80 + "\r")  # Clear the loading effect
-
-    # Ensure the thread finishes
-    thread.join()
-
-    # Check for exceptions in the thread
-    if not exception_queue.empty():
-        exception = exception_queue.get()
-        raise exception
-
-    output = [o for o in output if o is None ]  # Remove None lines
-    return "".join(output) if output else ""
+    def on_line(line):
+        if live_output:
+            print(line, end="")  # Print to console
+        # Only the tail stays in memory, the full output is streamed to the capture's log.
+        capture.write(line)
+
+    try:
+        result = get_supervisor().run(
+            command,
+            input=password + "\n" if password else None,
+            timeout=timeout,
+            on_line=on_line,
+            abort_watcher=abort_watcher,
+            abort_check=abort_condition_callback,
+            abort_check_interval=abort_check_interval,
+            description=description,
+            live_output=live_output,
+        )
+        if result.stopped == "abort":
+            log_info(f"{abort_watcher.path} is complete. Terminated the command." if abort_watcher else "Abort condition met. Terminated the command.")
+        elif result.stopped == "timeout":
+            log_error(f"Command timed out after {timeout} seconds.")
+            raise subprocess.TimeoutExpired(command, timeout)
+    except Exception as e:
+        if not isinstance(e, FileNotFoundError):
+            tail = "".join(capture.tail(20))
+            log_error(f"Last output lines:\n{tail}" + (f"Full log: {capture.log_path}" if capture.log_path else ""))
+        raise
+    finally:
+        capture.close()
+
+    return "".join(capture.tail())
 
 
 def create_venv(venv_dir):
@@ -258,6 +288,29 @@ def create_venv(venv_dir):
         log_success(f"Virtual environment created at {venv_dir}.")
 
 
+def gn_prebuilts_ready(oh_path: str) -> bool:
+    """Whether the tools GN generation needs are already in the source tree."""
+    return all((Path(oh_path) / p).exists() for p in GN_PREBUILTS)
+
+
+def build_script(product_name: str, gn_only: bool, oh_path: str = None, download: bool = True) -> str:
+    """Return the shell snippet that produces out.json inside the build container.
+
+    In GN-only mode the build stops after `gn gen`, and the prebuilts are only downloaded
+    when a tool GN generation needs is missing from `oh_path`. The download is then the
+    complete prebuilts_download.sh: its tool list differs between releases and has no
+    stable option to fetch single tools. Without `download` the prebuilts are expected in
+    place, e.g. after one download shared by several products.
+    """
+    fetch = "./build/prebuilts_download.sh && " if download else ""
+    if not gn_only:
+        return f"{fetch}./build.sh --product-name {product_name} {GN_FLAGS}"
+
+    if oh_path is not None and gn_prebuilts_ready(oh_path):
+        fetch = ""
+    return f"{fetch}./build.sh --product-name {product_name} --build-only-gn {GN_FLAGS}"
+
+
 def check_and_install_cmd(venv_dir, cmd):
     """Check if a command is installed in the virtual environment and install it if missing."""
     venv_bin = Path(venv_dir) / "bin" if os.name != "nt" else Path(venv_dir) / "Scripts"
@@ -270,7 +323,7 @@ def check_and_install_cmd(venv_dir, cmd):
     except FileNotFoundError:
         # Command not found, install via pip
         log_info(f"'{cmd}' not found. Installing liscopelens via pip...")
-        subprocess.check_call([str(pip_executable), "install", "liscopelens"])
+        get_supervisor().run([str(pip_executable), "install", "liscopelens"], passthrough=True).check()
         log_success(f"'{cmd}' installed successfully.")
 
 
@@ -281,6 +334,7 @@ def check_and_pull_docker(image_name):
         run_command_with_timeout(
             ["sudo", "docker", "pull", image_name],
             description=f"Pulling '{image_name}' image",
+            capture=OutputCapture.for_stage("docker-pull", log_dir),
         )
         log_success(f"'{image_name}' image pulled successfully.")
     except Exception as e:
@@ -288,34 +342,157 @@ def check_and_pull_docker(image_name):
         sys.exit(1)
 
 
+def docker_image_id(image_name):
+    """Return the local id of a Docker image, None if it has not been pulled."""
+    try:
+        output = run_command_with_timeout(
+            ["sudo", "docker", "image", "inspect", "--format", "{{.Id}}", image_name],
+            description=f"Inspecting '{image_name}' image",
+        )
+    except Exception:
+        return None
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    return lines[-1] if lines and lines[-1].startswith("sha256:") else None
+
+
+def source_fingerprint(oh_path):
+    """Digest of the revisions of all repo projects.
+
+    A tree that is not a repo checkout is fingerprinted by the paths, sizes and mtimes of its
+    GN build files and product configs instead. None if oh_path does not exist.
+    """
+    try:
+        return fingerprint(list_repo_projects(oh_path))
+    except FileNotFoundError:
+        return tree_fingerprint(oh_path, GN_INPUTS, skip=("out", ".git", ".repo"))
+
+
+def build_container_name(docker_image, oh_path):
+    """Name of the long-lived build container of an image and source tree."""
+    key = f"{docker_image}|{os.path.abspath(oh_path)}"
+    return f"oh-build-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def ensure_build_container(docker_image, oh_path):
+    """Start the persistent build container unless it is already running, return its name.
+
+    The container mounts the source tree and named volumes for ccache and the prebuilts
+    download cache, so compiler output and prebuilt archives survive across builds.
+    """
+    name = build_container_name(docker_image, oh_path)
+    state = run_command_with_timeout(
+        ["sudo", "docker", "inspect", "--format", "{{.State.Running}}", name],
+        description="Looking for the build container",
+    ).strip().splitlines()
+    state = state[-1].strip() if state else ""
+
+    if state == "true":
+        log_info(f"Reusing build container {name}.")
+    elif state == "false":
+        log_info(f"Starting stopped build container {name}...")
+        run_command_with_timeout(["sudo", "docker", "start", name], description="Starting build container")
+    else:
+        log_info(f"Creating build container {name}...")
+        run_command_with_timeout(
+            [
+                "sudo",
+                "docker",
+                "run",
+                "-d",
+                "--name",
+                name,
+                "-v",
+                f"{os.path.abspath(oh_path)}:/home/openharmony",
+                "-v",
+                f"{CCACHE_VOLUME}:/ccache",
+                "-v",
+                f"{PREBUILTS_VOLUME}:{PREBUILTS_CACHE_DIR}",
+                "-e",
+                "CCACHE_DIR=/ccache",
+                "-e",
+                "CCACHE_BASE=/ccache",
+                "-e",
+                "USE_CCACHE=1",
+                "-w",
+                "/home/openharmony",
+                docker_image,
+                "sleep",
+                "infinity",
+            ],
+            description="Creating build container",
+        )
+    return name
+
+
+def docker_exec_command(name, script, pidfile=None):
+    """Command running script in the build container; with a pidfile its process group can be stopped later."""
+    if pidfile:
+        # setsid makes the shell a process group leader, stop_build_process signals the whole group.
+        # -w keeps docker exec attached until the build exits, setsid would otherwise fork and return.
+        script = f"echo $$ > {pidfile}; exec sh -c {shlex.quote(script)}"
+        return ["sudo", "docker", "exec", "-w", "/home/openharmony", name, "setsid", "-w", "sh", "-c", script]
+    return ["sudo", "docker", "exec", "-w", "/home/openharmony", name, "sh", "-c", script]
+
+
+def stop_build_process(name, pidfile):
+    """Terminate a build started with docker_exec_command, the container keeps running."""
+    run_command_with_timeout(
+        ["sudo", "docker", "exec", name, "sh", "-c", f'kill -TERM -- -"$(cat {pidfile})" 2>/dev/null; rm -f {pidfile}'],
+        description="Stopping build",
+    )
+
+
+def report_build_caches(name):
+    """Log ccache hit statistics and the prebuilts cache size of the build container, return the ccache lines."""
+    ccache = run_command_with_timeout(
+        ["sudo", "docker", "exec", name, "sh", "-c", "command -v ccache >/dev/null && ccache -s || echo 'ccache not installed'"],
+        description="Reading ccache statistics",
+    )
+    lines = [line.strip() for line in ccache.splitlines() if re.search(r"(?i)hit|miss|size|not installed", line)]
+    prebuilts = run_command_with_timeout(
+        ["sudo", "docker", "exec", name, "du", "-sh", PREBUILTS_CACHE_DIR],
+        description="Measuring prebuilts cache",
+    ).strip().splitlines()
+    log_info("ccache: " + "; ".join(lines))
+    if prebuilts:
+        log_info(f"prebuilts cache: {prebuilts[-1].split()[0]}")
+    return lines
+
+
 def run_in_venv(venv_dir, command):
     """Run a command inside the virtual environment."""
     venv_bin = Path(venv_dir) / "bin" if os.name != "nt" else Path(venv_dir) / "Scripts"
     log_info(f"Running command in virtual environment: {command}")
-    result = subprocess.run([venv_bin / command[0]] + command[1:], check=True)
+    # The output stays on the terminal, scan.py draws its own progress bars.
+    result = get_supervisor().run([venv_bin / command[0]] + command[1:], passthrough=True).check()
     log_success(f"Command '{' '.join(map(str, command))}' executed successfully.")
     return result
 
 
-def check_out_json(oh_path, product_name, docker_image, args) -> str:
-    """Check if out.json exists and provide manual instructions if it doesn't."""
+def check_out_json(oh_path, product_name, docker_image, args, capture=None) -> str:
+    """Check if out.json exists and provide manual instructions if it doesn't.
+
+    If the build output was captured, its error lines are shown as well.
+    """
     out_json_path = Path(oh_path) / "out" / product_name / "out.json"
     if os.path.exists(out_json_path):
         log_success(f"Build successful. Found 'out.json' at: {out_json_path}")
     else:
         log_error(f"'out.json' not found at: {out_json_path}")
+        if capture is not None:
+            errors = capture.grep(r"(?i)\b(error|failed)\b", max_count=20) or capture.tail(20)
+            log_error("Build output:\n" + "".join(errors) + (f"Full log: {capture.log_path}" if capture.log_path else ""))
         log_error("Build may have failed. Please execute the following steps inside the Docker container manually:")
         manual_commands = [
             (
                 f" 1. sudo docker run --rm -v {os.path.abspath(args.oh_path)}:/home/openharmony {docker_image}\n"
-                f' 2. ./build/prebuilts_download.sh && ./build.sh --product-name {args.product_name} --gn-flags="--ide=json" '
-                f'--gn-flags="--json-file-name=out.json" --no-prebuild-sdk\n'
+                f" 2. {build_script(product_name, not args.full_build)} --no-prebuild-sdk\n"
                 f"{RESET}After build success, run: {CYAN}exit\n"
                 f" 3. source {os.path.join('venv', 'bin', 'activate')}"
                 if os.name != "nt"
                 else f"{os.path.join('venv', 'Scripts', 'activate')}"
             ),
-            f" 4. python utils/scan.py {oh_path}\n" f" 5. {LICT_CMD} {oh_path}",
+            f" 4. python -m utils.scan {oh_path} --product_name {product_name}\n" f" 5. {LICT_CMD} {oh_path}",
         ]
         for cmd in manual_commands:
             print(f"{CYAN}{cmd}{RESET}")
@@ -335,111 +512,354 @@ if __name__ == "__main__":
     parser.add_argument("--system_spec", default="standard", help="Docker system spec key or direct image name")
     parser.add_argument("--tag", default=DOCKER_TAG, help="Docker image tag")
     parser.add_argument("--oh_path", default="./oh-source", help="Path to OpenHarmony sources on host")
-    parser.add_argument("--product_name", default="rk3568", help="Product name to build inside Docker")
+    parser.add_argument(
+        "--product_name",
+        nargs="+",
+        default=["rk3568"],
+        help="Products to audit; several products share one scan and get one report each under --output",
+    )
+    parser.add_argument(
+        "--batch_jobs",
+        type=int,
+        help="Products built and analysed concurrently. Builds run one at a time by default, hb keeps state "
+        "shared by all products in the tree (out/ohos_config.json, the preloader output), analyses all at once",
+    )
     parser.add_argument("--output", default="./output", help="Output directory for licence report")
     parser.add_argument("--shadow", help="Node2license JSON file for shadow mode")
+    parser.add_argument("--scan_cpus", type=int, default=os.cpu_count(), help="CPU budget shared by all concurrent scancode jobs")
+    parser.add_argument("--scan_jobs", type=int, help="Number of concurrent scancode jobs, derived from --scan_cpus by default")
+    parser.add_argument("--incremental", action="store_true", help="Rescan only targets under repo projects whose revision moved")
+    parser.add_argument("--prune", action="store_true", help="Scan only targets the product images depend on")
+    parser.add_argument("--warm_scancode", action="store_true", help="Keep warm scancode workers instead of one CLI run per target")
+    parser.add_argument("--prefilter", action="store_true", help="Drop binaries, LFS pointers, prebuilts and generated files before scanning")
+    parser.add_argument("--prefilter_config", help="JSON of per-product path ignore patterns for --prefilter")
+    parser.add_argument(
+        "--fastpath", action="store_true", help="Resolve files with a single SPDX line or the Apache-2.0 header without scancode"
+    )
+    parser.add_argument("--fastpath_verify", type=float, help="Fraction of fast path files to cross-check with scancode")
+    parser.add_argument("--file_timeout", type=float, help="Seconds scancode may spend on one file, 120 by default")
+    parser.add_argument("--target_timeout", type=float, help="Seconds one scancode run may take before it is killed")
+    parser.add_argument(
+        "--stall_timeout", type=float, help="Kill a scancode run when no file finished for this many seconds"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help=(
+            "Also compact scan results into <oh_path>-license.db for lookups and archiving. The JSON results "
+            "stay, the next scan resumes from them and liscopelens reads them"
+        ),
+    )
+    parser.add_argument("--scan_mode", choices=["dir", "files"], default="dir", help="Scan whole target directories or only GN referenced files")
+
+    parser.add_argument(
+        "--full_build",
+        action="store_true",
+        help=(
+            "Run the complete build and stop it once out.json is written, instead of only the GN generation step. "
+            "The GN step skips the prebuilts download when gn and python are already in the tree, otherwise it "
+            "runs the full build/prebuilts_download.sh"
+        ),
+    )
+
+    parser.add_argument(
+        "--fix_line_endings",
+        action="store_true",
+        help="Convert CRLF to LF in the source tree before building, always done on Windows hosts",
+    )
+
+    parser.add_argument(
+        "--build_sentinel",
+        help="File relative to --oh_path the build creates once out.json is final, stops --full_build without waiting for it to settle",
+    )
+
+    parser.add_argument(
+        "--persistent_container",
+        action="store_true",
+        help=f"Build in a long-lived container per image and tree with the {CCACHE_VOLUME} and {PREBUILTS_VOLUME} volumes",
+    )
+    parser.add_argument("--remove_container", action="store_true", help="Remove the persistent build container after the run")
+    parser.add_argument("--download_cache", default=DEFAULT_CACHE_DIR, help="Cache for downloaded toolchains, may be shared between machines")
+    parser.add_argument("--scancode_sha256", help="Expected SHA-256 of the scancode-toolkit release archive")
+    parser.add_argument(
+        "--allow_unpinned",
+        action="store_true",
+        help="Download a scancode-toolkit archive without a pinned SHA-256, its digest is recorded on the first download",
+    )
+    parser.add_argument(
+        "--force",
+        action="append",
+        choices=["pull", "fetch", "build", "scan", "liscopelens", "all"],
+        default=[],
+        help="Rerun a stage even if its inputs are unchanged, may be repeated",
+    )
+    parser.add_argument("--state_file", default=STATE_FILE, help="Where the stage fingerprints of the last run are kept")
+    parser.add_argument("--metrics_dir", default=LOG_DIR, help="Directory for the JSON run report with per-stage timings and the full stage logs")
+    parser.add_argument("--prom_textfile", help="Also write the run metrics to this Prometheus textfile")
 
     parser.add_argument("--branch", 
                    help="OpenHarmony release tag branch (required if --download is set)")
+    parser.add_argument("--manifest_url", default=MANIFEST_URL, help="Manifest repository used by repo init")
+    parser.add_argument("--mirror", help="Shared repo mirror directory, reused by every checkout and branch")
+    parser.add_argument("--sync_jobs", type=int, help="Parallel repo sync jobs, the CPU count by default")
+    parser.add_argument("--lfs_jobs", type=int, help="Projects pulling git LFS objects in parallel, the CPU count by default")
+    parser.add_argument(
+        "--update_sources", action="store_true", help="Sync an existing --oh_path checkout (and the mirror) before building"
+    )
 
     args = parser.parse_args()
+    log_dir = args.metrics_dir
+    forward_signals()
 
     # 手动验证参数依赖关系
     if args.download and not args.branch:
         parser.error("--branch is required when --download is specified")
+    if args.warm_scancode and args.stall_timeout:
+        parser.error("--stall_timeout can not be combined with --warm_scancode, warm workers report no per-file progress")
 
     docker_name = f"oh-{uuid.uuid4()}"
     docker_system_spec = SYSTEM_SPC.get(args.system_spec, args.system_spec)
     docker_image = f"{DOCKER_URL}{docker_system_spec}:{args.tag}"
 
-    if args.download:
-        check_and_pull_docker(docker_image)  # Need image for repo as well
-        fetch_openharmony_source(Path(args.oh_path).resolve(), args.branch, docker_image)
-    else:
-        if not Path(args.oh_path).exists():
-            log_error("Source path is missing – use --download to fetch automatically.")
-            sys.exit(1)
-
-    create_venv(VENV_DIR)
-    get_scancode()
-    check_and_install_cmd(VENV_DIR, LICT_CMD)
-
-    check_and_pull_docker(docker_image)
+    metrics = RunMetrics(
+        os.path.join(args.metrics_dir, "run-report.json"),
+        args.prom_textfile,
+        labels={"product": ",".join(args.product_name), "branch": args.branch or "local"},
+    )
+    scan_metrics_path = os.path.join(args.metrics_dir, "scan-metrics.json")
+    gn_json_paths = {product: Path(args.oh_path) / "out" / product / "out.json" for product in args.product_name}
+    batch_jobs = args.batch_jobs or len(args.product_name)
+    # Concurrent builds race on hb's shared state and may generate out.json for another product's config.
+    build_jobs = args.batch_jobs or 1
+    scancode_result_dir = args.oh_path.split(os.path.sep)[-1] + "-license"
+    pipeline = Pipeline(args.state_file, force=args.force, metrics=metrics, log=log_info)
 
-    if os.path.exists(args.oh_path):
-        log_info(f"OpenHarmony source code path exists: {args.oh_path}")
-    else:
-        log_error(f"OpenHarmony source code path not found: {args.oh_path}")
-        log_error("Please provide the correct path to the OpenHarmony source code.")
+    if not args.download and not Path(args.oh_path).exists():
+        log_error("Source path is missing – use --download to fetch automatically.")
         sys.exit(1)
 
-    log_info("------ Build OH in Docker ------", prefix="\n")
+    with metrics.stage("setup"):
+        create_venv(VENV_DIR)
+        get_scancode(args.download_cache, args.scancode_sha256, args.allow_unpinned)
+        check_and_install_cmd(VENV_DIR, LICT_CMD)
+
+    @pipeline.stage("pull", inputs=lambda: {"image": docker_image}, outputs=lambda: docker_image_id(docker_image))
+    def pull_stage():
+        check_and_pull_docker(docker_image)
+
+    fetching = args.download or args.update_sources
+    if args.update_sources:
+        # Whether upstream moved is only known after syncing.
+        pipeline.force.add("fetch")
+    if fetching:
+
+        @pipeline.stage(
+            "fetch",
+            inputs=lambda: {"branch": args.branch, "oh_path": os.path.abspath(args.oh_path), "manifest": args.manifest_url},
+            outputs=lambda: source_fingerprint(args.oh_path),
+            deps=["pull"],
+        )
+        def fetch_stage():
+            fetch_openharmony_source(
+                Path(args.oh_path).resolve(),
+                args.branch,
+                docker_image,
+                manifest_url=args.manifest_url,
+                mirror=Path(args.mirror) if args.mirror else None,
+                jobs=args.sync_jobs,
+                lfs_jobs=args.lfs_jobs,
+                update=args.update_sources,
+            )
+
+    build_container = None
 
-    
-    def abort_if_out_json_exists():
-        out_json_path = Path(args.oh_path) / "out" / args.product_name / "out.json"
-        if not out_json_path.exists():
-            return False
-        
-        try:
-            with open(out_json_path, 'r', encoding="utf-8") as f:
-                content1 = json.load(f)
-            
-            time.sleep(1)
-            with open(out_json_path, 'r', encoding="utf-8") as f:
-                content2 = json.load(f)
-                
-            if content1 == content2:
-                return True
-            return False
-            
-        except (json.JSONDecodeError, IOError) as e:
-            log_info(f"File not ready yet: {e}")
-            return False
-    
-    run_command_with_timeout(
-        [
+    def container_command(script, name, pidfile=None):
+        if build_container:
+            return docker_exec_command(build_container, script, pidfile)
+        return [
             "sudo",
             "docker",
             "run",
             "--rm",
             "--name",
-            docker_name,
+            name,
             "-v",
             f"{os.path.abspath(args.oh_path)}:/home/openharmony",
             docker_image,
             "sh",
             "-c",
-            f'./build/prebuilts_download.sh && ./build.sh --product-name {args.product_name} '
-            f'--gn-flags="--ide=json" --gn-flags="--json-file-name=out.json"'
-        ],
-        description=f"This may take a long time, you can check log from {os.path.join(args.oh_path,'build.log')}",
-        abort_condition_callback=abort_if_out_json_exists,
-        abort_check_interval=20  # 每隔10秒检查一次
-    )
+            script,
+        ]
 
-    gn_json_path = check_out_json(args.oh_path, args.product_name, docker_image, args)
-    run_command_with_timeout(["sudo", "docker", "kill", docker_name])
+    def build_product(product_name):
+        pidfile = f"/tmp/oh-build-{product_name}.pid"
+        build_command = container_command(
+            # With several products the prebuilts were downloaded once by the build stage.
+            build_script(product_name, not args.full_build, args.oh_path, download=len(args.product_name) == 1),
+            f"{docker_name}-{product_name}",
+            pidfile,
+        )
 
-    log_info("------ Running Scancode ------", prefix="\n")
-    log_info(args.oh_path + os.path.sep)
-    run_in_venv(VENV_DIR, ["python", os.path.normpath("./utils/scan.py"), args.oh_path + os.path.sep])
+        build_capture = OutputCapture.for_stage(f"build-{product_name}", log_dir)
+        build_start = time.monotonic()
+        if args.full_build:
+            run_command_with_timeout(
+                build_command,
+                description=f"Building {product_name}, you can check log from {os.path.join(args.oh_path,'build.log')}",
+                abort_watcher=OutputWatcher(
+                    gn_json_paths[product_name],
+                    sentinel=Path(args.oh_path) / args.build_sentinel if args.build_sentinel else None,
+                ),
+                capture=build_capture,
+            )
+            if build_container:
+                stop_build_process(build_container, pidfile)
+            else:
+                run_command_with_timeout(["sudo", "docker", "kill", f"{docker_name}-{product_name}"])
+        else:
+            run_command_with_timeout(
+                build_command,
+                description=f"Generating GN targets of {product_name}",
+                capture=build_capture,
+            )
+        log_info(f"{'Build' if args.full_build else 'GN generation'} of {product_name} took {time.monotonic() - build_start:.0f}s")
+        return build_capture
+
+    @pipeline.stage(
+        "build",
+        inputs=lambda: {
+            "sources": source_fingerprint(args.oh_path) or uuid.uuid4().hex,
+            "products": args.product_name,
+            "script": build_script("", not args.full_build),
+        },
+        outputs=lambda: {product: file_fingerprint(path) for product, path in gn_json_paths.items()},
+        deps=["pull", *(["fetch"] if fetching else [])],
+    )
+    def build_stage():
+        global build_container
+        if os.path.exists(args.oh_path):
+            log_info(f"OpenHarmony source code path exists: {args.oh_path}")
+        else:
+            log_error(f"OpenHarmony source code path not found: {args.oh_path}")
+            log_error("Please provide the correct path to the OpenHarmony source code.")
+            sys.exit(1)
 
-    log_info("------ Running liscopelens ------", prefix="\n")
-    scancode_result_dir = args.oh_path.split(os.path.sep)[-1] + "-license"
-    log_info(scancode_result_dir)
-    run_in_venv(
-        VENV_DIR,
-        [
-            LICT_CMD,
-            "cpp",
-            "--gn_file",
-            gn_json_path,
-            "--scancode-dir",
-            scancode_result_dir,
-            "--ignore-unk",
-            *(["--shadow-license", args.shadow] if args.shadow and os.path.exists(args.shadow) else []),
-            "--output",
-            args.output
-        ],
+        if args.fix_line_endings or platform.system().lower() == "windows":
+            convert_line_endings_to_unix(args.oh_path, os.path.join(args.metrics_dir, "line-endings.json"))
+
+        log_info("------ Build OH in Docker ------", prefix="\n")
+        if args.persistent_container:
+            build_container = ensure_build_container(docker_image, args.oh_path)
+        if len(args.product_name) > 1 and (args.full_build or not gn_prebuilts_ready(args.oh_path)):
+            # Download the prebuilts once up front, concurrent downloads into one tree would clash.
+            run_command_with_timeout(
+                container_command("./build/prebuilts_download.sh", f"{docker_name}-prebuilts"),
+                description="Downloading prebuilts",
+                capture=OutputCapture.for_stage("prebuilts", log_dir),
+            )
+
+        # The products get their own out/<product> directory, only --batch_jobs runs them side by side.
+        with ThreadPoolExecutor(max_workers=build_jobs) as executor:
+            captures = dict(zip(args.product_name, executor.map(build_product, args.product_name)))
+        for product_name, build_capture in captures.items():
+            check_out_json(args.oh_path, product_name, docker_image, args, build_capture)
+        if build_container:
+            metrics.add("build", container=build_container, ccache=report_build_caches(build_container))
+
+    scan_command = [
+        "python",
+        "-m",
+        "utils.scan",
+        args.oh_path + os.path.sep,
+        "--product_name",
+        *args.product_name,
+        "--mode",
+        args.scan_mode,
+        "--cpus",
+        str(args.scan_cpus),
+        *(["--jobs", str(args.scan_jobs)] if args.scan_jobs else []),
+        *(["--incremental"] if args.incremental else []),
+        *(["--prune"] if args.prune else []),
+        *(["--compact"] if args.compact else []),
+        *(["--warm"] if args.warm_scancode else []),
+        *(["--prefilter"] if args.prefilter else []),
+        *(["--fastpath"] if args.fastpath else []),
+        *(["--fastpath_verify", str(args.fastpath_verify)] if args.fastpath_verify else []),
+        *(["--file_timeout", str(args.file_timeout)] if args.file_timeout else []),
+        *(["--target_timeout", str(args.target_timeout)] if args.target_timeout else []),
+        *(["--stall_timeout", str(args.stall_timeout)] if args.stall_timeout else []),
+        *(["--prefilter_config", args.prefilter_config] if args.prefilter_config else []),
+    ]
+
+    @pipeline.stage(
+        "scan",
+        inputs=lambda: {
+            # CPU budget, jobs and warm workers only change how fast the scan runs, not its results.
+            # The time limits decide which files end up with a fallback entry, the sample which are verified.
+            "options": [
+                sorted(args.product_name),
+                args.scan_mode,
+                args.incremental,
+                args.prune,
+                args.compact,
+                args.prefilter,
+                args.fastpath,
+                args.fastpath_verify,
+                args.file_timeout,
+                args.target_timeout,
+                args.stall_timeout,
+            ],
+            "prefilter_config": file_fingerprint(args.prefilter_config) if args.prefilter_config else None,
+            "scancode": file_fingerprint(os.path.join("scancode-toolkit", "setup.cfg")),
+        },
+        outputs=lambda: tree_fingerprint(scancode_result_dir, ".json"),
+        deps=["build"],
+    )
+    def scan_stage():
+        log_info("------ Running Scancode ------", prefix="\n")
+        log_info(args.oh_path + os.path.sep)
+        run_in_venv(VENV_DIR, [*scan_command, "--metrics", scan_metrics_path])
+        if os.path.exists(scan_metrics_path):
+            with open(scan_metrics_path, "r", encoding="utf-8") as f:
+                metrics.add("scan", scan=json.load(f))
+
+    @pipeline.stage(
+        "liscopelens",
+        inputs=lambda: {
+            "shadow": file_digest(args.shadow) if args.shadow and os.path.exists(args.shadow) else None,
+            "output": os.path.abspath(args.output),
+        },
+        outputs=lambda: tree_fingerprint(args.output),
+        deps=["build", "scan"],
     )
+    def liscopelens_stage():
+        log_info("------ Running liscopelens ------", prefix="\n")
+        log_info(scancode_result_dir)
+
+        def analyse(product_name):
+            # Every product reads the one shared scan, only the GN graph and the report differ.
+            run_in_venv(
+                VENV_DIR,
+                [
+                    LICT_CMD,
+                    "cpp",
+                    "--gn_file",
+                    gn_json_paths[product_name],
+                    "--scancode-dir",
+                    scancode_result_dir,
+                    "--ignore-unk",
+                    *(["--shadow-license", args.shadow] if args.shadow and os.path.exists(args.shadow) else []),
+                    "--output",
+                    args.output if len(args.product_name) == 1 else os.path.join(args.output, product_name)
+                ],
+            )
+
+        with ThreadPoolExecutor(max_workers=batch_jobs) as executor:
+            list(executor.map(analyse, args.product_name))
+
+    try:
+        pipeline.run()
+    finally:
+        if build_container and args.remove_container:
+            run_command_with_timeout(["sudo", "docker", "rm", "-f", build_container], description="Removing build container")
+    log_success(f"Run report written to {metrics.report_path}")
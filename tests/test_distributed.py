@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import textwrap
+import threading
+import subprocess
+from urllib.request import Request, urlopen
+
+import pytest
+
+from utils import distributed
+from utils.distributed import Coordinator, Worker
+from utils.planner import Shard
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A worker process whose scans take a while. Its lease renewals start late, as after a network hiccup.
+WORKER = textwrap.dedent(
+    """
+    import os
+    import sys
+    import json
+    import time
+    import threading
+
+    from utils import distributed
+    from utils.distributed import Worker
+
+
+    class Toolkit:
+        def __init__(self, tmp_path, seconds):
+            self.tmp_path = tmp_path
+            self.seconds = seconds
+
+        def scan_license(self, project_path, callback=None, prefix=None, files=None):
+            time.sleep(self.seconds)
+            output_path = os.path.join(self.tmp_path, "result.json")
+            os.makedirs(self.tmp_path, exist_ok=True)
+            with open(output_path, "w", encoding="utf-8") as f:
+                json.dump({"files": [os.path.relpath(file_path, prefix) for file_path in files]}, f)
+            return output_path, "", "", None
+
+
+    class LateWorker(Worker):
+        def _heartbeat(self, lease_id, interval, stop):
+            if not stop.wait(late):
+                super()._heartbeat(lease_id, interval, stop)
+
+
+    if __name__ == "__main__":
+        distributed.POLL_INTERVAL = 0.05
+        url, prefix, worker_id, scratch, seconds, late = sys.argv[1:]
+        late = float(late)
+        worker = LateWorker(Toolkit(scratch, float(seconds)), url, prefix, worker_id, give_up=2)
+        print(f"scanned {worker.run(log=lambda message: print(message, flush=True))}")
+    """
+)
+
+class FakeToolkit:
+    """Stands in for SCToolkit, a scan writes the scanned paths as its result."""
+
+    def __init__(self, tmp_path: str, barrier: threading.Barrier = None, hold: threading.Event = None) -> None:
+        self.tmp_path = tmp_path
+        self.barrier = barrier
+        self.hold = hold
+        self.leased = threading.Event()
+        self.first = threading.local()
+
+    def result_file(self, project_path: str, prefix: str) -> str:
+        return os.path.join(self.tmp_path, f"{os.path.relpath(project_path, prefix)}.json")
+
+    def shard_file(self, project_path: str, prefix: str, name: str) -> str:
+        return f"{self.result_file(project_path, prefix)}.shard-{name}"
+
+    def _scan(self, output_path: str, prefix: str, files: list[str]) -> tuple[str, str, str, dict]:
+        self.leased.set()
+        if self.hold is not None:
+            self.hold.wait(10)
+        if self.barrier is not None and not getattr(self.first, "done", False):
+            # Every worker takes its first shard before any finishes, so the work is shared.
+            self.first.done = True
+            self.barrier.wait(10)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump({"files": [os.path.relpath(file_path, prefix) for file_path in files]}, f)
+        return output_path, f"scanned {len(files)}\n", "", None
+
+    def scan_license(self, project_path: str, callback=None, prefix: str = None, files: list[str] = None):
+        return self._scan(self.result_file(project_path, prefix), prefix, files)
+
+    def scan_shard(self, project_path: str, prefix: str, files: list[str], name: str):
+        return self._scan(self.shard_file(project_path, prefix, name), prefix, files)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(distributed, "POLL_INTERVAL", 0.05)
+
+
+@pytest.fixture
+def shards(tmp_path):
+    prefix = str(tmp_path / "src")
+    target = lambda *parts: os.path.join(prefix, *parts)
+    return prefix, [
+        Shard(target("big"), [target("big", "a.c")], 30.0, 0, 2, "one"),
+        Shard(target("big"), [target("big", "b.c")], 30.0, 1, 2, "two"),
+        Shard(target("foundation", "x"), [target("foundation", "x", "x.c")], 20.0),
+        Shard(target("drivers"), [target("drivers", "d.c")], 10.0),
+    ]
+
+
+def start_worker(sct, coordinator, prefix, worker_id, **kwargs):
+    host, port = coordinator.address
+    worker = Worker(sct, f"http://127.0.0.1:{port}", prefix, worker_id, **kwargs)
+    scanned = {}
+    thread = threading.Thread(target=lambda: scanned.setdefault("count", worker.run(log=lambda message: None)))
+    thread.start()
+    return thread, scanned
+
+
+def test_two_workers_share_the_shards(tmp_path, shards):
+    prefix, shards = shards
+    coordinator = Coordinator(FakeToolkit(str(tmp_path / "results")), "127.0.0.1", 0)
+    barrier = threading.Barrier(2)
+    workers = [
+        start_worker(FakeToolkit(str(tmp_path / f"scratch-{i}"), barrier=barrier), coordinator, prefix, f"w{i}")
+        for i in range(2)
+    ]
+
+    dispatched = []
+    events = list(coordinator.run(shards, prefix, on_dispatch=dispatched.append))
+    for thread, _ in workers:
+        thread.join(10)
+
+    assert sorted(dispatched) == sorted(shards)
+    assert [error for _, _, _, error in events] == [None] * len(shards)
+    assert all(scanned["count"] >= 1 for _, scanned in workers)
+    assert sum(scanned["count"] for _, scanned in workers) == len(shards)
+    for shard, (output_path, stdout, _, _), _, _ in events:
+        with open(output_path, "r", encoding="utf-8") as f:
+            assert json.load(f)["files"] == [os.path.relpath(file_path, prefix) for file_path in shard.files]
+        assert stdout == "scanned 1\n"
+    assert os.path.exists(tmp_path / "results" / "big.json.shard-two")
+    # Workers upload their results and keep no copy.
+    assert not [names for i in range(2) for _, _, names in os.walk(tmp_path / f"scratch-{i}") if names]
+
+
+def test_expired_lease_goes_to_another_worker(tmp_path, shards):
+    prefix, shards = shards
+    coordinator = Coordinator(FakeToolkit(str(tmp_path / "results")), "127.0.0.1", 0, lease_timeout=0.3)
+    events = []
+    dispatched = []
+
+    def serve():
+        events.extend(coordinator.run(shards, prefix, on_dispatch=dispatched.append))
+
+    server = threading.Thread(target=serve)
+    server.start()
+
+    # The first worker takes the first shard, then hangs without renewing its lease.
+    hold = threading.Event()
+    stuck = FakeToolkit(str(tmp_path / "stuck"), hold=hold)
+    stuck_worker = Worker(stuck, f"http://127.0.0.1:{coordinator.address[1]}", prefix, "stuck", give_up=0.5)
+    stuck_worker._heartbeat = lambda lease_id, interval, stop: None
+    stuck_thread = threading.Thread(target=stuck_worker.run, kwargs={"log": lambda message: None}, daemon=True)
+    stuck_thread.start()
+    assert stuck.leased.wait(10)
+
+    thread, scanned = start_worker(FakeToolkit(str(tmp_path / "scratch")), coordinator, prefix, "healthy")
+    thread.join(10)
+    server.join(10)
+    hold.set()
+    stuck_thread.join(10)
+
+    assert scanned["count"] == len(shards)
+    assert sorted(shard for shard, _, _, _ in events) == sorted(shards)
+    assert [error for _, _, _, error in events] == [None] * len(shards)
+    assert coordinator.expiries == {0: 1}
+    # Leased twice, reported as dispatched once.
+    assert sorted(dispatched) == sorted(shards)
+
+
+def test_shard_fails_after_repeated_expiries(tmp_path, shards):
+    prefix, shards = shards
+    coordinator = Coordinator(FakeToolkit(str(tmp_path / "results")), "127.0.0.1", 0, lease_timeout=0.1, max_expiries=2)
+    events = []
+    server = threading.Thread(target=lambda: events.extend(coordinator.run(shards[:1], prefix)))
+    server.start()
+
+    def lease():
+        request = Request(
+            f"http://127.0.0.1:{coordinator.address[1]}/lease",
+            data=json.dumps({"worker": "ghost"}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+
+    for _ in range(2):
+        assert lease()["shard"]["target"] == "big"
+        time.sleep(0.3)
+    server.join(10)
+
+    assert len(events) == 1
+    shard, result, _, error = events[0]
+    assert shard == shards[0] and result is None
+    assert "lease expired 2 times, last held by ghost" in str(error)
+
+
+def test_workers_exit_once_told_all_is_done(tmp_path, shards):
+    prefix, shards = shards
+    script = tmp_path / "worker.py"
+    script.write_text(WORKER)
+    coordinator = Coordinator(FakeToolkit(str(tmp_path / "results")), "127.0.0.1", 0, lease_timeout=0.5)
+    events = []
+    server = threading.Thread(target=lambda: events.extend(coordinator.run(shards[3:], prefix)))
+    server.start()
+
+    def start(worker_id, seconds, late):
+        return subprocess.Popen(
+            [sys.executable, str(script), f"http://127.0.0.1:{coordinator.address[1]}", prefix, worker_id,
+             str(tmp_path / worker_id), str(seconds), str(late)],
+            cwd=ROOT,
+            env={**os.environ, "PYTHONPATH": ROOT},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+    # The late worker loses its lease before it renews, the other one takes over and finishes
+    # first. The late one is still scanning, the coordinator has to wait for it to come back.
+    workers = [start("late", 1.5, 0.7)]
+    deadline = time.monotonic() + 10
+    while not coordinator.leased and time.monotonic() < deadline:
+        time.sleep(0.01)
+    workers.append(start("other", 0.5, 0))
+    try:
+        outputs = [worker.communicate(timeout=20)[0] for worker in workers]
+    finally:
+        for worker in workers:
+            worker.kill()
+    server.join(10)
+
+    assert [worker.returncode for worker in workers] == [0, 0]
+    assert outputs[0].splitlines()[-1] == "scanned 1" and outputs[1].splitlines()[-1] == "scanned 1"
+    # Nobody ran into a coordinator that was already gone.
+    assert not any("error" in output or "unreachable" in output for output in outputs), outputs
+    assert coordinator.expiries == {0: 1}
+    assert [error for _, _, _, error in events] == [None]
@@ -0,0 +1,154 @@
+import os
+import io
+import json
+import hashlib
+import tarfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+
+import pytest
+
+from utils import downloader
+from utils.downloader import ChecksumError, fetch, probe
+
+
+SEGMENT = 1024
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """Serves the test directory. With ``ranged`` it answers range requests, and it can fail on purpose."""
+
+    ranged = False
+    fail_from = None
+    cut_once = set()
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        with open(path, "rb") as f:
+            data = f.read()
+        header = self.headers.get("Range")
+        type(self).requests.append(header)
+
+        if not self.ranged or header is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if header is None and self.path in self.cut_once:
+                # Drop the connection half way, once.
+                self.cut_once.discard(self.path)
+                self.wfile.write(data[: len(data) // 2])
+                return
+            self.wfile.write(data)
+            return
+
+        start, end = header[len("bytes="):].split("-")
+        start, end = int(start), min(int(end), len(data) - 1)
+        if self.fail_from is not None and start >= self.fail_from:
+            self.send_error(503)
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(data[start : end + 1])
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "SEGMENT_SIZE", SEGMENT)
+    monkeypatch.setattr(downloader, "BLOCK_SIZE", 256)
+    root = tmp_path / "www"
+    root.mkdir()
+
+    handler = type("TestHandler", (Handler,), {"cut_once": set(), "requests": []})
+    handler.__init__ = lambda self, *args, **kwargs: Handler.__init__(self, *args, directory=str(root), **kwargs)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, handler, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def publish(root, name: str, data: bytes) -> str:
+    (root / name).write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_ranged_download_resumes_missing_segments(tmp_path, server):
+    root, handler, base = server
+    data = os.urandom(5 * SEGMENT)
+    digest = publish(root, "tool.bin", data)
+    handler.ranged = True
+    handler.fail_from = 2 * SEGMENT
+    cache = tmp_path / "cache"
+
+    with pytest.raises(URLError):
+        fetch(f"{base}/tool.bin", str(cache), sha256=digest, connections=1)
+    with open(cache / "tool.bin.part.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["done"] == [0, 1]
+
+    assert probe(f"{base}/tool.bin") == (len(data), True)
+    handler.fail_from = None
+    handler.requests.clear()
+    path = fetch(f"{base}/tool.bin", str(cache), sha256=digest, connections=2)
+
+    with open(path, "rb") as f:
+        assert f.read() == data
+    # Only the probe and the segments that were missing are requested again.
+    assert sorted(handler.requests) == sorted(
+        ["bytes=0-0"] + [f"bytes={start}-{start + SEGMENT - 1}" for start in range(2 * SEGMENT, 5 * SEGMENT, SEGMENT)]
+    )
+    assert not os.path.exists(cache / "tool.bin.part") and not os.path.exists(cache / "tool.bin.part.json")
+    assert (cache / "tool.bin.sha256").read_text().strip() == digest
+
+
+def test_download_without_ranges_restarts(tmp_path, server):
+    root, handler, base = server
+    data = os.urandom(3 * SEGMENT)
+    digest = publish(root, "tool.bin", data)
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    # Left over from an interrupted ranged download, it can not be resumed without ranges.
+    (cache / "tool.bin.part").write_bytes(b"\0" * len(data))
+    (cache / "tool.bin.part.json").write_text(
+        json.dumps({"url": f"{base}/tool.bin", "size": len(data), "segment": SEGMENT, "done": [0, 1]})
+    )
+    handler.cut_once.add("/tool.bin")
+
+    assert probe(f"{base}/tool.bin") == (len(data), False)
+    path = fetch(f"{base}/tool.bin", str(cache), sha256=digest, connections=4)
+
+    with open(path, "rb") as f:
+        assert f.read() == data
+    # The stream cut off half way was fetched again from the start.
+    assert handler.requests.count(None) == 2
+
+
+def test_checksum_mismatch_leaves_nothing_behind(tmp_path, server):
+    root, handler, base = server
+    payload = io.BytesIO()
+    with tarfile.open(fileobj=payload, mode="w:gz") as tar:
+        content = os.urandom(4 * SEGMENT)
+        info = tarfile.TarInfo("tool/data.bin")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    actual = publish(root, "tool.tar.gz", payload.getvalue())
+    handler.ranged = True
+    cache = tmp_path / "cache"
+    dest = tmp_path / "tool"
+
+    with pytest.raises(ChecksumError, match=actual):
+        fetch(f"{base}/tool.tar.gz", str(cache), sha256="0" * 64, extract_to=str(dest))
+
+    assert os.listdir(cache) == []
+    assert not os.path.exists(dest) and not os.path.exists(f"{dest}.partial")
+
+    fetch(f"{base}/tool.tar.gz", str(cache), sha256=actual, extract_to=str(dest))
+    assert (dest / "tool" / "data.bin").read_bytes() == content
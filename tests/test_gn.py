@@ -0,0 +1,92 @@
+import io
+import json
+
+import pytest
+
+from utils.gn import _JsonStream, iter_targets
+
+
+# Escapes, non-ASCII text, every kind of number and the literals, in and between the targets.
+SAMPLE = json.dumps(
+    {
+        "build_settings": {"root_path": "/home/openharmony", "build_dir": "//out/rk3568/", "default_toolchain": "//build"},
+        "targets": {
+            "//base/hiviewdfx:log": {
+                "deps": ["//third_party/bounds_checking_function:libsec_shared", "//base/\"quoted\":x"],
+                "public_deps": [],
+                "sources": ["//base/hiviewdfx/log.c", "//base/café/中文.c", "//base/tab\there\\back/slash.c"],
+                "testonly": False,
+                "metadata": {"size": 123456789, "ratio": -0.125, "exponent": 1.5e-07, "big": 6.02e23, "none": None},
+            },
+            "//third_party/bounds_checking_function:libsec_shared": {
+                "deps": [],
+                "sources": ["//third_party/bounds_checking_function/src/memcpy_s.c"],
+                "escapes": "line\nbreak \u0001 control 😀 emoji \\u not an escape",
+                "testonly": True,
+                "count": 0,
+            },
+            "//empty:target": {},
+        },
+        "toolchains": {"//build": {"tools": {"cc": {"command": "clang -c {{source}} -o {{output}}"}}}},
+    },
+    indent=1,
+    ensure_ascii=False,
+)
+
+
+class SplitReader:
+    """File object returning ``text`` in the pieces between ``cuts``, the reader asks for more in between."""
+
+    def __init__(self, text: str, cuts: list[int]) -> None:
+        bounds = [0, *cuts, len(text)]
+        self.pieces = [text[start:end] for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def read(self, size: int = -1) -> str:
+        return self.pieces.pop(0) if self.pieces else ""
+
+
+def read_document(stream: _JsonStream) -> dict:
+    """Walk the top-level object member by member like ``iter_targets``, the targets one by one."""
+    document = {}
+    stream.expect("{")
+    for key in stream.members():
+        if key != "targets":
+            document[key] = stream.value()
+            continue
+        stream.expect("{")
+        document[key] = {}
+        for label in stream.members():
+            document[key][label] = stream.value()
+    assert stream.peek() == ""
+    return document
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64, 1024 * 1024])
+def test_stream_matches_json_load(chunk_size):
+    assert read_document(_JsonStream(io.StringIO(SAMPLE), chunk_size)) == json.loads(SAMPLE)
+
+
+def test_stream_splits_anywhere():
+    expected = json.loads(SAMPLE)
+    for cut in range(1, len(SAMPLE)):
+        assert read_document(_JsonStream(SplitReader(SAMPLE, [cut]))) == expected, SAMPLE[cut - 10 : cut + 10]
+
+
+@pytest.mark.parametrize("text", ["12345", "-0.125", "1.5e-07", "6.02E+23", '"a\\"b\\\\c"', '"\\u00e9\\ud83d\\ude00"', "true", "null"])
+def test_values_cut_at_every_position(text):
+    document = f'{{"value": {text}, "next": 1}}'
+    for cut in range(1, len(document)):
+        stream = _JsonStream(SplitReader(document, [cut]))
+        assert read_document(stream) == json.loads(document), document[:cut]
+
+
+def test_iter_targets_keeps_the_requested_fields(tmp_path):
+    gn_file = tmp_path / "out.json"
+    gn_file.write_text(SAMPLE, encoding="utf-8")
+
+    targets = dict(iter_targets(str(gn_file), ["deps", "sources"]))
+
+    expected = json.loads(SAMPLE)["targets"]
+    assert list(targets) == list(expected)
+    for label, target in targets.items():
+        assert target == {field: expected[label][field] for field in ("deps", "sources") if field in expected[label]}
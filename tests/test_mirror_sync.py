@@ -0,0 +1,106 @@
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("repo") is None or subprocess.run(["git", "lfs", "version"], capture_output=True).returncode != 0,
+    reason="needs the repo tool and git-lfs",
+)
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(remote: Path, name: str, branch: str, files: dict[str, str]) -> str:
+    """Add a commit with files to a branch of a bare repository, return its id."""
+    clone = remote.parent / "clones" / f"{name}-{branch}"
+    if not clone.exists():
+        git("clone", "-q", str(remote / f"{name}.git"), str(clone))
+    if branch in git("ls-remote", "--heads", "origin", cwd=clone):
+        git("checkout", "-q", "-B", branch, f"origin/{branch}", cwd=clone)
+    else:
+        git("checkout", "-q", "-B", branch, cwd=clone)
+    for path, content in files.items():
+        (clone / path).write_text(content)
+    git("add", "-A", cwd=clone)
+    git("commit", "-q", "-m", f"update {branch}", cwd=clone)
+    git("push", "-q", "origin", f"HEAD:refs/heads/{branch}", cwd=clone)
+    return git("rev-parse", "HEAD", cwd=clone)
+
+
+def manifest(remote: Path, revision: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<manifest>\n'
+        f'  <remote name="origin" fetch="file://{remote}"/>\n'
+        f'  <default remote="origin" revision="{revision}"/>\n'
+        '  <project name="base" path="base"/>\n'
+        '  <project name="drivers" path="drivers"/>\n'
+        "</manifest>\n"
+    )
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".gitconfig").write_text("[user]\n\tname = Test\n\temail = test@example.com\n[color]\n\tui = false\n")
+    monkeypatch.setenv("HOME", str(home))
+    # run.py logs to setup.log in the working directory.
+    monkeypatch.chdir(tmp_path)
+
+    remote = tmp_path / "remote"
+    for name in ("manifest", "base", "drivers"):
+        git("init", "-q", "--bare", "-b", "master", str(remote / f"{name}.git"))
+    for name in ("base", "drivers"):
+        commit(remote, name, "master", {"README": f"{name} master\n"})
+    commit(remote, "manifest", "master", {"default.xml": manifest(remote, "master")})
+    commit(remote, "manifest", "release", {"default.xml": manifest(remote, "release")})
+    for name in ("base", "drivers"):
+        commit(remote, name, "release", {"README": f"{name} release\n"})
+    return remote
+
+
+def sync(workdir: Path, remote: Path, mirror: Path, **kwargs) -> None:
+    from run import repo_sync_script
+
+    workdir.mkdir(exist_ok=True)
+    script = repo_sync_script(
+        str(workdir), manifest_url=f"file://{remote}/manifest.git", mirror=str(mirror), jobs=2, lfs_jobs=2, **kwargs
+    )
+    subprocess.run(["bash", "-c", script], check=True, capture_output=True, text=True)
+
+
+def test_branches_share_the_mirror(tmp_path, remote):
+    mirror = tmp_path / "mirror"
+
+    sync(tmp_path / "master", remote, mirror, branch="master")
+    assert (tmp_path / "master" / "base" / "README").read_text() == "base master\n"
+    assert (mirror / "base.git").is_dir() and (mirror / "drivers.git").is_dir()
+
+    release = commit(remote, "base", "release", {"README": "base release 2\n"})
+    sync(tmp_path / "release", remote, mirror, branch="release")
+    assert (tmp_path / "release" / "base" / "README").read_text() == "base release 2\n"
+    assert (tmp_path / "release" / "drivers" / "README").read_text() == "drivers release\n"
+    # The mirror was refreshed before the second checkout cloned from it.
+    git("cat-file", "-e", release, cwd=mirror / "base.git")
+
+    # --dissociate: the checkouts own their objects, the mirror can go away.
+    shutil.rmtree(mirror)
+    for tree in ("master", "release"):
+        git("fsck", "-q", cwd=tmp_path / tree / "base")
+
+
+def test_update_syncs_an_existing_tree(tmp_path, remote):
+    mirror = tmp_path / "mirror"
+    sync(tmp_path / "tree", remote, mirror, branch="master")
+
+    update = commit(remote, "drivers", "master", {"README": "drivers master 2\n"})
+    sync(tmp_path / "tree", remote, mirror, init=False)
+
+    assert (tmp_path / "tree" / "drivers" / "README").read_text() == "drivers master 2\n"
+    assert git("rev-parse", "HEAD", cwd=tmp_path / "tree" / "drivers") == update
+    git("cat-file", "-e", update, cwd=mirror / "drivers.git")
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+import textwrap
+
+import pytest
+
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="process groups are POSIX only")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A scan whose pool workers each start a shell with a child of its own, both record their pid.
+SCAN = textwrap.dedent(
+    """
+    import os
+    import sys
+
+    from utils.planner import Shard
+    from utils.scheduler import ScanScheduler
+    from utils.supervisor import forward_signals, get_supervisor
+
+
+    class Toolkit:
+        def __init__(self, pid_dir):
+            self.pid_dir = pid_dir
+
+        def scan_license(self, project_path, callback=None, prefix=None, files=None):
+            name = os.path.basename(project_path)
+            script = f"sleep 60 & echo $! > {self.pid_dir}/{name}.child; echo $$ > {self.pid_dir}/{name}.shell; wait"
+            get_supervisor().run(script, shell=True).check()
+            return None, "", "", None
+
+
+    if __name__ == "__main__":
+        forward_signals()
+        pid_dir = sys.argv[1]
+        shards = [Shard(os.path.join(pid_dir, name), None, 1.0) for name in ("a", "b")]
+        for _ in ScanScheduler(Toolkit(pid_dir), jobs=2).run(shards, pid_dir):
+            pass
+    """
+)
+
+
+def alive(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+def wait_for(condition, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+@pytest.mark.parametrize("signum", [signal.SIGINT, signal.SIGTERM])
+def test_interrupted_scan_leaves_no_children(tmp_path, signum):
+    script = tmp_path / "scan.py"
+    script.write_text(SCAN)
+    pid_files = [tmp_path / f"{name}.{kind}" for name in ("a", "b") for kind in ("shell", "child")]
+
+    # A session of its own, the signal goes to its process group like a Ctrl-C in a terminal.
+    scan = subprocess.Popen(
+        [sys.executable, str(script), str(tmp_path)],
+        cwd=ROOT,
+        env={**os.environ, "PYTHONPATH": ROOT},
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        assert wait_for(lambda: all(path.exists() and path.read_text().strip() for path in pid_files))
+        pids = [int(path.read_text()) for path in pid_files]
+
+        os.killpg(scan.pid, signum)
+        scan.wait(30)
+        assert wait_for(lambda: not any(alive(pid) for pid in pids), 5), [pid for pid in pids if alive(pid)]
+    finally:
+        if scan.poll() is None:
+            os.killpg(scan.pid, signal.SIGKILL)
+        for path in pid_files:
+            if path.exists() and path.read_text().strip():
+                try:
+                    os.killpg(int(path.read_text()), signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    pass
@@ -0,0 +1,83 @@
+import os
+import re
+import gzip
+import threading
+from collections import deque
+
+
+LOG_DIR = "logs"
+DEFAULT_TAIL_LINES = 200
+
+
+class OutputCapture:
+    """Keep the last lines of a command's output in memory and stream all of it to a gzip log.
+
+    Memory stays at ``tail_lines`` lines however much the command prints, the complete output
+    is only on disk and can be searched with ``grep``.
+
+    Args:
+        log_path: gzip file the full output is written to, ``None`` keeps only the tail.
+        tail_lines: Number of most recent lines kept in memory.
+    """
+
+    def __init__(self, log_path: str = None, tail_lines: int = DEFAULT_TAIL_LINES) -> None:
+        self.log_path = log_path
+        self.lines = deque(maxlen=tail_lines)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.fp = None
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self.fp = gzip.open(log_path, "wt", encoding="utf-8", errors="replace")
+
+    @classmethod
+    def for_stage(cls, stage: str, log_dir: str = LOG_DIR, tail_lines: int = DEFAULT_TAIL_LINES) -> "OutputCapture":
+        """Capture whose full log goes to ``<log_dir>/<stage>.log.gz``."""
+        return cls(os.path.join(log_dir, f"{stage}.log.gz"), tail_lines)
+
+    def write(self, line: str) -> None:
+        with self.lock:
+            self.lines.append(line)
+            self.count += 1
+            if self.fp is not None:
+                self.fp.write(line)
+
+    def tail(self, n: int = None) -> list[str]:
+        """Return the last ``n`` lines, all kept lines by default."""
+        with self.lock:
+            lines = list(self.lines)
+        return lines if n is None else lines[-n:]
+
+    def grep(self, pattern: str, max_count: int = None) -> list[str]:
+        """Return the lines of the full output matching the regular expression ``pattern``."""
+        regex = re.compile(pattern)
+        if self.fp is None:
+            return [line for line in self.tail() if regex.search(line)][:max_count]
+
+        with self.lock:
+            if not self.fp.closed:
+                self.fp.flush()
+
+        matches = []
+        with gzip.open(self.log_path, "rt", encoding="utf-8", errors="replace") as f:
+            try:
+                for line in f:
+                    if regex.search(line):
+                        matches.append(line)
+                        if max_count is not None and len(matches) >= max_count:
+                            break
+            except EOFError:
+                # The log is still being written, everything up to the last flush was read.
+                pass
+        return matches
+
+    def close(self) -> None:
+        with self.lock:
+            if self.fp is not None and not self.fp.closed:
+                self.fp.close()
+
+    def __enter__(self) -> "OutputCapture":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,420 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import queue
+import socket
+import threading
+from collections import deque
+from urllib.request import Request, urlopen
+from urllib.error import URLError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_LEASE_TIMEOUT = 600
+DEFAULT_MAX_EXPIRIES = 3
+POLL_INTERVAL = 5
+
+
+def shard_to_wire(shard, prefix: str) -> dict:
+    """Serialize a shard with paths relative to the source root, workers may mount it elsewhere."""
+    rel = lambda path: os.path.relpath(path, prefix).replace(os.sep, "/")
+    return {
+        "target": rel(shard.target),
+        "files": None if shard.files is None else [rel(file_path) for file_path in shard.files],
+        "cost": shard.cost,
+        "index": shard.index,
+        "count": shard.count,
+        "name": shard.name,
+    }
+
+
+def shard_from_wire(data: dict, prefix: str):
+    from .planner import Shard
+
+    local = lambda rel: os.path.join(prefix, *rel.split("/"))
+    return Shard(
+        local(data["target"]),
+        None if data["files"] is None else [local(rel) for rel in data["files"]],
+        data["cost"],
+        data["index"],
+        data["count"],
+        data["name"],
+    )
+
+
+class Coordinator:
+    """Hand out scan shards to remote workers over HTTP and collect their results.
+
+    Workers lease one shard at a time and renew the lease while scanning, a lease that is not
+    renewed within ``lease_timeout`` goes back to the front of the queue for another worker.
+    A late result for a shard that was reassigned meanwhile is still accepted if it arrives
+    first. ``run`` yields the same ``(shard, result, seconds, error)`` tuples as
+    ``ScanScheduler.run`` so it is a drop-in replacement for the local process pool.
+
+    Endpoints, all ``POST`` with JSON bodies:
+        ``/lease``    ``{"worker"}`` -> ``{"lease", "shard", "lease_timeout"}``, ``{"shard": null, "done"}``
+        ``/renew``    ``{"lease", "worker"}`` -> ``{"ok"}``
+        ``/complete`` ``{"lease", "seconds", "stdout", "stderr", "fastpath"}`` header plus the gzip result JSON
+        ``/fail``     ``{"lease", "error"}``
+
+    Args:
+        sct: Toolkit whose result paths the uploaded results are written to.
+        host: Address to listen on.
+        port: Port to listen on, ``0`` picks a free one.
+        lease_timeout: Seconds a lease stays valid without renewal.
+        max_expiries: Expired leases after which a shard is reported as failed.
+    """
+
+    def __init__(
+        self,
+        sct,
+        host: str = "0.0.0.0",
+        port: int = 8765,
+        lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+        max_expiries: int = DEFAULT_MAX_EXPIRIES,
+    ) -> None:
+        self.sct = sct
+        self.lease_timeout = lease_timeout
+        self.max_expiries = max_expiries
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+        self.shards = []
+        self.prefix = None
+        self.todo = deque()
+        self.leases = {}
+        self.issued = {}
+        self.expiries = {}
+        self.closed = set()
+        self.leased = set()
+        self.dispatched = queue.Queue()
+        # Worker -> (last request, whether it was holding a shard then), and the workers told that all is done.
+        self.seen = {}
+        self.released = set()
+        self.drained = threading.Condition(self.lock)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+
+    def _handler(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    if self.path == "/complete":
+                        meta = json.loads(self.headers["X-Scan-Meta"])
+                        response = coordinator.complete(meta, gzip.decompress(body))
+                    else:
+                        request = json.loads(body or b"{}")
+                        action = {"/lease": coordinator.lease, "/renew": coordinator.renew, "/fail": coordinator.fail}[self.path]
+                        response = action(request)
+                    status = 200
+                except KeyError:
+                    response, status = {"error": f"unknown endpoint {self.path}"}, 404
+                except Exception as e:
+                    response, status = {"error": str(e)}, 500
+
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def lease(self, request: dict) -> dict:
+        with self.lock:
+            worker = request.get("worker")
+            self._reap()
+            if not self.todo:
+                self.seen[worker] = (time.monotonic(), False)
+                done = len(self.closed) == len(self.shards)
+                if done:
+                    self.released.add(worker)
+                    self.drained.notify_all()
+                return {"shard": None, "done": done}
+            self.seen[worker] = (time.monotonic(), True)
+            shard_id = self.todo.popleft()
+            if shard_id not in self.leased:
+                self.leased.add(shard_id)
+                self.dispatched.put(self.shards[shard_id])
+            lease_id = uuid.uuid4().hex
+            self.issued[lease_id] = shard_id
+            self.leases[lease_id] = [shard_id, worker, time.monotonic() + self.lease_timeout]
+            return {
+                "lease": lease_id,
+                "shard": shard_to_wire(self.shards[shard_id], self.prefix),
+                "lease_timeout": self.lease_timeout,
+            }
+
+    def renew(self, request: dict) -> dict:
+        with self.lock:
+            # Also for an expired lease, the worker is alive and will come back for the next shard.
+            self.seen[request.get("worker")] = (time.monotonic(), True)
+            lease = self.leases.get(request["lease"])
+            if lease is None:
+                return {"ok": False}
+            lease[2] = time.monotonic() + self.lease_timeout
+            return {"ok": True}
+
+    def complete(self, meta: dict, result: bytes) -> dict:
+        with self.lock:
+            shard_id = self._settle(meta["lease"])
+            if shard_id is None:
+                return {"ok": False, "reason": "shard already settled"}
+            shard = self.shards[shard_id]
+
+        if shard.count > 1:
+            output_path = self.sct.shard_file(shard.target, self.prefix, shard.name)
+        else:
+            output_path = self.sct.result_file(shard.target, self.prefix)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(f"{output_path}.tmp", "wb") as f:
+            f.write(result)
+        os.replace(f"{output_path}.tmp", output_path)
+
+        result = (output_path, meta.get("stdout", ""), meta.get("stderr", ""), meta.get("fastpath"))
+        self.events.put((shard, result, meta.get("seconds"), None))
+        return {"ok": True}
+
+    def fail(self, request: dict) -> dict:
+        with self.lock:
+            shard_id = self._settle(request["lease"])
+        if shard_id is not None:
+            error = RuntimeError(f"worker failed: {request.get('error')}")
+            self.events.put((self.shards[shard_id], None, None, error))
+        return {"ok": True}
+
+    def _settle(self, lease_id: str) -> int | None:
+        """Close the shard of a lease, even an expired one, ``None`` if it was closed already."""
+        self.leases.pop(lease_id, None)
+        shard_id = self.issued.get(lease_id)
+        if shard_id is None or shard_id in self.closed:
+            return None
+        self.closed.add(shard_id)
+        if shard_id in self.todo:
+            self.todo.remove(shard_id)
+        for other in [key for key, value in self.leases.items() if value[0] == shard_id]:
+            del self.leases[other]
+        return shard_id
+
+    def _reap(self) -> None:
+        now = time.monotonic()
+        for lease_id, (shard_id, worker, deadline) in list(self.leases.items()):
+            if deadline > now:
+                continue
+            del self.leases[lease_id]
+            self.expiries[shard_id] = self.expiries.get(shard_id, 0) + 1
+            if self.expiries[shard_id] >= self.max_expiries:
+                self.closed.add(shard_id)
+                error = RuntimeError(f"lease expired {self.expiries[shard_id]} times, last held by {worker}")
+                self.events.put((self.shards[shard_id], None, None, error))
+            else:
+                self.todo.appendleft(shard_id)
+
+    def _drain(self) -> None:
+        """Keep serving until every worker that asked for a shard was told that all are done.
+
+        A worker that stays silent longer than it would while alive counts as gone: idle ones
+        poll every ``POLL_INTERVAL``, one still scanning a reassigned shard renews its lease.
+        """
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                deadlines = [
+                    seen + (self.lease_timeout if busy else 3 * POLL_INTERVAL)
+                    for worker, (seen, busy) in self.seen.items()
+                    if worker not in self.released
+                ]
+                deadlines = [deadline for deadline in deadlines if deadline > now]
+                if not deadlines:
+                    return
+                self.drained.wait(min(deadlines) - now)
+
+    def run(self, shards: list, prefix: str, on_dispatch: callable = None):
+        """Serve ``shards`` until every one is settled, yield ``(shard, result, seconds, error)``.
+
+        The server then stays up until the workers learnt that they can exit, see ``_drain``.
+        ``on_dispatch`` is called from this generator's thread with each shard after its first lease.
+        """
+
+        def report_dispatched():
+            while on_dispatch is not None and not self.dispatched.empty():
+                on_dispatch(self.dispatched.get())
+
+        with self.lock:
+            self.shards = list(shards)
+            self.prefix = prefix
+            self.todo = deque(range(len(self.shards)))
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            for _ in range(len(self.shards)):
+                while True:
+                    report_dispatched()
+                    try:
+                        event = self.events.get(timeout=POLL_INTERVAL)
+                        report_dispatched()
+                        yield event
+                        break
+                    except queue.Empty:
+                        with self.lock:
+                            self._reap()
+            self._drain()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class Worker:
+    """Lease shards from a coordinator, scan them locally and upload the results.
+
+    The worker needs the same source tree as the coordinator, mounted at ``prefix``.
+
+    Args:
+        sct: Toolkit used to scan, its result directory only holds the worker's scratch results.
+        url: Base URL of the coordinator, e.g. ``http://build-01:8765``.
+        prefix: Source root on this host.
+        worker_id: Name reported to the coordinator.
+        give_up: Seconds the coordinator may be unreachable before the worker exits.
+    """
+
+    def __init__(self, sct, url: str, prefix: str, worker_id: str = None, give_up: float = 300) -> None:
+        self.sct = sct
+        self.url = url.rstrip("/")
+        self.prefix = prefix
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.give_up = give_up
+
+    def _post(self, endpoint: str, payload: dict = None, data: bytes = None, headers: dict = None) -> dict:
+        body = data if data is not None else json.dumps(payload or {}).encode("utf-8")
+        request = Request(f"{self.url}{endpoint}", data=body, headers=headers or {"Content-Type": "application/json"})
+        with urlopen(request, timeout=600) as response:
+            return json.loads(response.read())
+
+    def _heartbeat(self, lease_id: str, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            try:
+                self._post("/renew", {"lease": lease_id, "worker": self.worker_id})
+            except (URLError, OSError):
+                pass
+
+    def run(self, log=print) -> int:
+        """Work until the coordinator reports all shards done, return the number of shards scanned."""
+        scanned = 0
+        unreachable_since = None
+        while True:
+            try:
+                response = self._post("/lease", {"worker": self.worker_id})
+                unreachable_since = None
+            except (URLError, OSError) as e:
+                unreachable_since = unreachable_since or time.monotonic()
+                if time.monotonic() - unreachable_since > self.give_up:
+                    log(f"coordinator unreachable for {self.give_up}s, exiting: {e}")
+                    return scanned
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            if response["shard"] is None:
+                if response.get("done"):
+                    return scanned
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            lease_id = response["lease"]
+            shard = shard_from_wire(response["shard"], self.prefix)
+            log(f"leased {response['shard']['target']} (shard {shard.index + 1}/{shard.count})")
+
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(lease_id, response["lease_timeout"] / 3, stop), daemon=True
+            )
+            heartbeat.start()
+            start = time.monotonic()
+            try:
+                if shard.count > 1:
+                    output_path, stdout, stderr, fastpath = self.sct.scan_shard(
+                        shard.target, self.prefix, shard.files, shard.name
+                    )
+                else:
+                    output_path, stdout, stderr, fastpath = self.sct.scan_license(
+                        shard.target, prefix=self.prefix, files=shard.files
+                    )
+                with open(output_path, "rb") as f:
+                    result = gzip.compress(f.read())
+                os.remove(output_path)
+                meta = {
+                    "lease": lease_id,
+                    "seconds": time.monotonic() - start,
+                    "stdout": stdout[-4096:],
+                    "stderr": stderr[-4096:],
+                    "fastpath": fastpath,
+                }
+                self._post(
+                    "/complete",
+                    data=result,
+                    headers={"Content-Type": "application/gzip", "X-Scan-Meta": json.dumps(meta)},
+                )
+                scanned += 1
+            except Exception as e:
+                log(f"error: {e}")
+                try:
+                    self._post("/fail", {"lease": lease_id, "error": str(e)})
+                except (URLError, OSError):
+                    pass
+            finally:
+                stop.set()
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import tempfile
+
+    from .scan import SCAN_OPTIONS, SCToolkit
+    from .fastpath import HeaderClassifier
+    from .supervisor import forward_signals
+    from .quarantine import Quarantine
+    from .scan_cache import ScanCache
+
+    parser = argparse.ArgumentParser(description="Scan worker leasing targets from a `python -m utils.scan --coordinator` run")
+    parser.add_argument("coordinator", help="coordinator URL, e.g. http://build-01:8765")
+    parser.add_argument("prefix", help="source root on this host, the same tree the coordinator scans")
+    parser.add_argument("--n", type=int, default=os.cpu_count(), help="scancode processes")
+    parser.add_argument("--scancode", default="./scancode-toolkit", help="scancode-toolkit directory")
+    parser.add_argument("--cache", help="per-file scan result cache on this host")
+    parser.add_argument("--warm", action="store_true", help="keep a warm scancode worker")
+    parser.add_argument("--fastpath", action="store_true", help="resolve clearly tagged files without scancode")
+    parser.add_argument("--file_timeout", type=float, help="seconds scancode may spend on one file")
+    parser.add_argument("--target_timeout", type=float, help="seconds one scancode run may take before it is killed")
+    parser.add_argument("--stall_timeout", type=float, help="kill a scancode run when no file finished for this long")
+    parser.add_argument("--quarantine", help="directory of the persistent quarantine list on this host")
+    parser.add_argument("--worker_id", help="name reported to the coordinator")
+    args = parser.parse_args()
+    if args.warm and args.stall_timeout:
+        parser.error("--stall_timeout needs per-file progress and can not be combined with --warm")
+    forward_signals()
+
+    with tempfile.TemporaryDirectory(prefix="scan-worker-") as scratch:
+        sct = SCToolkit(
+            args.scancode,
+            os.path.join(scratch, "results"),
+            args.n,
+            warm=args.warm,
+            fastpath=HeaderClassifier() if args.fastpath else None,
+            file_timeout=args.file_timeout,
+            target_timeout=args.target_timeout,
+            stall_timeout=args.stall_timeout,
+            quarantine=Quarantine(args.quarantine) if args.quarantine else None,
+        )
+        if args.cache:
+            sct.cache = ScanCache(args.cache, namespace=f"{sct.version} {SCAN_OPTIONS}")
+        worker = Worker(sct, args.coordinator, args.prefix, args.worker_id)
+        print(f"worker {worker.worker_id} scanned {worker.run()} shard(s)")
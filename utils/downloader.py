@@ -0,0 +1,327 @@
+import io
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import threading
+from http.client import HTTPException
+from urllib.request import Request, urlopen
+from urllib.error import URLError, HTTPError
+
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "LISCOPELENS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "liscopelens-one-click")
+)
+DEFAULT_CONNECTIONS = 4
+SEGMENT_SIZE = 8 * 1024**2
+BLOCK_SIZE = 256 * 1024
+RETRIES = 3
+
+
+class ChecksumError(ValueError):
+    """Raised when a downloaded artifact does not match its pinned SHA-256."""
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def probe(url: str) -> tuple[int | None, bool]:
+    """Return ``(size or None, whether the server honours range requests)``."""
+    with urlopen(Request(url, headers={"Range": "bytes=0-0"}), timeout=60) as response:
+        content_range = response.headers.get("Content-Range", "")
+        if response.status == 206 and "/" in content_range and not content_range.endswith("/*"):
+            return int(content_range.rsplit("/", 1)[1]), True
+        length = response.headers.get("Content-Length")
+        return (int(length) if length else None), False
+
+
+class _Download:
+    """One artifact being fetched into ``<path>.part``, segment by segment over several connections.
+
+    Finished segments are recorded in ``<path>.part.json`` so an interrupted download resumes
+    with the missing ones. Readers get the bytes in order as soon as they are on disk, which is
+    what lets a tarball be verified and extracted while it is still coming in.
+    """
+
+    def __init__(
+        self, url: str, path: str, connections: int, progress: callable = None, probed: tuple[int | None, bool] = None
+    ) -> None:
+        self.url = url
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.state_path = f"{path}.part.json"
+        self.connections = connections
+        self.progress = progress or (lambda advance: None)
+        self.size, ranged = probed if probed is not None else probe(url)
+
+        if self.size is None or not ranged:
+            # Without ranges there is one stream, a partial file can not be resumed.
+            self.segments = [(0, None)]
+            done = set()
+            self.connections = 1
+        else:
+            self.segments = [
+                (start, min(start + SEGMENT_SIZE, self.size)) for start in range(0, self.size, SEGMENT_SIZE)
+            ]
+            done = self._load_state()
+
+        if not done or not os.path.exists(self.part_path):
+            done = set()
+            with open(self.part_path, "wb") as f:
+                if self.size:
+                    f.truncate(self.size)
+        self.done = done
+        self.filled = [(end - start) if i in done else 0 for i, (start, end) in enumerate(self.segments)]
+        self.failed = None
+        self.condition = threading.Condition()
+        self.next_segment = 0
+        self.progress(sum(self.filled))
+
+    def _load_state(self) -> set[int]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if state.get("url") != self.url or state.get("size") != self.size or state.get("segment") != SEGMENT_SIZE:
+            return set()
+        return set(state["done"])
+
+    def _save_state(self) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "size": self.size, "segment": SEGMENT_SIZE, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _claim(self) -> int | None:
+        # Segments are handed out in order so the reader is never far behind the writers.
+        with self.condition:
+            while self.next_segment < len(self.segments) and self.next_segment in self.done:
+                self.next_segment += 1
+            if self.next_segment >= len(self.segments) or self.failed is not None:
+                return None
+            self.next_segment += 1
+            return self.next_segment - 1
+
+    def _fetch_segment(self, index: int) -> None:
+        start, end = self.segments[index]
+        headers = {} if end is None else {"Range": f"bytes={start}-{end - 1}"}
+        with urlopen(Request(self.url, headers=headers), timeout=60) as response, open(self.part_path, "r+b") as f:
+            if end is not None and response.status != 206:
+                raise URLError(f"server ignored the range request for {self.url}")
+            f.seek(start)
+            with self.condition:
+                self.filled[index] = 0
+            for block in iter(lambda: response.read(BLOCK_SIZE), b""):
+                f.write(block)
+                f.flush()
+                with self.condition:
+                    self.filled[index] += len(block)
+                    self.condition.notify_all()
+                self.progress(len(block))
+        if end is not None and self.filled[index] != end - start:
+            raise URLError(f"short read on bytes {start}-{end - 1} of {self.url}")
+        # A stream without ranges that breaks off just ends, its announced size tells.
+        if end is None and self.size is not None and self.filled[index] != self.size:
+            raise URLError(f"short read, {self.filled[index]} of {self.size} bytes of {self.url}")
+
+    def _worker(self) -> None:
+        while (index := self._claim()) is not None:
+            for attempt in range(RETRIES):
+                try:
+                    self._fetch_segment(index)
+                    break
+                except (URLError, HTTPError, HTTPException, OSError) as e:
+                    self.progress(-self.filled[index])
+                    if attempt == RETRIES - 1:
+                        with self.condition:
+                            self.failed = e
+                            self.condition.notify_all()
+                        return
+            with self.condition:
+                self.done.add(index)
+                if self.segments[index][1] is not None:
+                    self._save_state()
+                self.condition.notify_all()
+
+    def start(self) -> list[threading.Thread]:
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def wait_bytes(self, position: int) -> int:
+        """Block until the byte at ``position`` is on disk, return how many bytes from there are, 0 at the end."""
+        with self.condition:
+            while True:
+                if self.failed is not None:
+                    raise self.failed
+                for index, (start, end) in enumerate(self.segments):
+                    if end is None or position < end:
+                        break
+                else:
+                    return 0
+                available = start + self.filled[index] - position
+                if available > 0:
+                    return available
+                if end is None and index in self.done:
+                    return 0
+                self.condition.wait()
+
+
+class _StreamReader(io.RawIOBase):
+    """Sequential view of a download in progress that hashes everything it hands out."""
+
+    def __init__(self, download: _Download) -> None:
+        self.download = download
+        self.position = 0
+        self.digest = hashlib.sha256()
+        # Unbuffered, a read-ahead buffer would hold bytes of segments that were not written yet.
+        self.file = open(download.part_path, "rb", buffering=0)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        available = self.download.wait_bytes(self.position)
+        if available == 0:
+            return 0
+        self.file.seek(self.position)
+        data = self.file.read(min(len(buffer), available))
+        buffer[: len(data)] = data
+        self.digest.update(data)
+        self.position += len(data)
+        return len(data)
+
+    def drain(self) -> None:
+        while self.read(BLOCK_SIZE):
+            pass
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+
+def _extract_tar(tar: tarfile.TarFile, dest: str) -> None:
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(dest, filter="data")
+    else:
+        tar.extractall(dest)
+
+
+def fetch(
+    url: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    sha256: str = None,
+    connections: int = DEFAULT_CONNECTIONS,
+    progress: callable = None,
+    extract_to: str = None,
+    probed: tuple[int | None, bool] = None,
+) -> str:
+    """Download ``url`` into ``cache_dir`` once and return the cached path.
+
+    The artifact is fetched with up to ``connections`` parallel range requests and resumes
+    after an interruption. It is checked against ``sha256``. Without a pin the digest of the
+    first download is recorded and later cache hits are checked against that. With
+    ``extract_to`` a ``.tar.gz`` is unpacked while it downloads into a temporary directory that
+    only takes its final name once the checksum matched. Zip archives are extracted after the
+    download.
+
+    Args:
+        progress: Called with the number of bytes gained, negative when a segment is retried.
+        probed: Result of an earlier ``probe(url)``, the server is not asked again.
+
+    Raises:
+        ChecksumError: If the artifact does not match its pinned or recorded digest.
+        URLError: If the download failed after retries.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, os.path.basename(url.split("?", 1)[0]))
+    digest_path = f"{path}.sha256"
+
+    if os.path.exists(path):
+        recorded = None
+        if os.path.exists(digest_path):
+            with open(digest_path, "r", encoding="utf-8") as f:
+                recorded = f.read().strip()
+        actual = _sha256_file(path)
+        if (sha256 or recorded) in (None, actual):
+            if extract_to is not None:
+                extract(path, extract_to)
+            return path
+        os.remove(path)
+
+    download = _Download(url, path, connections, progress, probed)
+    threads = download.start()
+    reader = _StreamReader(download)
+    staging = f"{extract_to}.partial" if extract_to is not None else None
+    try:
+        if staging is not None and path.endswith((".tar.gz", ".tgz")):
+            shutil.rmtree(staging, ignore_errors=True)
+            with tarfile.open(fileobj=reader, mode="r|gz") as tar:
+                _extract_tar(tar, staging)
+        reader.drain()
+    except BaseException as e:
+        # Stop handing out segments, the ones on disk stay recorded for the next attempt.
+        with download.condition:
+            download.failed = download.failed or e
+        raise
+    finally:
+        reader.close()
+        for thread in threads:
+            thread.join()
+    if download.failed is not None:
+        raise download.failed
+
+    actual = reader.digest.hexdigest()
+    if sha256 is not None and actual != sha256.lower():
+        os.remove(download.part_path)
+        if os.path.exists(download.state_path):
+            os.remove(download.state_path)
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+        raise ChecksumError(f"{url}: expected sha256 {sha256}, got {actual}")
+
+    os.replace(download.part_path, path)
+    if os.path.exists(download.state_path):
+        os.remove(download.state_path)
+    with open(digest_path, "w", encoding="utf-8") as f:
+        f.write(actual + "\n")
+
+    if staging is not None and os.path.isdir(staging):
+        _publish(staging, extract_to)
+    elif extract_to is not None:
+        extract(path, extract_to)
+    return path
+
+
+def extract(path: str, dest: str) -> None:
+    """Extract a cached archive into ``dest`` through a temporary directory."""
+    staging = f"{dest}.partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path, "r") as zip_ref:
+            zip_ref.extractall(staging)
+    else:
+        with tarfile.open(path, "r:*") as tar:
+            _extract_tar(tar, staging)
+    _publish(staging, dest)
+
+
+def _publish(staging: str, dest: str) -> None:
+    os.makedirs(dest, exist_ok=True)
+    for name in os.listdir(staging):
+        target = os.path.join(dest, name)
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        elif os.path.lexists(target):
+            os.remove(target)
+        os.replace(os.path.join(staging, name), target)
+    os.rmdir(staging)
@@ -0,0 +1,297 @@
+import os
+import re
+import json
+from typing import Iterable, Iterator
+
+
+FILE_FIELDS = ("sources", "public", "inputs")
+DEP_FIELDS = ("deps", "public_deps")
+DEFAULT_ROOT_PATTERN = re.compile(r"^//build/ohos/images:|^//build/ohos/packages:make_packages")
+LICENSE_FILE_PATTERN = re.compile(r"^(LICEN[CS]E|NOTICE|COPYING|COPYRIGHT)([._-].*)?$|^README\.OpenSource$", re.IGNORECASE)
+TARGET_DEPTH = 3
+READ_CHUNK_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JsonStream:
+    """Incremental reader over a JSON document, values are decoded one at a time.
+
+    Only the value currently being decoded has to fit into memory, which lets callers walk
+    the members of a huge top-level object without materializing it.
+    """
+
+    def __init__(self, fp, chunk_size: int = READ_CHUNK_SIZE) -> None:
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it, ``""`` at the end."""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"expected {char!r} but found {found!r} in JSON stream")
+        self.pos += 1
+
+    def value(self):
+        """Decode and consume the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number ending at the buffer end, or right before its fraction or exponent, may
+                # continue in the next chunk. No valid value is followed by one of ".eE".
+                if self.eof or (end < len(self.buf) and self.buf[end] not in ".eE"):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def members(self) -> Iterator[str]:
+        """Iterate the keys of the object whose ``{`` was just consumed.
+
+        The caller has to consume each member's value (``value`` or a nested walk) before
+        asking for the next key.
+        """
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def iter_targets(gn_file: str, fields: Iterable[str] = None) -> Iterator[tuple[str, dict]]:
+    """Stream the ``targets`` section of a GN ``--ide=json`` project file.
+
+    Args:
+        gn_file: Path of the ``out.json``.
+        fields: Target fields to keep, all fields when ``None``.
+
+    Yields:
+        tuple[str, dict]: ``(label, target)`` one target at a time.
+    """
+    fields = None if fields is None else tuple(fields)
+    with open(gn_file, "r", encoding="utf-8") as f:
+        stream = _JsonStream(f)
+        stream.expect("{")
+        for key in stream.members():
+            if key != "targets":
+                stream.value()
+                continue
+            stream.expect("{")
+            for label in stream.members():
+                target = stream.value()
+                if fields is not None:
+                    target = {field: target[field] for field in fields if field in target}
+                yield label, target
+            return
+
+
+def read_dependency_graph(gn_file: str) -> dict[str, list[str]]:
+    """Return ``{label: deps + public_deps}`` of every target in a GN project file."""
+    return {
+        label: [dep for field in DEP_FIELDS for dep in target.get(field, [])]
+        for label, target in iter_targets(gn_file, DEP_FIELDS)
+    }
+
+
+class PathTrie:
+    """Set of relative directories that keeps only the outermost ones.
+
+    Adding a directory below one already present is a no-op, adding a parent drops the
+    children it covers, so membership checks cost one step per path component instead of a
+    scan over every known directory.
+    """
+
+    def __init__(self) -> None:
+        self.root = {}
+
+    @staticmethod
+    def _parts(path: str) -> list[str]:
+        return [part for part in path.replace(os.sep, "/").split("/") if part]
+
+    def covers(self, path: str) -> bool:
+        """Whether ``path`` or one of its parents is in the trie."""
+        node = self.root
+        for part in self._parts(path):
+            if node is None:
+                return True
+            if part not in node:
+                return False
+            node = node[part]
+        return node is None
+
+    def add(self, path: str) -> bool:
+        """Add ``path``, return ``False`` if it was already covered."""
+        parts = self._parts(path)
+        if not parts or self.covers(path):
+            return False
+        node = self.root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        # Leaves are None, anything below the new leaf is covered by it now.
+        node[parts[-1]] = None
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        stack = [((), self.root)]
+        while stack:
+            parts, node = stack.pop()
+            if node is None:
+                yield "/".join(parts)
+                continue
+            stack.extend(((*parts, name), child) for name, child in node.items())
+
+
+def label_dir(label: str) -> str:
+    """Return the source-root relative directory of a GN label, e.g. ``//a/b:c`` -> ``a/b``."""
+    return re.sub(r"//|:.+$", "", label).strip("/")
+
+
+def source_path(source: str) -> str | None:
+    """Return the source-root relative path of a GN file reference, ``None`` if it is outside the tree."""
+    if not source.startswith("//"):
+        return None
+    return source[2:]
+
+
+def target_key(rel_path: str) -> str:
+    """Return the scan target a source-root relative directory belongs to.
+
+    Results are grouped by the first ``TARGET_DEPTH`` path components, which is the layout the
+    ``<tree>-license`` directory has always used.
+    """
+    return "/".join(rel_path.split("/")[:TARGET_DEPTH])
+
+
+def target_files(target: dict) -> list[str]:
+    """Return the source-root relative files a GN target references through ``FILE_FIELDS``."""
+    files = []
+    for field in FILE_FIELDS:
+        values = target.get(field)
+        # "public" is the string "*" when every header of the target is public.
+        if not isinstance(values, list):
+            continue
+        for value in values:
+            rel = source_path(value)
+            if rel is not None:
+                files.append(rel)
+    return files
+
+
+def default_roots(labels: Iterable[str]) -> list[str]:
+    """Return the image and package targets a product build starts from."""
+    return sorted(label for label in labels if DEFAULT_ROOT_PATTERN.match(label))
+
+
+def dependency_closure(graph: dict[str, list[str]], roots: list[str]) -> set[str]:
+    """Return the labels reachable from ``roots`` in ``{label: deps}``, roots included."""
+    reachable = set()
+    stack = [root for root in roots if root in graph]
+    while stack:
+        label = stack.pop()
+        if label in reachable:
+            continue
+        reachable.add(label)
+        stack.extend(dep for dep in graph[label] if dep in graph and dep not in reachable)
+    return reachable
+
+
+def license_neighbours(prefix: str, rel_file: str, key: str, listing_cache: dict[str, list[str]]) -> list[str]:
+    """Return the license relevant files next to ``rel_file`` and in its parents up to its scan target.
+
+    Args:
+        prefix: Source root on disk.
+        rel_file: Source-root relative file path.
+        key: Scan target ``rel_file`` is grouped under.
+        listing_cache: Directory listings shared between calls, keyed by relative directory.
+    """
+    parts = rel_file.split("/")[:-1]
+    stop = len(key.split("/"))
+    found = []
+    for depth in range(len(parts), stop - 1, -1):
+        rel_dir = "/".join(parts[:depth])
+        if rel_dir not in listing_cache:
+            try:
+                names = os.listdir(os.path.join(prefix, rel_dir))
+            except OSError:
+                names = []
+            listing_cache[rel_dir] = [
+                name for name in names
+                if LICENSE_FILE_PATTERN.match(name) and os.path.isfile(os.path.join(prefix, rel_dir, name))
+            ]
+        found.extend(f"{rel_dir}/{name}" for name in listing_cache[rel_dir])
+    return found
+
+
+def collect_target_files(targets: Iterable[tuple[str, dict]], prefix: str) -> dict[str, list[str]]:
+    """Group the files GN targets reference, plus their license neighbours, by scan target.
+
+    A file is grouped under the shortest target key of a GN label containing it, so the result
+    files line up with the directory mode layout, files outside every label directory fall back
+    to the key of their own directory.
+
+    Args:
+        targets: ``(label, target)`` pairs as yielded by ``iter_targets``.
+        prefix: Source root on disk.
+
+    Returns:
+        dict[str, list[str]]: ``{target key: sorted absolute file paths}``, only existing files.
+    """
+    label_keys = set()
+    referenced = set()
+    for label, target in targets:
+        label_keys.add(target_key(label_dir(label)))
+        referenced.update(target_files(target))
+
+    listing_cache = {}
+    grouped = {}
+    for rel_file in referenced:
+        # Files directly in the source root have no target directory to be grouped under.
+        if "/" not in rel_file or not os.path.isfile(os.path.join(prefix, rel_file)):
+            continue
+        parts = rel_file.split("/")[:-1]
+        key = next(
+            (
+                "/".join(parts[:depth])
+                for depth in range(1, min(len(parts), TARGET_DEPTH) + 1)
+                if "/".join(parts[:depth]) in label_keys
+            ),
+            target_key("/".join(parts)),
+        )
+        group = grouped.setdefault(key, set())
+        group.add(rel_file)
+        group.update(license_neighbours(prefix, rel_file, key, listing_cache))
+
+    return {
+        key: sorted(os.path.join(prefix, *rel.split("/")) for rel in group)
+        for key, group in grouped.items()
+    }
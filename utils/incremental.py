@@ -0,0 +1,149 @@
+import os
+import glob
+import json
+import subprocess
+from .supervisor import get_supervisor
+
+
+REVISIONS_FILE = ".project_revisions"
+
+
+def read_git_head(project_dir: str) -> str | None:
+    """Resolve the commit a project's HEAD points to without spawning git where possible.
+
+    ``repo sync`` leaves projects on a detached HEAD, so reading ``HEAD`` is usually enough,
+    symbolic refs are resolved through loose refs and ``packed-refs`` before falling back to
+    ``git rev-parse``.
+    """
+    git_dir = os.path.join(project_dir, ".git")
+    if os.path.isfile(git_dir):
+        with open(git_dir, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        if content.startswith("gitdir:"):
+            git_dir = os.path.normpath(os.path.join(project_dir, content[len("gitdir:"):].strip()))
+
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r", encoding="utf-8") as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+
+    if not head.startswith("ref:"):
+        return head
+
+    ref = head[len("ref:"):].strip()
+    try:
+        with open(os.path.join(git_dir, ref), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(git_dir, "packed-refs"), "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+
+    try:
+        return get_supervisor().run(["git", "rev-parse", "HEAD"], cwd=project_dir, merge_stderr=False).check().stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def list_repo_projects(oh_path: str) -> dict[str, str]:
+    """Return ``{project path: HEAD revision}`` for every project of a repo checkout.
+
+    Raises:
+        FileNotFoundError: If ``oh_path`` is not a repo checkout.
+    """
+    project_list = os.path.join(oh_path, ".repo", "project.list")
+    with open(project_list, "r", encoding="utf-8") as f:
+        paths = [line.strip().strip("/") for line in f if line.strip()]
+
+    projects = {}
+    for path in paths:
+        revision = read_git_head(os.path.join(oh_path, path))
+        if revision is not None:
+            projects[path] = revision
+    return projects
+
+
+def overlaps(target: str, project: str) -> bool:
+    """Whether a scan target and a repo project share files, paths are relative posix paths."""
+    return target == project or target.startswith(project + "/") or project.startswith(target + "/")
+
+
+class RevisionTracker:
+    """Remember the repo project revisions a scan result directory was produced from.
+
+    The revisions are stored next to the results so the next run can tell which targets are
+    under projects that moved since, and which results belong to projects that were removed.
+    """
+
+    def __init__(self, oh_path: str, result_path: str) -> None:
+        self.oh_path = oh_path
+        self.result_path = result_path
+        self.state_path = os.path.join(result_path, REVISIONS_FILE)
+
+    def load(self) -> dict[str, str]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)["projects"]
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save(self, projects: dict[str, str]) -> None:
+        os.makedirs(self.result_path, exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"projects": projects}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def invalidate(self) -> dict:
+        """Drop results that are out of date with the checkout and record the current revisions.
+
+        Every result in the directory that overlaps a changed, new or removed project is deleted
+        together with its partial shard results, so the regular resume logic rescans it. That
+        includes results of targets this run does not scan, e.g. of another product, the saved
+        revisions would hide their changes from later runs. The new revisions are saved right
+        away: every result they affect is gone, so an interrupted run still rescans it.
+
+        Returns:
+            dict: ``changed``, ``removed`` projects and the ``invalidated`` result files.
+        """
+        previous = self.load()
+        current = list_repo_projects(self.oh_path)
+
+        changed = sorted(path for path, revision in current.items() if previous.get(path) != revision)
+        removed = sorted(set(previous) - set(current))
+        moved = changed + removed
+
+        stale = set()
+        for root, _, names in os.walk(self.result_path):
+            for name in names:
+                # Partial results of a split target are named "<target>.json.shard-<name>".
+                if not name.endswith(".json") and ".json.shard-" not in name:
+                    continue
+                rel = os.path.relpath(os.path.join(root, name.rsplit(".json", 1)[0]), self.result_path).replace(os.sep, "/")
+                # No revisions recorded yet, results of any earlier run can not be trusted.
+                if not previous or any(overlaps(rel, project) for project in moved):
+                    stale.add(rel)
+
+        invalidated = []
+        for target in sorted(stale):
+            result_file = os.path.join(self.result_path, f"{target}.json")
+            # Shard names only depend on the file list, parts of the old revision would be merged.
+            parts = glob.glob(glob.escape(f"{result_file}.shard-") + "*")
+            for part in parts:
+                os.remove(part)
+            if os.path.exists(result_file):
+                os.remove(result_file)
+                invalidated.append(result_file)
+            elif parts:
+                invalidated.append(result_file)
+
+        self.save(current)
+        return {"changed": changed, "removed": removed, "invalidated": invalidated}
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+
+
+JOURNAL_FILE = ".scan_journal"
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def result_checksum(result_file: str) -> str:
+    digest = hashlib.sha256()
+    with open(result_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ScanJournal:
+    """Append-only record of each target's scan state, kept next to the results.
+
+    Every transition (``running``, ``done`` with the result checksum, ``failed`` with the error)
+    is appended and flushed to disk, so after a crash the last line of each target tells what
+    was lost: ``running`` targets are redone without counting as a failed attempt, ``done``
+    targets whose result is missing or does not match its checksum are redone, ``failed``
+    targets are retried until ``max_attempts`` is reached.
+
+    Args:
+        result_path: Directory the per-target results are written to.
+        max_attempts: Number of failed scans after which a target is given up.
+    """
+
+    def __init__(self, result_path: str, max_attempts: int = 3) -> None:
+        self.path = os.path.join(result_path, JOURNAL_FILE)
+        self.max_attempts = max_attempts
+        self.entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash, everything before it is intact.
+                        continue
+                    self.entries[entry["target"]] = entry
+        except OSError:
+            pass
+
+        # Rewrite compacted to one line per target so the journal does not grow across runs.
+        os.makedirs(result_path, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+        self.fp = open(self.path, "a", encoding="utf-8")
+
+    def state(self, target: str) -> str:
+        return self.entries.get(target, {}).get("state", PENDING)
+
+    def attempts(self, target: str) -> int:
+        return self.entries.get(target, {}).get("attempts", 0)
+
+    def lost(self) -> list[str]:
+        """Targets a previous run was still scanning when it stopped."""
+        return sorted(target for target, entry in self.entries.items() if entry["state"] == RUNNING)
+
+    def is_done(self, target: str, result_file: str) -> bool:
+        """Whether ``target`` has an intact result.
+
+        Results from before the journal existed are adopted when they parse as JSON.
+        """
+        if not os.path.exists(result_file):
+            return False
+
+        entry = self.entries.get(target)
+        if entry is None:
+            try:
+                with open(result_file, "r", encoding="utf-8") as f:
+                    json.load(f)
+            except ValueError:
+                return False
+            self.done(target, result_file)
+            return True
+
+        return (
+            entry["state"] == DONE
+            and entry.get("size") == os.path.getsize(result_file)
+            and entry.get("sha256") == result_checksum(result_file)
+        )
+
+    def gave_up(self, target: str) -> bool:
+        return self.state(target) == FAILED and self.attempts(target) >= self.max_attempts
+
+    def running(self, target: str) -> None:
+        self._append(target, RUNNING)
+
+    def done(self, target: str, result_file: str) -> None:
+        self._append(target, DONE, sha256=result_checksum(result_file), size=os.path.getsize(result_file))
+
+    def failed(self, target: str, error: str) -> None:
+        self._append(target, FAILED, attempts=self.attempts(target) + 1, error=error)
+
+    def close(self) -> None:
+        self.fp.close()
+
+    def _append(self, target: str, state: str, **fields) -> None:
+        entry = {"target": target, "state": state, "attempts": self.attempts(target), "time": time.time(), **fields}
+        self.entries[target] = entry
+        self.fp.write(json.dumps(entry) + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
@@ -0,0 +1,103 @@
+import os
+import mmap
+import shutil
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from .prefilter import BINARY_MAGICS, SNIFF_SIZE
+
+
+SKIP_DIRS = {".repo", ".git"}
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 4096
+
+
+def has_crlf(file_path: str) -> bool | None:
+    """Whether a text file contains CRLF, ``None`` for binary files."""
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_SIZE)
+        if head.startswith(BINARY_MAGICS) or b"\x00" in head:
+            return None
+        if b"\r\n" in head:
+            return True
+        if len(head) < SNIFF_SIZE:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Start one byte early so a CRLF split across the sniffed head is found.
+            return mapped.find(b"\r\n", SNIFF_SIZE - 1) != -1
+
+
+def rewrite_lf(file_path: str) -> int:
+    """Replace CRLF with LF through a temporary file and an atomic rename, return the bytes saved."""
+    directory = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".crlf-")
+    saved = 0
+    try:
+        with open(file_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            carry = b""
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                chunk = carry + chunk
+                # A trailing CR may be the first half of a CRLF in the next chunk.
+                carry = b"\r" if chunk.endswith(b"\r") else b""
+                if carry:
+                    chunk = chunk[:-1]
+                converted = chunk.replace(b"\r\n", b"\n")
+                saved += len(chunk) - len(converted)
+                dst.write(converted)
+            dst.write(carry)
+        shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return saved
+
+
+def iter_files(path: str):
+    for root, dirnames, files in os.walk(path):
+        dirnames[:] = [name for name in dirnames if name not in SKIP_DIRS]
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                yield file_path
+
+
+def normalize_line_endings(path: str, workers: int = None, dry_run: bool = False) -> dict:
+    """Convert CRLF to LF in the text files under ``path`` that contain any, in parallel.
+
+    Files without CRLF and binary files are only read, never written, so their mtimes stay
+    untouched. ``.repo`` and ``.git`` directories and symlinks are skipped.
+
+    Returns:
+        dict: ``{"scanned", "binary", "changed": [paths], "bytes_saved", "errors": [(path, message)]}``.
+    """
+
+    def process(file_path):
+        try:
+            crlf = has_crlf(file_path)
+            if crlf is None:
+                return file_path, "binary", 0
+            if not crlf:
+                return file_path, "clean", 0
+            return file_path, "changed", 0 if dry_run else rewrite_lf(file_path)
+        except (OSError, ValueError) as e:
+            return file_path, f"error: {e}", 0
+
+    summary = {"scanned": 0, "binary": 0, "changed": [], "bytes_saved": 0, "errors": []}
+    files = iter_files(path)
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as executor:
+        # Batches keep the number of queued futures bounded on trees with millions of files.
+        results = itertools.chain.from_iterable(
+            executor.map(process, batch) for batch in iter(lambda: list(itertools.islice(files, BATCH_SIZE)), [])
+        )
+        for file_path, status, saved in results:
+            summary["scanned"] += 1
+            if status == "binary":
+                summary["binary"] += 1
+            elif status == "changed":
+                summary["changed"].append(file_path)
+                summary["bytes_saved"] += saved
+            elif status.startswith("error"):
+                summary["errors"].append((file_path, status[len("error: "):]))
+    return summary
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import platform
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+METRIC_PREFIX = "liscopelens"
+
+
+def _usage(who) -> tuple[float, int]:
+    """Return ``(cpu seconds, peak rss bytes)`` of this process or its reaped children."""
+    if resource is None:
+        return time.process_time() if who == "self" else 0.0, 0
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return usage.ru_utime + usage.ru_stime, rss
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ScanMetrics:
+    """Throughput, per-target latency and ETA of one scan run.
+
+    The ETA scales the planner's remaining estimated cost by how fast the estimated cost has
+    been worked off so far, so it corrects itself when the estimates are off.
+
+    Args:
+        total_cost: Estimated seconds of all planned shards.
+    """
+
+    def __init__(self, total_cost: float) -> None:
+        self.start = time.monotonic()
+        self.started = time.time()
+        self.total_cost = total_cost
+        self.done_cost = 0.0
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.latency = {}
+        self.fastpath = None
+
+    def shard_done(self, cost: float) -> None:
+        self.done_cost += cost
+
+    def target_done(self, target: str, seconds: float, files: int, size: int) -> None:
+        self.latency[target] = seconds
+        self.files += files
+        self.bytes += size
+
+    def target_failed(self, target: str) -> None:
+        self.failed += 1
+
+    def fastpath_done(self, files: int, resolved: int, verified: int, mismatched: int, mismatches: list[str]) -> None:
+        """Count the files of one scan the header fast path looked at and resolved."""
+        if self.fastpath is None:
+            self.fastpath = {"files": 0, "resolved": 0, "verified": 0, "mismatched": 0, "mismatches": []}
+        self.fastpath["files"] += files
+        self.fastpath["resolved"] += resolved
+        self.fastpath["verified"] += verified
+        self.fastpath["mismatched"] += mismatched
+        self.fastpath["mismatches"] += mismatches
+
+    def eta(self) -> float | None:
+        """Seconds until every planned shard is done, ``None`` before the first one finished."""
+        if self.done_cost <= 0:
+            return None
+        elapsed = time.monotonic() - self.start
+        return elapsed * max(0.0, self.total_cost - self.done_cost) / self.done_cost
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.start
+        latency = list(self.latency.values())
+        return {
+            "elapsed": elapsed,
+            "targets": len(self.latency),
+            "failed": self.failed,
+            "files": self.files,
+            "bytes": self.bytes,
+            "files_per_second": self.files / elapsed if elapsed else 0.0,
+            "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+            "latency": {
+                "p50": _percentile(latency, 0.5),
+                "p90": _percentile(latency, 0.9),
+                "p99": _percentile(latency, 0.99),
+                "max": max(latency, default=0.0),
+            },
+            "slowest": sorted(self.latency.items(), key=lambda item: item[1], reverse=True)[:10],
+            **({"fastpath": self.fastpath} if self.fastpath is not None else {}),
+        }
+
+    def write(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=2))
+
+
+class RunMetrics:
+    """Wall time, CPU time and peak RSS of each pipeline stage, written as JSON and Prometheus text.
+
+    CPU time is taken for the orchestrator and for the child processes it waited for during
+    the stage. Work done inside a Docker container belongs to the daemon, not to the docker
+    client the stage ran, and is not included. The kernel only reports peak RSS for the whole
+    run, so the ``lifetime_`` RSS fields are the peaks up to the end of the stage, of the
+    orchestrator and of its largest single child, which may have run in an earlier stage.
+
+    Args:
+        report_path: JSON run report.
+        prom_path: Prometheus textfile, e.g. in the node_exporter textfile collector directory.
+        labels: Labels attached to every metric, e.g. product and branch.
+    """
+
+    def __init__(self, report_path: str, prom_path: str = None, labels: dict = None) -> None:
+        self.report_path = report_path
+        self.prom_path = prom_path
+        self.labels = labels or {}
+        self.started = time.time()
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Measure the enclosed block as stage ``name``, the stage is also recorded when it fails."""
+        wall = time.monotonic()
+        cpu_self, _ = _usage("self")
+        cpu_children, _ = _usage("children")
+        entry = self.stages[name] = {"status": "running"}
+        try:
+            yield entry
+            entry["status"] = "ok"
+        except BaseException:
+            entry["status"] = "failed"
+            raise
+        finally:
+            end_self, rss_self = _usage("self")
+            end_children, rss_children = _usage("children")
+            entry.update(
+                wall_seconds=time.monotonic() - wall,
+                cpu_seconds=end_self - cpu_self,
+                children_cpu_seconds=end_children - cpu_children,
+                lifetime_peak_rss_bytes=rss_self,
+                children_lifetime_peak_rss_bytes=rss_children,
+            )
+            self.write()
+
+    def add(self, name: str, **values) -> None:
+        """Attach extra values, e.g. the scan summary, to a stage."""
+        self.stages.setdefault(name, {}).update(values)
+
+    def write(self) -> None:
+        report = {
+            "started": self.started,
+            "host": platform.node(),
+            "labels": self.labels,
+            "stages": self.stages,
+        }
+        _write_atomic(self.report_path, json.dumps(report, indent=2))
+        if self.prom_path:
+            _write_atomic(self.prom_path, self.prometheus())
+
+    def prometheus(self) -> str:
+        gauges = {
+            "stage_wall_seconds": ("wall_seconds", "Wall time of a pipeline stage."),
+            "stage_cpu_seconds": ("cpu_seconds", "CPU time the orchestrator spent in a stage."),
+            "stage_children_cpu_seconds": ("children_cpu_seconds", "CPU time of the child processes of a stage."),
+            "stage_children_lifetime_peak_rss_bytes": (
+                "children_lifetime_peak_rss_bytes",
+                "Peak RSS of the largest child process of the run up to the end of a stage.",
+            ),
+        }
+        scan_gauges = {
+            "scan_files_per_second": "files_per_second",
+            "scan_bytes_per_second": "bytes_per_second",
+            "scan_files": "files",
+            "scan_bytes": "bytes",
+            "scan_failed_targets": "failed",
+        }
+
+        def labels(**extra):
+            merged = {**self.labels, **extra}
+            return ",".join(f'{key}="{_escape_label(value)}"' for key, value in merged.items())
+
+        lines = []
+        for metric, (field, help_text) in gauges.items():
+            lines += [f"# HELP {METRIC_PREFIX}_{metric} {help_text}", f"# TYPE {METRIC_PREFIX}_{metric} gauge"]
+            for name, entry in self.stages.items():
+                if field in entry:
+                    lines.append(f"{METRIC_PREFIX}_{metric}{{{labels(stage=name)}}} {entry[field]}")
+        lines += [f"# TYPE {METRIC_PREFIX}_stage_success gauge"]
+        for name, entry in self.stages.items():
+            lines.append(f"{METRIC_PREFIX}_stage_success{{{labels(stage=name)}}} {int(entry.get('status') == 'ok')}")
+
+        scan = self.stages.get("scan", {}).get("scan")
+        if scan:
+            for metric, field in scan_gauges.items():
+                lines += [f"# TYPE {METRIC_PREFIX}_{metric} gauge", f"{METRIC_PREFIX}_{metric}{{{labels()}}} {scan[field]}"]
+            lines += [f"# TYPE {METRIC_PREFIX}_scan_target_latency_seconds gauge"]
+            for name, value in scan["latency"].items():
+                quantile = {"p50": "0.5", "p90": "0.9", "p99": "0.99", "max": "1"}[name]
+                lines.append(f"{METRIC_PREFIX}_scan_target_latency_seconds{{{labels(quantile=quantile)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value) -> str:
+    """Escape a Prometheus label value, backslash, double quote and line feed must be escaped."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,155 @@
+import os
+import json
+import math
+import hashlib
+from typing import Callable, NamedTuple
+
+
+HISTORY_FILE = ".scan_history"
+# Rough single process scancode throughput, only used until a history exists to calibrate it.
+DEFAULT_OVERHEAD = 10.0
+DEFAULT_PER_FILE = 0.05
+DEFAULT_PER_BYTE = 1e-6
+SHARDS_PER_JOB = 4
+MIN_SHARD_COST = 120.0
+
+
+class Shard(NamedTuple):
+    """One unit of scan work, a whole target or a slice of its files."""
+
+    target: str
+    files: list[str] | None
+    cost: float
+    index: int = 0
+    count: int = 1
+    name: str = ""
+
+
+class ScanHistory:
+    """Wall times of past target scans, stored next to the scan results."""
+
+    def __init__(self, result_path: str) -> None:
+        self.path = os.path.join(result_path, HISTORY_FILE)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.records = json.load(f)
+        except (OSError, ValueError):
+            self.records = {}
+
+    def record(self, key: str, seconds: float, files: int, size: int) -> None:
+        self.records[key] = {"seconds": seconds, "files": files, "bytes": size}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.records, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class ShardPlanner:
+    """Estimate target scan costs, split oversized targets and order the work longest first.
+
+    The cost of a target is ``overhead + files * per_file + bytes * per_byte`` seconds, scaled
+    by how far past scans were off that model, or the target's own past scan time scaled by
+    its size when a history exists for it. Targets above the shard cost are split into slices
+    of their files, sorted by path so sub-directories stay together, and every shard is
+    dispatched longest first to keep the makespan close to ``total cost / jobs``.
+
+    Args:
+        jobs: Number of concurrent scan jobs, nothing is split for a single job.
+        list_files: Callable listing the files scancode would scan in a directory.
+        history: Past scan times, optional.
+        shard_cost: Largest cost in seconds a shard may have, derived from the total by default.
+    """
+
+    def __init__(
+        self,
+        jobs: int,
+        list_files: Callable[[str], list[str]],
+        history: ScanHistory = None,
+        shard_cost: float = None,
+    ) -> None:
+        self.jobs = jobs
+        self.list_files = list_files
+        self.history = history
+        self.shard_cost = shard_cost
+        self.measured = {}
+        self.scale = self._calibrate()
+
+    @staticmethod
+    def model(files: int, size: int) -> float:
+        return DEFAULT_OVERHEAD + files * DEFAULT_PER_FILE + size * DEFAULT_PER_BYTE
+
+    def _calibrate(self) -> float:
+        records = self.history.records.values() if self.history else []
+        predicted = sum(self.model(r["files"], r["bytes"]) for r in records)
+        actual = sum(r["seconds"] for r in records)
+        return actual / predicted if predicted and actual else 1.0
+
+    def estimate(self, key: str, files: int, size: int) -> float:
+        record = self.history.records.get(key) if self.history else None
+        if record and record["bytes"]:
+            return record["seconds"] * max(size, 1) / record["bytes"]
+        if record:
+            return record["seconds"]
+        return self.model(files, size) * self.scale
+
+    def plan(self, targets: dict[str, list[str] | None], keys: dict[str, str]) -> list[Shard]:
+        """Turn ``{target: files or None for the whole directory}`` into shards, longest first.
+
+        Args:
+            targets: Targets to scan, ``None`` scans the whole directory.
+            keys: ``{target: history key}``, the result path of the target.
+        """
+        sized = {}
+        costs = {}
+        for target, files in targets.items():
+            listed = files if files is not None else self.list_files(target)
+            sizes = [(file_path, os.path.getsize(file_path)) for file_path in listed]
+            sized[target] = sizes
+            total = sum(size for _, size in sizes)
+            self.measured[target] = (len(sizes), total)
+            costs[target] = self.estimate(keys[target], len(sizes), total)
+
+        shard_cost = self.shard_cost
+        if shard_cost is None:
+            shard_cost = max(sum(costs.values()) / (self.jobs * SHARDS_PER_JOB), MIN_SHARD_COST)
+
+        shards = []
+        for target, files in targets.items():
+            count = math.ceil(costs[target] / shard_cost) if self.jobs > 1 else 1
+            count = min(count, len(sized[target]))
+            if count <= 1:
+                shards.append(Shard(target, files, costs[target]))
+                continue
+            shards.extend(self._split(target, sorted(sized[target]), costs[target], count))
+
+        shards.sort(key=lambda shard: shard.cost, reverse=True)
+        return shards
+
+    def _split(self, target: str, sizes: list[tuple[str, int]], cost: float, count: int) -> list[Shard]:
+        weights = [DEFAULT_PER_FILE + size * DEFAULT_PER_BYTE for _, size in sizes]
+        budget = sum(weights) / count
+
+        slices, current, acc = [], [], 0.0
+        for (file_path, _), weight in zip(sizes, weights):
+            if current and acc + weight > budget and len(slices) < count - 1:
+                slices.append((current, acc))
+                current, acc = [], 0.0
+            current.append(file_path)
+            acc += weight
+        slices.append((current, acc))
+
+        total = sum(weight for _, weight in slices)
+        return [
+            Shard(
+                target,
+                files,
+                cost * weight / total,
+                index,
+                len(slices),
+                hashlib.sha1("\n".join(files).encode("utf-8")).hexdigest()[:12],
+            )
+            for index, (files, weight) in enumerate(slices)
+        ]
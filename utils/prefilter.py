@@ -0,0 +1,119 @@
+import os
+import json
+import fnmatch
+
+from .gn import LICENSE_FILE_PATTERN
+
+
+SNIFF_SIZE = 8192
+DEFAULT_MAX_SIZE = 10 * 1024**2
+DEFAULT_IGNORE_PATTERNS = ("out/*", "prebuilts/*", "*/prebuilts/*", "*/prebuilt/*", "*/.git/*", "*/.repo/*")
+BINARY_MAGICS = (
+    b"\x7fELF",  # ELF executables, shared objects, object files
+    b"MZ",  # PE executables
+    b"\xcf\xfa\xed\xfe", b"\xce\xfa\xed\xfe", b"\xca\xfe\xba\xbe",  # Mach-O, fat binaries, java classes
+    b"!<arch>\n",  # static libraries
+    b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00", b"\x28\xb5\x2f\xfd", b"7z\xbc\xaf\x27\x1c",  # archives
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"RIFF", b"OggS", b"ID3", b"wOFF", b"wOF2",  # media and fonts
+    b"ANDROID!", b"\x3a\xff\x26\xed", b"hsqs",  # boot, sparse and squashfs images
+)
+LFS_POINTER = b"version https://git-lfs.github.com/spec/v1"
+GENERATED_MARKERS = (b"@generated", b"DO NOT EDIT", b"Generated by the protocol buffer compiler")
+
+
+def load_ignore_patterns(config_path: str | None, product_name: str) -> list[str]:
+    """Return the path ignore patterns for a product.
+
+    The config is a JSON object mapping product names to lists of ``fnmatch`` patterns matched
+    against source-root relative paths, patterns under ``"*"`` apply to every product. Without
+    a config the built-in ``DEFAULT_IGNORE_PATTERNS`` are used.
+    """
+    if not config_path:
+        return list(DEFAULT_IGNORE_PATTERNS)
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return [*config.get("*", []), *config.get(product_name, [])]
+
+
+class PreFilter:
+    """Decide cheaply which files are worth handing to scancode.
+
+    Files are dropped when they match an ignore pattern, are empty or larger than ``max_size``,
+    are git-lfs pointers, or when their first bytes show a binary format (magic number or a NUL
+    byte) or a generated-code marker. License files are only dropped when they are binary.
+
+    Args:
+        prefix: Source root on disk, patterns are matched against paths relative to it.
+        patterns: ``fnmatch`` patterns of paths to ignore.
+        max_size: Largest file size in bytes to keep.
+    """
+
+    def __init__(self, prefix: str, patterns: list[str], max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.prefix = prefix
+        self.patterns = patterns
+        self.max_size = max_size
+
+    def classify(self, file_path: str) -> tuple[str | None, int]:
+        """Return ``(reason or None to keep, size)`` for one file."""
+        rel = os.path.relpath(file_path, self.prefix).replace(os.sep, "/")
+        size = os.path.getsize(file_path)
+        is_license = LICENSE_FILE_PATTERN.match(os.path.basename(file_path)) is not None
+
+        if not is_license and any(fnmatch.fnmatch(rel, pattern) for pattern in self.patterns):
+            return "ignored", size
+        if size == 0:
+            return "empty", size
+        if not is_license and size > self.max_size:
+            return "too_large", size
+
+        with open(file_path, "rb") as f:
+            head = f.read(SNIFF_SIZE)
+        if head.startswith(LFS_POINTER):
+            return "lfs_pointer", size
+        if head.startswith(BINARY_MAGICS) or b"\x00" in head:
+            return "binary", size
+        if not is_license and any(marker in head for marker in GENERATED_MARKERS):
+            return "generated", size
+        return None, size
+
+    def filter(self, files: list[str]) -> tuple[list[str], list[tuple[str, str, int]]]:
+        """Split ``files`` into the ones to scan and ``(file, reason, size)`` of the skipped ones."""
+        kept, skipped = [], []
+        for file_path in files:
+            try:
+                reason, size = self.classify(file_path)
+            except OSError:
+                reason, size = "unreadable", 0
+            if reason is None:
+                kept.append(file_path)
+            else:
+                skipped.append((file_path, reason, size))
+        return kept, skipped
+
+
+def write_report(report_path: str, prefix: str, kept: int, kept_bytes: int, skipped: list[tuple[str, str, int]]) -> dict:
+    """Write the pre-filter report, per-reason totals plus every skipped file, and return the totals."""
+    reasons = {}
+    for _, reason, size in skipped:
+        total = reasons.setdefault(reason, {"files": 0, "bytes": 0})
+        total["files"] += 1
+        total["bytes"] += size
+
+    summary = {
+        "kept": {"files": kept, "bytes": kept_bytes},
+        "skipped": {"files": len(skipped), "bytes": sum(size for _, _, size in skipped)},
+        "reasons": reasons,
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                **summary,
+                "files": [
+                    {"path": os.path.relpath(file_path, prefix).replace(os.sep, "/"), "reason": reason, "bytes": size}
+                    for file_path, reason, size in sorted(skipped)
+                ],
+            },
+            f,
+            indent=2,
+        )
+    return summary
@@ -3,39 +3,44 @@ import sys
 import platform
 import subprocess
 import shutil
-import tarfile
-import zipfile
-from urllib.request import urlopen
 from urllib.error import URLError, HTTPError
-from .logger import log_success, log_error, log_info
+from .logger import log_error, log_info
+from .downloader import DEFAULT_CACHE_DIR, ChecksumError, fetch, probe
 from rich.progress import Progress, BarColumn, TextColumn, DownloadColumn, TransferSpeedColumn, TimeRemainingColumn
 
+# Release file name -> SHA-256, from the checksums published on the v32.4.1 release page, e.g.
+# "scancode-toolkit-v32.4.1_py3.10-linux.tar.gz": "<sha256>". Downloading a file without a pin
+# needs --scancode_sha256 or --allow_unpinned, the latter trusts the digest of the first download.
+SCANCODE_SHA256 = {}
 
 
-def download_file(url, dest):
+def download_file(url, cache_dir=DEFAULT_CACHE_DIR, sha256=None, extract_to=None):
+    """Fetch url into the download cache with parallel resumable range requests, see utils/downloader.py."""
     log_info(f"Downloading {url}...")
     try:
-        with urlopen(url) as response:
-            total_size = int(response.info().get('Content-Length', 0))
-            chunk_size = 1024  # Size of each chunk in bytes
+        with Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            DownloadColumn(),
+            TransferSpeedColumn(),
+            TimeRemainingColumn(),
+        ) as progress:
+            probed = probe(url)
+            task = progress.add_task(f"Downloading {os.path.basename(url)}", total=probed[0])
+            path = fetch(
+                url,
+                cache_dir,
+                sha256=sha256,
+                progress=lambda advance: progress.update(task, advance=advance),
+                extract_to=extract_to,
+                probed=probed,
+            )
 
-            with open(dest, 'wb') as out_file, Progress(
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                DownloadColumn(),
-                TransferSpeedColumn(),
-                TimeRemainingColumn(),
-            ) as progress:
-                task = progress.add_task(f"Downloading {dest}", total=total_size)
-                
-                while True:
-                    chunk = response.read(chunk_size)
-                    if not chunk:
-                        break
-                    out_file.write(chunk)
-                    progress.update(task, advance=len(chunk))
-        
-        log_info(f"Downloaded to {dest}")
+        log_info(f"Downloaded to {path}")
+        return path
+    except ChecksumError as e:
+        log_error(f"Checksum mismatch: {e}")
+        sys.exit(1)
     except HTTPError as e:
         log_error(f"HTTP Error: {e.code} - {e.reason}")
         sys.exit(1)
@@ -43,18 +48,7 @@ def download_file(url, dest):
         log_error(f"URL Error: {e.reason}")
         sys.exit(1)
 
-def extract_file(file_path, extract_to):
-    if file_path.endswith(".tar.gz"):
-        log_info(f"Extracting {file_path}...")
-        with tarfile.open(file_path, 'r:gz') as tar:
-            tar.extractall(extract_to)
-    elif file_path.endswith(".zip"):
-        log_info(f"Extracting {file_path}...")
-        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-    log_success(f"Extracted to {extract_to}")
-
-def get_scancode():
+def get_scancode(cache_dir=DEFAULT_CACHE_DIR, sha256=None, allow_unpinned=False):
     dir_path = "./scancode-toolkit"
     system_type = platform.system().lower()
 
@@ -80,11 +74,20 @@ def get_scancode():
     file_name = f"scancode-toolkit-v32.4.1_py{python_version}-{os_type}.{file_extension}"
     download_url = base_url + file_name
 
+    sha256 = sha256 or SCANCODE_SHA256.get(file_name)
+    if sha256 is None and not allow_unpinned:
+        log_error(
+            f"No SHA-256 is pinned for {file_name}, pass the published digest with --scancode_sha256 "
+            "or use --allow_unpinned to trust the first download."
+        )
+        sys.exit(1)
+
     try:
-        download_file(download_url, file_name)
-        extract_file(file_name, ".")
-        os.rename(f"scancode-toolkit-v32.4.1", dir_path)
-        os.remove(file_name)
+        # Tarballs are unpacked while they download, the tree only appears once its checksum matched.
+        staging = f"{dir_path}.download"
+        download_file(download_url, cache_dir, sha256, extract_to=staging)
+        os.rename(os.path.join(staging, "scancode-toolkit-v32.4.1"), dir_path)
+        shutil.rmtree(staging)
     except Exception as e:
         log_error(f"An error occurred: {e}")
         sys.exit(1)
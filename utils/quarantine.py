@@ -0,0 +1,61 @@
+import os
+import json
+import time
+
+
+QUARANTINE_FILE = ".scan_quarantine"
+TIMEOUT_ERROR = "interrupted: timeout"
+
+
+def timed_out(entry: dict) -> bool:
+    """Whether scancode gave up on a file entry because of its per-file ``--timeout``."""
+    return any(TIMEOUT_ERROR in error.lower() for error in entry.get("scan_errors", []))
+
+
+class Quarantine:
+    """Files scancode could not finish in time, kept next to the results across runs.
+
+    Files are keyed by content digest, so a copy of a pathological file elsewhere in the tree
+    is caught as well. The list is append-only JSON lines like the scan journal; pool workers
+    add to it concurrently, every process sees the entries that existed when it loaded it.
+
+    Args:
+        result_path: Directory the per-target results are written to.
+    """
+
+    def __init__(self, result_path: str) -> None:
+        self.path = os.path.join(result_path, QUARANTINE_FILE)
+        self.entries = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry["digest"]] = entry
+        except OSError:
+            pass
+        return entries
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.entries
+
+    def add(self, digest: str, path: str, reason: str) -> None:
+        entry = {"digest": digest, "path": path, "reason": reason, "time": time.time()}
+        self.entries[digest] = entry
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # One short line per write, appends from several processes do not interleave.
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def since(self, start: float) -> list[dict]:
+        """Entries added by any process since ``start``, re-read from disk."""
+        self.entries = self._load()
+        return [entry for entry in self.entries.values() if entry["time"] >= start]
+
+    def __len__(self) -> int:
+        return len(self.entries)
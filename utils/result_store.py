@@ -0,0 +1,268 @@
+import os
+import copy
+import json
+import zlib
+import sqlite3
+import hashlib
+from typing import Iterator
+
+
+EMPTY_DETECTION = {
+    "license_detections": [],
+    "detected_license_expression": None,
+    "detected_license_expression_spdx": None,
+    "license_clues": [],
+    "percentage_of_license_text": 0,
+    "scan_errors": [],
+}
+ENTRY_FIELDS = (
+    "detected_license_expression",
+    "detected_license_expression_spdx",
+    "percentage_of_license_text",
+    "scan_errors",
+)
+DETECTION_FIELDS = ("license_expression", "license_expression_spdx", "identifier")
+MATCH_FIELDS = (
+    "license_expression",
+    "spdx_license_expression",
+    "start_line",
+    "end_line",
+    "score",
+    "matcher",
+    "rule_identifier",
+)
+
+
+def relocate_entry(entry: dict, path: str | None) -> dict:
+    """Return a copy of a scancode file entry whose match ``from_file`` fields point to ``path``.
+
+    Cached entries are stored with ``path=None`` so the same detections can be reused for every
+    location the content shows up at.
+    """
+    entry = copy.deepcopy(entry)
+    for detection in entry.get("license_detections", []):
+        for match in detection.get("matches", []):
+            match["from_file"] = path
+    for clue in entry.get("license_clues", []):
+        clue["from_file"] = path
+    return entry
+
+
+def assemble_result(root_name: str, entries: dict[str, dict], headers: list[dict] = None) -> dict:
+    """Build a scancode compatible result from per-file entries.
+
+    Args:
+        root_name: Name of the scanned directory, scancode prefixes every path with it.
+        entries: ``{relative posix path: file entry without path}``.
+        headers: Scancode ``headers`` section to embed.
+
+    Returns:
+        dict: Result with ``headers``, aggregated ``license_detections`` and ``files``.
+    """
+    dirs = {root_name}
+    for rel in entries:
+        parts = rel.split("/")[:-1]
+        for idx in range(len(parts)):
+            dirs.add("/".join([root_name, *parts[:idx + 1]]))
+
+    files = [{"path": d, "type": "directory", **copy.deepcopy(EMPTY_DETECTION)} for d in dirs]
+    detections = {}
+    for rel, entry in entries.items():
+        path = f"{root_name}/{rel}"
+        files.append({"path": path, **relocate_entry(entry, path)})
+        for detection in entry.get("license_detections", []):
+            aggregated = detections.setdefault(
+                detection.get("identifier"),
+                {
+                    "identifier": detection.get("identifier"),
+                    "license_expression": detection.get("license_expression"),
+                    "license_expression_spdx": detection.get("license_expression_spdx"),
+                    "detection_count": 0,
+                },
+            )
+            aggregated["detection_count"] += 1
+
+    files.sort(key=lambda entry: entry["path"])
+    return {"headers": headers or [], "license_detections": list(detections.values()), "files": files}
+
+
+def slim_entry(entry: dict) -> dict:
+    """Keep only the license relevant fields of a scancode file entry."""
+    def slim_matches(matches):
+        return [{field: match.get(field) for field in MATCH_FIELDS} for match in matches]
+
+    slim = {field: entry.get(field, EMPTY_DETECTION[field]) for field in ENTRY_FIELDS}
+    slim["type"] = "file"
+    slim["license_detections"] = [
+        {**{field: detection.get(field) for field in DETECTION_FIELDS}, "matches": slim_matches(detection.get("matches", []))}
+        for detection in entry.get("license_detections", [])
+    ]
+    slim["license_clues"] = slim_matches(entry.get("license_clues", []))
+    return slim
+
+
+class ResultStore:
+    """Single-file, compressed store of the license relevant part of all per-target results.
+
+    Rows are keyed by the source-root relative file path, so every file below a directory is
+    one index range away. Identical detections (the same license header in thousands of files)
+    are stored once. ``export`` writes the per-target JSON layout of ``<tree>-license`` back
+    for consumers that read it, such as ``liscopelens cpp --scancode-dir``.
+
+    Args:
+        db_path: Path of the SQLite database, created on first use.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = os.path.normpath(db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS targets (
+                key TEXT PRIMARY KEY,
+                root_name TEXT NOT NULL,
+                headers BLOB NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                id INTEGER PRIMARY KEY,
+                digest TEXT UNIQUE NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                target TEXT NOT NULL,
+                blob INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS files_target ON files (target);
+            """
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def compact(self, result_path: str) -> dict:
+        """Import the per-target JSON files of ``result_path``.
+
+        Results whose file did not change since the last compaction are skipped, targets whose
+        result file disappeared are dropped.
+
+        Returns:
+            dict: Number of ``targets`` seen, ``updated`` and ``removed`` ones.
+        """
+        known = {key: (mtime_ns, size) for key, mtime_ns, size in self.conn.execute("SELECT key, mtime_ns, size FROM targets")}
+        seen, updated = set(), 0
+        for root, dirs, names in os.walk(result_path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                if name.startswith(".") or not name.endswith(".json"):
+                    continue
+                result_file = os.path.join(root, name)
+                key = os.path.relpath(result_file, result_path)[:-len(".json")].replace(os.sep, "/")
+                stat = os.stat(result_file)
+                seen.add(key)
+                if known.get(key) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                with open(result_file, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                with self.conn:
+                    self._import(key, result, stat)
+                updated += 1
+
+        removed = set(known) - seen
+        with self.conn:
+            for key in removed:
+                self.conn.execute("DELETE FROM files WHERE target = ?", (key,))
+                self.conn.execute("DELETE FROM targets WHERE key = ?", (key,))
+            self.conn.execute("DELETE FROM blobs WHERE id NOT IN (SELECT DISTINCT blob FROM files)")
+        return {"targets": len(seen), "updated": updated, "removed": len(removed)}
+
+    def _import(self, key: str, result: dict, stat: os.stat_result) -> None:
+        parent = key.rsplit("/", 1)[0] if "/" in key else ""
+        entries = [entry for entry in result.get("files", []) if entry.get("type") == "file"]
+        root_name = entries[0]["path"].split("/", 1)[0] if entries else key.rsplit("/", 1)[-1]
+
+        self.conn.execute("DELETE FROM files WHERE target = ?", (key,))
+        for entry in entries:
+            data = json.dumps(slim_entry(entry), separators=(",", ":"), sort_keys=True).encode("utf-8")
+            digest = hashlib.sha1(data).hexdigest()
+            self.conn.execute("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)", (digest, zlib.compress(data)))
+            path = f"{parent}/{entry['path']}" if parent else entry["path"]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, (SELECT id FROM blobs WHERE digest = ?))",
+                (path, key, digest),
+            )
+
+        headers = zlib.compress(json.dumps(result.get("headers", [])).encode("utf-8"))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?)",
+            (key, root_name, headers, stat.st_mtime_ns, stat.st_size),
+        )
+
+    def lookup(self, prefix: str = "") -> Iterator[tuple[str, dict]]:
+        """Yield ``(path, entry)`` for the file ``prefix`` and every file below the directory ``prefix``.
+
+        Paths are source-root relative, ``""`` yields everything.
+        """
+        prefix = prefix.strip("/")
+        if prefix:
+            # "0" sorts right after "/", so the range covers exactly the paths below the prefix.
+            query = "path = ? OR (path >= ? AND path < ?)"
+            params = (prefix, f"{prefix}/", f"{prefix}0")
+        else:
+            query, params = "1", ()
+        rows = self.conn.execute(
+            f"SELECT path, data FROM files JOIN blobs ON blobs.id = files.blob WHERE {query} ORDER BY path",
+            params,
+        )
+        for path, data in rows:
+            yield path, json.loads(zlib.decompress(data))
+
+    def export(self, out_path: str) -> int:
+        """Write the per-target JSON layout of ``<tree>-license`` to ``out_path``, return the number of targets."""
+        targets = self.conn.execute("SELECT key, root_name, headers FROM targets ORDER BY key").fetchall()
+        for key, root_name, headers in targets:
+            parent = key.rsplit("/", 1)[0] if "/" in key else ""
+            strip = len(f"{parent}/{root_name}/") if parent else len(f"{root_name}/")
+            rows = self.conn.execute(
+                "SELECT path, data FROM files JOIN blobs ON blobs.id = files.blob WHERE target = ?", (key,)
+            )
+            entries = {path[strip:]: json.loads(zlib.decompress(data)) for path, data in rows}
+
+            result_file = os.path.join(out_path, f"{key}.json")
+            os.makedirs(os.path.dirname(result_file), exist_ok=True)
+            with open(result_file, "w", encoding="utf-8") as f:
+                json.dump(assemble_result(root_name, entries, json.loads(zlib.decompress(headers))), f)
+        return len(targets)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact scan results into one store, query or export it")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="import a <tree>-license directory")
+    compact_parser.add_argument("result_path", help="directory with the per-target JSON files")
+    compact_parser.add_argument("db_path", help="store to update")
+
+    lookup_parser = subparsers.add_parser("lookup", help="print the license of every file below a path")
+    lookup_parser.add_argument("db_path", help="store to query")
+    lookup_parser.add_argument("prefix", nargs="?", default="", help="source-root relative file or directory")
+
+    export_parser = subparsers.add_parser("export", help="recreate the <tree>-license layout")
+    export_parser.add_argument("db_path", help="store to export")
+    export_parser.add_argument("out_path", help="directory to write the per-target JSON files to")
+
+    args = parser.parse_args()
+    store = ResultStore(args.db_path)
+    if args.command == "compact":
+        print(store.compact(args.result_path))
+    elif args.command == "lookup":
+        for path, entry in store.lookup(args.prefix):
+            print(f"{path}\t{entry['detected_license_expression_spdx'] or ''}")
+    else:
+        print(f"exported {store.export(args.out_path)} target(s) to {args.out_path}")
+    store.close()
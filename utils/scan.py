@@ -1,8 +1,46 @@
 import os
-import re
+import copy
+import glob
+import shutil
 import platform
+import tempfile
 import subprocess
+import configparser
 import json
+from typing import Iterable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import ScanScheduler, split_cpu_budget
+from .distributed import DEFAULT_LEASE_TIMEOUT, Coordinator
+from .scan_cache import ScanCache, file_digest
+from .incremental import RevisionTracker
+from .planner import ScanHistory, ShardPlanner
+from .result_store import EMPTY_DETECTION, ResultStore, assemble_result, relocate_entry
+from .workers import WorkerUnavailable, get_worker
+from .prefilter import PreFilter, load_ignore_patterns, write_report
+from .metrics import ScanMetrics
+from .journal import ScanJournal
+from .fastpath import HeaderClassifier, sampled
+from .quarantine import Quarantine, timed_out
+from .supervisor import forward_signals, get_supervisor
+from .gn import (
+    FILE_FIELDS,
+    PathTrie,
+    collect_target_files,
+    default_roots,
+    dependency_closure,
+    iter_targets,
+    label_dir,
+    read_dependency_graph,
+    target_key,
+)
+
+
+SCAN_OPTIONS = '--ignore=".*" --license'
+STALL_TAIL_LINES = 50
+# Mismatches listed per scan, the counts stay exact. Worker results carry them in an HTTP header.
+FASTPATH_MISMATCH_LIMIT = 100
 
 
 def normalize_path(input_path: str, prefix: str) -> str:
@@ -13,26 +51,375 @@ def normalize_path(input_path: str, prefix: str) -> str:
     return rel_path
 
 
+def write_result(output_path: str, result: dict) -> None:
+    """Write a result JSON atomically, a crash leaves either the old file or the complete new one."""
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_path, output_path)
+
+
+def select_target_dirs(labels: Iterable[str], prefix: str) -> list[str]:
+    """Map GN labels to the existing directories to scan.
+
+    Every label is truncated to its target key, labels pointing at a file use its directory,
+    directories nested in an already selected one are folded into it.
+    """
+    trie = PathTrie()
+    for label in labels:
+        rel = target_key(label_dir(label))
+        if trie.covers(rel):
+            continue
+
+        node = os.path.join(prefix, rel)
+        if os.path.isfile(node):
+            rel = os.path.dirname(rel)
+        elif not os.path.exists(node):
+            continue
+        trie.add(rel)
+
+    return [os.path.join(prefix, *rel.split("/")) for rel in trie]
+
+
+def list_files(project_path: str) -> list[str]:
+    """List the regular files scancode would scan under ``project_path`` with ``--ignore=".*"``."""
+    files = []
+    for root, dirs, names in os.walk(project_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            if not name.startswith(".") and os.path.isfile(file_path) and not os.path.islink(file_path):
+                files.append(file_path)
+    return files
+
+
 class SCToolkit:
-    """"""
-    def __init__(self, scancode_path: str, tmp_path: str = "tmp/", number: int = 11) -> None:
+    """Thin wrapper around the bundled scancode-toolkit.
+
+    Args:
+        scancode_path: Directory of the scancode-toolkit release.
+        tmp_path: Directory the per-target result JSON files are written to.
+        number: Number of processes of each scancode invocation (``scancode -n``).
+        cache: Optional per-file result cache, when given only files with unseen content
+            are handed to scancode and the per-target JSON is rebuilt from cached detections.
+        warm: Scan through a long-lived scancode worker per process instead of one CLI run
+            per target, the CLI stays the fallback when no worker can be started.
+        fastpath: Resolve files with an unambiguous SPDX line or Apache-2.0 header without
+            scancode, see ``HeaderClassifier``.
+        verify: Fraction of the fast path files that are scanned by scancode as well, the
+            scancode result is kept and differences are reported.
+        file_timeout: Seconds scancode may spend on one file (``scancode --timeout``).
+        target_timeout: Seconds one scancode invocation may run before it is killed.
+        stall_timeout: Seconds without a file finishing before an invocation is killed.
+        quarantine: Files that ran into a limit are recorded here and get a header-only
+            fallback entry; a killed invocation is split until the stalling file is alone.
+    """
+    def __init__(
+        self,
+        scancode_path: str,
+        tmp_path: str = "tmp/",
+        number: int = 11,
+        cache: ScanCache = None,
+        warm: bool = False,
+        fastpath: HeaderClassifier = None,
+        verify: float = 0.0,
+        file_timeout: float = None,
+        target_timeout: float = None,
+        stall_timeout: float = None,
+        quarantine: Quarantine = None,
+    ) -> None:
         self.scancode_path = os.path.normpath(scancode_path)
         self.tmp_path = os.path.normpath(tmp_path)
+        self.staging_path = f"{self.tmp_path}.staging"
         self.number = number
+        self.cache = cache
+        self.warm = warm
+        self.fastpath = fastpath
+        self.verify = verify
+        self.file_timeout = file_timeout
+        self.target_timeout = target_timeout
+        self.stall_timeout = stall_timeout
+        self.quarantine = quarantine
         self._check_toolkit()
 
-    def scan_license(self, project_path: str, callback: callable = None, prefix: str = None) -> str:
-        store_path = normalize_path(project_path, prefix)
-        os.makedirs(os.path.dirname(f"{self.tmp_path}/{store_path}.json"), exist_ok=True)
-        result = subprocess.run(
-            f'{self.scaner_path} -n {self.number} --ignore=".*" --license --json {self.tmp_path}/{store_path}.json {project_path}',
+    @property
+    def version(self) -> str:
+        """Version of the scancode-toolkit release, ``unknown`` if it can not be determined."""
+        parser = configparser.ConfigParser()
+        parser.read(os.path.join(self.scancode_path, "setup.cfg"))
+        return parser.get("metadata", "version", fallback="unknown")
+
+    def result_file(self, project_path: str, prefix: str) -> str:
+        """Return the path of the per-target result JSON of ``project_path``."""
+        return f"{self.tmp_path}/{normalize_path(project_path, prefix)}.json"
+
+    def shard_file(self, project_path: str, prefix: str, name: str) -> str:
+        """Return the path of a partial result, not ending in ``.json`` so it is never read as a result."""
+        return f"{self.result_file(project_path, prefix)}.shard-{name}"
+
+    def scan_license(
+        self, project_path: str, callback: callable = None, prefix: str = None, files: list[str] = None
+    ) -> tuple[str, str, str, dict]:
+        output_path = self.result_file(project_path, prefix)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        if files is not None:
+            stdout, stderr, fastpath = self.scan_files(project_path, files, output_path)
+        elif self.cache is not None or self.fastpath is not None or self.quarantine is not None:
+            stdout, stderr, fastpath = self.scan_files(project_path, list_files(project_path), output_path)
+        else:
+            # scancode writes its JSON incrementally, only a complete file may take the result's name.
+            stdout, stderr = self._run_scancode(project_path, f"{output_path}.tmp")
+            os.replace(f"{output_path}.tmp", output_path)
+            fastpath = None
+        return output_path, stdout, stderr, fastpath
+
+    def scan_shard(self, project_path: str, prefix: str, files: list[str], name: str) -> tuple[str, str, str, dict]:
+        """Scan a slice of a target's files into a partial result, see ``merge_shards``."""
+        output_path = self.shard_file(project_path, prefix, name)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        stdout, stderr, fastpath = self.scan_files(project_path, files, output_path)
+        return output_path, stdout, stderr, fastpath
+
+    def merge_shards(self, project_path: str, prefix: str, names: list[str]) -> str:
+        """Merge the partial results of a split target into its per-target JSON and drop them."""
+        output_path = self.result_file(project_path, prefix)
+        root_name = os.path.basename(os.path.normpath(project_path))
+
+        headers, entries = [], {}
+        for name in names:
+            with open(self.shard_file(project_path, prefix, name), "r", encoding="utf-8") as f:
+                result = json.load(f)
+            headers.extend(result.get("headers", []))
+            for entry in result.get("files", []):
+                if entry.get("type") == "file":
+                    entries[entry["path"].split("/", 1)[-1]] = {k: v for k, v in entry.items() if k != "path"}
+
+        write_result(output_path, assemble_result(root_name, entries, headers))
+
+        for stale in glob.glob(glob.escape(f"{output_path}.shard-") + "*"):
+            os.remove(stale)
+        return output_path
+
+    def scan_files(self, root: str, files: list[str], output_path: str) -> tuple[str, str, dict]:
+        """Scan an explicit list of files below ``root`` into one scancode compatible JSON.
+
+        Files already known to the cache are not scanned again, files sharing the same content
+        are scanned only once.
+
+        Returns:
+            tuple[str, str, dict]: stdout and stderr of the scan, and the fast path counts
+            ``{"files", "resolved", "verified", "mismatched", "mismatches"}``, ``None`` when the
+            fast path is off. Only files that got the fast path entry count as resolved, the
+            verified ones got scancode's.
+        """
+        root = os.path.normpath(root)
+        root_name = os.path.basename(root)
+
+        digests = {}
+        for file_path in files:
+            rel = os.path.relpath(file_path, root).replace(os.sep, "/")
+            digests[rel] = file_digest(file_path)
+
+        known = self.cache.get_many(list(digests.values())) if self.cache is not None else {}
+        todo = {}
+        for rel, digest in digests.items():
+            if digest not in known:
+                todo.setdefault(digest, rel)
+        missed = {digest for digest in digests.values() if digest not in known}
+
+        # Files that ran into a time limit before are not handed to scancode again.
+        skipped = 0
+        if self.quarantine is not None:
+            for digest in [digest for digest in todo if digest in self.quarantine]:
+                known[digest] = self._fallback(os.path.join(root, todo.pop(digest)), self.quarantine.entries[digest]["reason"])
+                skipped += 1
+
+        # Fast path entries are not cached, classifying a header is about as cheap as a cache lookup.
+        fast, checks = {}, {}
+        if self.fastpath is not None:
+            for digest, rel in list(todo.items()):
+                try:
+                    entry = self.fastpath.classify(os.path.join(root, rel))
+                except OSError:
+                    entry = None
+                if entry is None:
+                    continue
+                if sampled(digest, self.verify):
+                    checks[digest] = entry
+                else:
+                    fast[digest] = todo.pop(digest)
+                    known[digest] = entry
+
+        stdout, stderr = "", ""
+        if todo:
+            scanned, stdout, stderr = self._scan_isolating(
+                root_name, {rel: os.path.join(root, rel) for rel in todo.values()}, {rel: digest for digest, rel in todo.items()}
+            )
+            fresh = {digest: scanned[rel] for digest, rel in todo.items() if rel in scanned}
+            if self.cache is not None:
+                self.cache.put_many({digest: entry for digest, entry in fresh.items() if not entry.get("scan_errors")})
+            known.update(fresh)
+
+        mismatched = []
+        for digest, entry in checks.items():
+            actual = known.get(digest, {}).get("detected_license_expression")
+            if actual != entry["detected_license_expression"]:
+                mismatched.append(f"{root_name}/{todo[digest]}: {entry['detected_license_expression']}, scancode {actual}")
+
+        entries = {rel: known[digest] for rel, digest in digests.items() if digest in known}
+        resolved = sum(1 for digest in digests.values() if digest in fast)
+        verified = sum(1 for digest in digests.values() if digest in checks)
+        headers = [
+            {
+                "tool_name": "scancode-toolkit",
+                "tool_version": self.version,
+                "options": {"input": [root], "--license": True, "--ignore": [".*"]},
+                "extra_data": {
+                    "files_count": len(digests),
+                    "unique_files_count": len(set(digests.values())),
+                    "scanned_files_count": len(todo),
+                    **(
+                        {"fastpath_files_count": resolved, "fastpath_verified_count": verified}
+                        if self.fastpath is not None
+                        else {}
+                    ),
+                },
+            }
+        ]
+        write_result(output_path, assemble_result(root_name, entries, headers))
+
+        fastpath = None
+        if self.fastpath is None:
+            stdout += f"{len(digests)} files, {len(digests) - len(todo)} reused, {len(todo)} scanned\n"
+        else:
+            pending = sum(1 for digest in digests.values() if digest in missed)
+            stdout += (
+                f"{len(digests)} files, {len(digests) - pending} reused, {len(todo)} scanned, "
+                f"{resolved} by header fast path, {verified} verified, {len(mismatched)} mismatched\n"
+            )
+            stdout += "".join(f"header fast path mismatch on {mismatch}\n" for mismatch in mismatched)
+            fastpath = {
+                "files": len(digests),
+                "resolved": resolved,
+                "verified": verified,
+                "mismatched": len(mismatched),
+                "mismatches": mismatched[:FASTPATH_MISMATCH_LIMIT],
+            }
+        if skipped:
+            stdout += f"{skipped} quarantined file(s) not scanned\n"
+        return stdout, stderr, fastpath
+
+    def _scan_isolating(
+        self, root_name: str, files: dict[str, str], digests: dict[str, str]
+    ) -> tuple[dict[str, dict], str, str]:
+        """``_scan_staged`` that narrows a scan killed by a time limit down to the file causing it.
+
+        The files of a killed scan are scanned again in two halves, recursively, until the file
+        that stalls is alone and goes to the quarantine. Files scancode itself gave up on with
+        its per-file timeout are quarantined as well. Quarantined files get the fallback entry.
+        """
+        try:
+            entries, stdout, stderr = self._scan_staged(root_name, files)
+        except subprocess.TimeoutExpired:
+            if self.quarantine is None:
+                raise
+            if len(files) == 1:
+                (rel, file_path), = files.items()
+                self.quarantine.add(digests[rel], file_path, "stalled")
+                return {rel: self._fallback(file_path, "stalled")}, f"quarantined {rel}: scan did not finish in time\n", ""
+            items = list(files.items())
+            first = self._scan_isolating(root_name, dict(items[: len(items) // 2]), digests)
+            second = self._scan_isolating(root_name, dict(items[len(items) // 2 :]), digests)
+            return {**first[0], **second[0]}, first[1] + second[1], first[2] + second[2]
+
+        if self.quarantine is not None:
+            for rel, entry in list(entries.items()):
+                if timed_out(entry) and rel in files:
+                    self.quarantine.add(digests[rel], files[rel], "file timeout")
+                    entries[rel] = self._fallback(files[rel], "file timeout")
+                    stdout += f"quarantined {rel}: scancode timed out on it\n"
+        return entries, stdout, stderr
+
+    @staticmethod
+    def _fallback(file_path: str, reason: str) -> dict:
+        """Entry of a quarantined file, its license header if it has a clear one, else no detection."""
+        try:
+            entry = HeaderClassifier().classify(file_path)
+        except OSError:
+            entry = None
+        entry = entry or copy.deepcopy(EMPTY_DETECTION)
+        entry["scan_errors"] = [f"quarantined ({reason}), not scanned by scancode"]
+        return entry
+
+    def _scan_staged(self, root_name: str, files: dict[str, str]) -> tuple[dict[str, dict], str, str]:
+        """Scan ``{relative path: file path}`` through a staging copy laid out like the original tree.
+
+        Returns:
+            tuple: ``{relative path: file entry without path}``, stdout and stderr.
+        """
+        os.makedirs(self.staging_path, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.staging_path)
+        try:
+            stage_root = os.path.join(staging, root_name)
+            for rel, file_path in files.items():
+                staged = os.path.join(stage_root, rel)
+                os.makedirs(os.path.dirname(staged), exist_ok=True)
+                try:
+                    os.link(file_path, staged)
+                except OSError:
+                    shutil.copy2(file_path, staged)
+
+            output_path = os.path.join(staging, "result.json")
+            stdout, stderr = self._run_scancode(stage_root, output_path)
+            with open(output_path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        entries = {}
+        for entry in result.get("files", []):
+            if entry.get("type") != "file":
+                continue
+            rel = entry.pop("path").split("/", 1)[-1]
+            entries[rel] = relocate_entry(entry, None)
+        return entries, stdout, stderr
+
+    def _run_scancode(self, input_path: str, output_path: str) -> tuple[str, str]:
+        """Run scancode on ``input_path``.
+
+        Raises:
+            subprocess.TimeoutExpired: If the target timeout or the stall watchdog stopped it.
+            subprocess.CalledProcessError: If scancode failed without writing a result.
+        """
+        if self.warm:
+            try:
+                return get_worker(self.scancode_path).scan(
+                    input_path, output_path, self.number, self.file_timeout, self.target_timeout
+                )
+            except WorkerUnavailable:
+                pass
+
+        options = f" --timeout {self.file_timeout}" if self.file_timeout else ""
+        tail = None
+        if self.stall_timeout:
+            # --verbose prints a line per finished file, that is what the watchdog listens for.
+            options += " --verbose"
+            tail = deque(maxlen=STALL_TAIL_LINES)
+        result = get_supervisor().run(
+            f'{self.scaner_path} -n {self.number} {SCAN_OPTIONS}{options} --json {output_path} {input_path}',
             shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+            merge_stderr=tail is not None,
+            on_line=tail.append if tail is not None else None,
+            timeout=self.target_timeout,
+            stall_timeout=self.stall_timeout,
         )
-        return f"{self.tmp_path}/{store_path}.json", result.stdout, result.stderr
+        stdout = "".join(tail) if tail is not None else result.stdout
+        if result.returncode != 0 and result.stopped is None and os.path.exists(output_path):
+            # scancode exits non-zero when a file had scan errors, e.g. hit --timeout, the result is complete.
+            return stdout, result.stderr
+        result.check()
+        return stdout, result.stderr
 
     def _check_toolkit(self):
         if platform.system().lower() == "windows":
@@ -59,59 +446,335 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("prefix", help="prefix")
+    parser.add_argument(
+        "--product_name", nargs="+", default=["rk3568"], help="products whose out.json list the targets, the union is scanned"
+    )
+    parser.add_argument("--gn_file", nargs="+", help="GN out.json files, default to <prefix>out/<product_name>/out.json")
+    parser.add_argument(
+        "--mode",
+        choices=["dir", "files"],
+        default="dir",
+        help="scan whole target directories or only the files GN targets reference plus their license files",
+    )
     
-    parser.add_argument("--n", type=int, default=11, help="thread number")
+    parser.add_argument("--n", type=int, default=None, help="scancode processes per job, derived from --cpus by default")
+    parser.add_argument("--jobs", type=int, default=None, help="concurrent scancode jobs, derived from --cpus by default")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count(), help="global CPU budget shared by all jobs")
+    parser.add_argument("--cache", default="scancode-cache.sqlite", help="per-file scan result cache shared across runs")
+    parser.add_argument("--cache_size", type=float, default=4, help="cache size limit in GiB")
+    parser.add_argument("--no_cache", action="store_true", help="scan whole directories without the per-file cache")
+    parser.add_argument("--incremental", action="store_true", help="rescan only targets under repo projects whose revision moved")
+    parser.add_argument("--prune", action="store_true", help="scan only targets the product images depend on")
+    parser.add_argument("--prefilter", action="store_true", help="drop binaries, LFS pointers, prebuilts and generated files before scanning")
+    parser.add_argument("--prefilter_config", help="JSON of per-product path ignore patterns, see utils/prefilter.py")
+    parser.add_argument("--max_file_size", type=float, default=10, help="largest file in MiB the pre-filter keeps")
+    parser.add_argument("--warm", action="store_true", help="keep one warm scancode worker per job instead of a CLI run per target")
+    parser.add_argument(
+        "--fastpath", action="store_true", help="resolve files with a single SPDX line or the Apache-2.0 header without scancode"
+    )
+    parser.add_argument(
+        "--fastpath_verify", type=float, default=0.0, help="fraction of fast path files to cross-check with scancode, e.g. 0.01"
+    )
+    parser.add_argument(
+        "--file_timeout", type=float, help="seconds scancode may spend on one file, scancode's own default is 120"
+    )
+    parser.add_argument("--target_timeout", type=float, help="seconds one scancode run may take before it is killed")
+    parser.add_argument(
+        "--stall_timeout",
+        type=float,
+        help="kill a scancode run when no file finished for this many seconds, not available with --warm",
+    )
+    parser.add_argument("--compact", action="store_true", help="also compact the results into <result dir>.db, the JSON results are kept")
+    parser.add_argument("--max_attempts", type=int, default=3, help="failed scans of a target before it is given up")
+    parser.add_argument("--shard_cost", type=float, help="largest estimated seconds of one shard, split targets above it")
+    parser.add_argument("--roots", nargs="+", help="GN labels to walk dependencies from, defaults to the image targets")
+    parser.add_argument(
+        "--coordinator",
+        help="HOST:PORT to serve the shards on for `python -m utils.distributed` workers instead of scanning locally, "
+        "--jobs is then the expected number of workers",
+    )
+    parser.add_argument("--metrics", help="write throughput, per-target latency and timing of the scan to this JSON file")
+    parser.add_argument("--lease_timeout", type=float, default=DEFAULT_LEASE_TIMEOUT, help="seconds before a silent worker's shard is reassigned")
     args = parser.parse_args()
+    if args.warm and args.stall_timeout:
+        # A warm worker reports only when its scan is done, there is no progress to watch.
+        parser.error("--stall_timeout needs per-file progress and can not be combined with --warm")
+    forward_signals()
 
     prefix = args.prefix
-    number = args.n
+    jobs, number = split_cpu_budget(args.cpus, args.jobs, args.n)
     result_path = os.path.normpath(f"./{prefix.strip(os.sep).split(os.sep)[-1]}-license")
-    gn_out_path = os.path.normpath(f"{prefix}out/rk3568/out.json")
-    sct = SCToolkit("./scancode-toolkit", result_path, number)
-
-    nodes = json.load(open(gn_out_path, "r"))["targets"].keys()
-
-    tgts = set()
-    back_tgts = set()
-    for node in nodes:
+    gn_out_paths = [
+        os.path.normpath(path) for path in args.gn_file or [f"{prefix}out/{product}/out.json" for product in args.product_name]
+    ]
+    sct = SCToolkit(
+        "./scancode-toolkit",
+        result_path,
+        number,
+        warm=args.warm,
+        fastpath=HeaderClassifier() if args.fastpath else None,
+        verify=args.fastpath_verify,
+        file_timeout=args.file_timeout,
+        target_timeout=args.target_timeout,
+        stall_timeout=args.stall_timeout,
+        # Without limits the quarantine stays off and --no_cache keeps scanning whole directories.
+        quarantine=Quarantine(result_path) if args.file_timeout or args.target_timeout or args.stall_timeout else None,
+    )
+    # Hardlinks of a run that was killed before it could clean up.
+    shutil.rmtree(sct.staging_path, ignore_errors=True)
+    if not args.no_cache:
+        sct.cache = ScanCache(args.cache, namespace=f"{sct.version} {SCAN_OPTIONS}", max_bytes=int(args.cache_size * 1024**3))
 
-        node = "/".join(re.sub(r"//|:.+$", "", node).split(os.sep)[:3])
-        node = os.path.join(prefix, node)
+    console = Console()
+    reachable = None
+    if args.prune:
+        reachable, labels, all_dirs, kept_dirs = set(), set(), set(), set()
+        for gn_out_path in gn_out_paths:
+            graph = read_dependency_graph(gn_out_path)
+            roots = args.roots or default_roots(graph)
+            closure = dependency_closure(graph, roots)
+            if not closure:
+                console.print(f"none of the root targets {roots} found in {gn_out_path}, nothing pruned")
+                reachable = None
+                break
+            reachable |= closure
+            labels.update(graph)
+            all_dirs |= {target_key(label_dir(label)) for label in graph}
+            kept_dirs |= {target_key(label_dir(label)) for label in closure}
+            del graph
+        if reachable:
+            console.print(
+                f"pruned {len(labels - reachable)} of {len(labels)} GN targets and "
+                f"{len(all_dirs - kept_dirs)} of {len(all_dirs)} directories unreachable from the root(s) "
+                f"of {len(gn_out_paths)} product(s)"
+            )
 
-        if any(node.startswith(tgt) for tgt in tgts):
-            continue
+    def gn_targets(fields=()):
+        # Several products share most of their targets, a directory is scanned once for all of them.
+        return (
+            (label, target)
+            for gn_out_path in gn_out_paths
+            for label, target in iter_targets(gn_out_path, fields)
+            if reachable is None or label in reachable
+        )
 
-        if os.path.isfile(node):
-            if os.path.exists(os.path.dirname(node)):
-                tgts.add(os.path.dirname(node))
-            continue
+    tgt_files = None
+    if args.mode == "files":
+        tgt_files = {
+            os.path.join(prefix, *key.split("/")): files
+            for key, files in collect_target_files(gn_targets(FILE_FIELDS), prefix).items()
+        }
+        tgts = list(tgt_files)
+    else:
+        tgts = select_target_dirs((label for label, _ in gn_targets()), prefix)
 
-        if not os.path.exists(node):
-            continue
+    keys = {tgt: normalize_path(tgt, prefix=prefix).replace(os.sep, "/") for tgt in tgts}
+    if args.incremental:
+        try:
+            report = RevisionTracker(prefix, sct.tmp_path).invalidate()
+            console.print(
+                f"incremental: {len(report['changed'])} project(s) changed, {len(report['removed'])} removed, "
+                f"{len(report['invalidated'])} result(s) invalidated"
+            )
+        except FileNotFoundError:
+            console.print(f"no repo checkout found at {prefix}, incremental mode disabled")
 
-        tgts.add(node)
+    journal = ScanJournal(sct.tmp_path, args.max_attempts)
+    if journal.lost():
+        console.print(f"{len(journal.lost())} target(s) were interrupted by the previous run and will be redone")
 
-    console = Console()
+    console.print(f"scanning with {jobs} concurrent job(s) x {number} scancode process(es)")
     with Progress(console=console) as progress:
         task = progress.add_task("[cyan]Scanning licenses...", total=len(tgts))
-        for idx, tgt in enumerate(tgts):
-            console.print(f"current target path: {tgt}, remain file number: {len(tgts) - idx}")
-            new_tgt = normalize_path(tgt, prefix=prefix)
 
-            if os.path.exists(f"{sct.tmp_path}{os.path.sep}{new_tgt}.json"):
-                console.print(f"{sct.tmp_path}{os.path.sep}{new_tgt}.json already exists, next ..")
+        pending = {}
+        gave_up = []
+        for tgt in sorted(tgts):
+            result_file = sct.result_file(tgt, prefix)
+
+            if journal.is_done(keys[tgt], result_file):
+                console.print(f"{result_file} already exists, next ..")
                 progress.update(task, advance=1)
                 continue
+            if journal.gave_up(keys[tgt]):
+                gave_up.append(tgt)
+                progress.update(task, advance=1)
+                continue
+            pending[tgt] = (tgt_files or {}).get(tgt)
 
-            try:
-                result_path, stdout, stderr = sct.scan_license(tgt, callback=None, prefix=prefix)
-                console.print(f"scan result path: {result_path}")
-                console.print(stdout)
-                if stderr:
-                    console.print(f"stderr: {stderr}")
+        if args.prefilter:
+            prefilter = PreFilter(
+                prefix,
+                # A path is only ignored if every product ignores it, the results are shared.
+                sorted(
+                    set.intersection(
+                        *(set(load_ignore_patterns(args.prefilter_config, product)) for product in args.product_name)
+                    )
+                ),
+                int(args.max_file_size * 1024**2),
+            )
+            with ThreadPoolExecutor(max_workers=args.cpus) as executor:
+                filtered = list(
+                    executor.map(
+                        lambda tgt: prefilter.filter(pending[tgt] if pending[tgt] is not None else list_files(tgt)),
+                        pending,
+                    )
+                )
+            skipped = []
+            for tgt, (kept, dropped) in zip(list(pending), filtered):
+                pending[tgt] = kept
+                skipped.extend(dropped)
+            kept = [file_path for files in pending.values() for file_path in files]
+            summary = write_report(
+                f"{sct.tmp_path}.prefilter.json", prefix, len(kept), sum(map(os.path.getsize, kept)), skipped
+            )
+            console.print(
+                f"pre-filter: kept {summary['kept']['files']} file(s) ({summary['kept']['bytes'] / 1024**2:.1f} MiB), "
+                f"skipped {summary['skipped']['files']} ({summary['skipped']['bytes'] / 1024**2:.1f} MiB): "
+                + ", ".join(f"{reason} {total['files']}" for reason, total in sorted(summary["reasons"].items()))
+            )
 
-            except Exception as e:
-                console.print(f"error: {e}")
+        history = ScanHistory(sct.tmp_path)
+        planner = ShardPlanner(jobs, list_files, history=history, shard_cost=args.shard_cost)
+        shards = planner.plan(pending, keys)
+        console.print(
+            f"planned {len(shards)} shard(s) for {len(pending)} target(s), "
+            f"{sum(shard.count > 1 for shard in shards)} shard(s) from split targets, "
+            f"estimated {sum(shard.cost for shard in shards) / 3600:.1f} scan hour(s)"
+        )
 
-            finally:
-                progress.update(task, advance=1)
+        # Split targets are merged once all of their shards exist, shards finished by an
+        # interrupted run are reused.
+        split = {}
+        for shard in shards:
+            if shard.count > 1:
+                split.setdefault(shard.target, []).append(shard)
+        remaining = {
+            tgt: {s.name for s in parts if not os.path.exists(sct.shard_file(tgt, prefix, s.name))}
+            for tgt, parts in split.items()
+        }
+        failed = {}
+        elapsed = {}
+        shards = [s for s in shards if s.count == 1 or s.name in remaining[s.target]]
+        metrics = ScanMetrics(sum(shard.cost for shard in shards))
+
+        def finish(tgt):
+            if tgt in split:
+                sct.merge_shards(tgt, prefix, [s.name for s in split[tgt]])
+            journal.done(keys[tgt], sct.result_file(tgt, prefix))
+            if tgt in elapsed:
+                history.record(keys[tgt], elapsed[tgt], *planner.measured[tgt])
+                metrics.target_done(keys[tgt], elapsed[tgt], *planner.measured[tgt])
+            progress.update(task, advance=1)
+
+        def fail(tgt, error):
+            journal.failed(keys[tgt], str(error))
+            metrics.target_failed(keys[tgt])
+            progress.update(task, advance=1)
+
+        for tgt in [tgt for tgt, names in remaining.items() if not names]:
+            finish(tgt)
+
+        started = set()
+
+        def dispatched(shard):
+            # Recorded when the first shard of a target starts, a crash only loses what was running.
+            if shard.target not in started:
+                started.add(shard.target)
+                journal.running(keys[shard.target])
+
+        if args.coordinator:
+            host, port = args.coordinator.rsplit(":", 1)
+            scheduler = Coordinator(sct, host, int(port), args.lease_timeout)
+            console.print(f"serving {len(shards)} shard(s) on http://{args.coordinator}")
+        else:
+            scheduler = ScanScheduler(sct, jobs)
+
+        try:
+            for idx, (shard, result, seconds, error) in enumerate(scheduler.run(shards, prefix, on_dispatch=dispatched)):
+                tgt = shard.target
+                label = tgt if shard.count == 1 else f"{tgt} (shard {shard.index + 1}/{shard.count})"
+                metrics.shard_done(shard.cost)
+                eta = metrics.eta()
+                console.print(
+                    f"finished target path: {label}, remain shard number: {len(shards) - idx - 1}"
+                    + (f", eta {eta / 60:.0f} min" if eta is not None else "")
+                )
+                if error is not None:
+                    console.print(f"error: {error}")
+                    failed[tgt] = error
+                else:
+                    result_path, stdout, stderr, fastpath = result
+                    console.print(f"scan result path: {result_path}")
+                    console.print(stdout)
+                    if fastpath is not None:
+                        metrics.fastpath_done(**fastpath)
+                    if stderr:
+                        console.print(f"stderr: {stderr}")
+                    elapsed[tgt] = elapsed.get(tgt, 0.0) + seconds
+
+                if shard.count > 1:
+                    remaining[tgt].discard(shard.name)
+                    if remaining[tgt]:
+                        continue
+
+                if tgt in failed:
+                    fail(tgt, failed[tgt])
+                else:
+                    finish(tgt)
+        finally:
+            history.save()
+            journal.close()
+            shutil.rmtree(sct.staging_path, ignore_errors=True)
+            if args.metrics:
+                metrics.write(args.metrics)
+
+    summary = metrics.summary()
+    console.print(
+        f"scanned {summary['files']} file(s), {summary['bytes'] / 1024**2:.1f} MiB in {summary['elapsed'] / 60:.1f} min "
+        f"({summary['files_per_second']:.1f} files/s, {summary['bytes_per_second'] / 1024**2:.2f} MiB/s), "
+        f"target latency p50 {summary['latency']['p50']:.0f}s p90 {summary['latency']['p90']:.0f}s "
+        f"p99 {summary['latency']['p99']:.0f}s"
+    )
+
+    if summary.get("fastpath"):
+        fastpath = summary["fastpath"]
+        console.print(
+            f"header fast path resolved {fastpath['resolved']} of {fastpath['files']} file(s) "
+            f"({fastpath['resolved'] / max(1, fastpath['files']):.1%}), {fastpath['verified']} verified against scancode, "
+            f"{fastpath['mismatched']} mismatched"
+        )
+        for mismatch in fastpath["mismatches"]:
+            console.print(f"  fast path mismatch {mismatch}")
+
+    quarantined = sct.quarantine.since(metrics.started) if sct.quarantine is not None else []
+    if sct.quarantine is not None and len(sct.quarantine):
+        console.print(
+            f"quarantine: {len(quarantined)} file(s) added this run, {len(sct.quarantine)} in total, "
+            f"scanned by header only, delete {sct.quarantine.path} to retry them"
+        )
+        for entry in quarantined:
+            console.print(f"  {entry['reason']}: {entry['path']}")
+
+    for tgt in gave_up:
+        console.print(
+            f"gave up on {tgt} after {journal.attempts(keys[tgt])} failed attempt(s), "
+            f"delete {journal.path} to retry it"
+        )
+
+    if sct.cache is not None:
+        evicted = sct.cache.evict()
+        stats = sct.cache.stats()
+        console.print(
+            f"scan cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+            f"{stats['entries']} entries, {stats['bytes'] / 1024**2:.1f} MiB, {evicted} evicted this run"
+        )
+
+    if args.compact:
+        store = ResultStore(f"{sct.tmp_path}.db")
+        report = store.compact(sct.tmp_path)
+        store.close()
+        console.print(
+            f"result store {sct.tmp_path}.db: {report['targets']} target(s), "
+            f"{report['updated']} updated, {report['removed']} removed"
+        )
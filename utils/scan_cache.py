@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+
+
+DEFAULT_MAX_BYTES = 4 * 1024**3
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path: str) -> str:
+    """Return the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ScanCache:
+    """Content addressed store of per-file scancode detections.
+
+    Entries are keyed by the sha256 of the file content and the scancode options they were
+    produced with, so identical files in different trees, branches or vendored copies are
+    scanned once. The database is size bounded, least recently used entries are evicted
+    first by ``evict``.
+
+    Args:
+        db_path: Path of the SQLite database, created on first use.
+        namespace: Scan configuration the entries belong to, e.g. the scancode options.
+        max_bytes: Upper bound of the stored (compressed) entry size.
+    """
+
+    def __init__(self, db_path: str, namespace: str = "", max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.db_path = os.path.normpath(db_path)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self._conn = None
+
+    def __getstate__(self):
+        # sqlite connections can not cross process boundaries, reconnect lazily in the worker.
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (namespace, digest)
+                );
+                CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+                CREATE TABLE IF NOT EXISTS stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                """
+            )
+        return self._conn
+
+    def get_many(self, digests: list[str]) -> dict[str, dict]:
+        """Look up cached detections, return ``{digest: entry}`` for every hit and count hits/misses."""
+        digests = list(dict.fromkeys(digests))
+        found = {}
+        with self.conn:
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT digest, data FROM entries WHERE namespace = ? AND digest IN ({','.join('?' * len(chunk))})",
+                    [self.namespace, *chunk],
+                ).fetchall()
+                for digest, data in rows:
+                    found[digest] = json.loads(zlib.decompress(data))
+
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE namespace = ? AND digest = ?",
+                [(now, self.namespace, digest) for digest in found],
+            )
+            self._bump(hits=len(found), misses=len(digests) - len(found))
+        return found
+
+    def put_many(self, entries: dict[str, dict]) -> None:
+        """Store ``{digest: entry}``, entries must not contain path specific fields."""
+        now = time.time()
+        rows = []
+        for digest, entry in entries.items():
+            data = zlib.compress(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+            rows.append((self.namespace, digest, data, len(data), now))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the cache fits ``max_bytes``, return the number dropped."""
+        with self.conn:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            victims = []
+            for namespace, digest, size in self.conn.execute(
+                "SELECT namespace, digest, size FROM entries ORDER BY last_used"
+            ):
+                if total <= self.max_bytes:
+                    break
+                victims.append((namespace, digest))
+                total -= size
+
+            self.conn.executemany("DELETE FROM entries WHERE namespace = ? AND digest = ?", victims)
+            self._bump(evictions=len(victims))
+        return len(victims)
+
+    def stats(self) -> dict:
+        """Return cumulative hit/miss/eviction counters plus the current entry count and size."""
+        result = {"hits": 0, "misses": 0, "evictions": 0}
+        result.update(self.conn.execute("SELECT name, value FROM stats").fetchall())
+        count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        result.update(entries=count, bytes=size)
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = result["hits"] / lookups if lookups else 0.0
+        return result
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _bump(self, **counters: int) -> None:
+        self.conn.executemany(
+            "INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [(name, value) for name, value in counters.items() if value],
+        )
@@ -0,0 +1,59 @@
+"""Warm scancode worker, executed with the Python interpreter of the bundled scancode-toolkit.
+
+The license index is loaded once at startup, afterwards scan requests are read from stdin and
+answered on stdout, one JSON document per line:
+
+    request:  {"input": "...", "output": "...", "processes": 4, "timeout": 120}
+    response: {"ok": true, "stdout": "...", "stderr": "..."} or {"ok": false, "error": "..."}
+
+"complete" is set when the output was written, also when some files had scan errors.
+
+This file must only depend on the standard library and scancode itself.
+"""
+import io
+import os
+import sys
+import json
+import traceback
+import contextlib
+
+
+def main():
+    # Keep the protocol channel private, anything scancode or its children print goes to stderr.
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    from scancode.cli import run_scan
+    from licensedcode.cache import get_index
+
+    get_index()
+    protocol.write(json.dumps({"ready": True}) + "\n")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                with open(request["output"], "w", encoding="utf-8") as output:
+                    success, _ = run_scan(
+                        input=request["input"],
+                        license=True,
+                        ignore=(".*",),
+                        processes=request.get("processes", 1),
+                        timeout=request.get("timeout", 120),
+                        output_json=output,
+                        quiet=True,
+                        return_results=False,
+                    )
+            response = {"ok": bool(success), "complete": True, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+            if not success:
+                response["error"] = "scancode reported scan errors"
+        except Exception:
+            response = {"ok": False, "error": traceback.format_exc(), "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+        protocol.write(json.dumps(response) + "\n")
+
+
+if __name__ == "__main__":
+    main()
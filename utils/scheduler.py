@@ -0,0 +1,91 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .supervisor import forward_signals
+
+
+DEFAULT_PROCESSES_PER_JOB = 4
+
+
+def split_cpu_budget(cpus: int = None, jobs: int = None, processes: int = None) -> tuple[int, int]:
+    """Split a global CPU budget between concurrent scancode jobs and their ``-n`` processes.
+
+    Args:
+        cpus: Total number of CPUs the scan stage may use, defaults to ``os.cpu_count()``.
+        jobs: Number of scancode invocations running at the same time.
+        processes: Number of processes each scancode invocation gets (``scancode -n``).
+
+    Returns:
+        tuple[int, int]: ``(jobs, processes)`` so that ``jobs * processes`` stays within ``cpus``
+        unless both values were given explicitly.
+    """
+    cpus = max(1, cpus or os.cpu_count() or 1)
+
+    if jobs and processes:
+        return jobs, processes
+    if jobs:
+        return jobs, max(1, cpus // jobs)
+    if processes:
+        return max(1, cpus // processes), processes
+
+    processes = min(DEFAULT_PROCESSES_PER_JOB, cpus)
+    return max(1, cpus // processes), processes
+
+
+def scan_target(sct, shard, prefix: str) -> tuple[tuple[str, str, str, dict], float]:
+    """Pool entry point, scan one shard with the given toolkit and time it."""
+    start = time.monotonic()
+    if shard.count > 1:
+        result = sct.scan_shard(shard.target, prefix, shard.files, shard.name)
+    else:
+        result = sct.scan_license(shard.target, callback=None, prefix=prefix, files=shard.files)
+    return result, time.monotonic() - start
+
+
+class ScanScheduler:
+    """Run several scancode invocations at once on a process pool.
+
+    Each worker process blocks on one scancode invocation, scancode itself fans out to
+    ``sct.number`` processes, so ``jobs * sct.number`` is the CPU budget of the scan stage.
+    Shards are submitted in the given order, which the planner makes longest first.
+    """
+
+    def __init__(self, sct, jobs: int = 1) -> None:
+        self.sct = sct
+        self.jobs = max(1, jobs)
+
+    def run(self, shards: list, prefix: str, on_dispatch: callable = None):
+        """Scan all shards and yield ``(shard, result, seconds, error)`` in completion order.
+
+        ``result`` is the ``(result_path, stdout, stderr, fastpath)`` tuple of the scan, ``error`` is the
+        exception raised while scanning, exactly one of both is ``None``. Shards are handed to
+        the pool only when a job is free, ``on_dispatch`` is called with each one at that point.
+        """
+        if not shards:
+            return
+
+        queued = iter(shards)
+        # The workers' scancode runs lead their own process groups, a Ctrl-C must be passed on.
+        with ProcessPoolExecutor(max_workers=min(self.jobs, len(shards)), initializer=forward_signals) as executor:
+            futures = {}
+
+            def dispatch():
+                for shard in queued:
+                    if on_dispatch is not None:
+                        on_dispatch(shard)
+                    futures[executor.submit(scan_target, self.sct, shard, prefix)] = shard
+                    return
+
+            for _ in range(min(self.jobs, len(shards))):
+                dispatch()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = futures.pop(future)
+                    dispatch()
+                    try:
+                        result, seconds = future.result()
+                        yield shard, result, seconds, None
+                    except Exception as e:
+                        yield shard, None, None, e
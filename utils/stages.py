@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+from typing import NamedTuple
+
+
+STATE_FILE = ".pipeline_state"
+
+
+def fingerprint(value) -> str:
+    """Stable digest of any JSON serializable value."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path: str) -> list | None:
+    """``[size, mtime_ns]`` of a file, ``None`` if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def tree_fingerprint(root: str, suffix: str | tuple[str, ...] = "", skip: tuple[str, ...] = ()) -> str | None:
+    """Digest over the paths, sizes and mtimes of the files under ``root`` ending in ``suffix``.
+
+    Directories named in ``skip`` are not descended into.
+    """
+    if not os.path.isdir(root):
+        return None
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if name not in skip)
+        for name in sorted(filenames):
+            if name.endswith(suffix):
+                path = os.path.join(dirpath, name)
+                entries.append([os.path.relpath(path, root), *(file_fingerprint(path) or [])])
+    return fingerprint(entries)
+
+
+class Stage(NamedTuple):
+    name: str
+    run: callable
+    inputs: callable
+    outputs: callable
+    deps: tuple
+
+
+class Pipeline:
+    """Run stages in dependency order, skipping the ones whose inputs and outputs are unchanged.
+
+    A stage's fingerprint covers its own ``inputs()`` and the recorded outputs of the stages it
+    depends on, so a stage that produced something new makes everything downstream run again.
+    A stage is skipped when its fingerprint matches the stored one and ``outputs()`` still
+    returns what it returned after the last successful run. The state is saved after every
+    stage, a failed stage keeps no state and runs again next time.
+
+    Args:
+        state_path: File the fingerprints are stored in.
+        force: Names of stages to run regardless of their fingerprint, ``"all"`` forces every stage.
+        metrics: ``RunMetrics`` to time the stages with.
+        log: Called with a message for every skipped stage.
+    """
+
+    def __init__(self, state_path: str = STATE_FILE, force=(), metrics=None, log=print) -> None:
+        self.state_path = state_path
+        self.force = set(force or ())
+        self.metrics = metrics
+        self.log = log
+        self.stages = {}
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def stage(self, name: str, inputs: callable = dict, outputs: callable = lambda: None, deps=()):
+        """Decorator registering a stage, stages must be registered after their dependencies."""
+
+        def register(run):
+            for dep in deps:
+                if dep not in self.stages:
+                    raise ValueError(f"stage {name} depends on unknown stage {dep}")
+            self.stages[name] = Stage(name, run, inputs, outputs, tuple(deps))
+            return run
+
+        return register
+
+    def fingerprint(self, stage: Stage) -> str:
+        return fingerprint(
+            {
+                "inputs": stage.inputs(),
+                "deps": {dep: self.state.get(dep, {}).get("outputs") for dep in stage.deps},
+            }
+        )
+
+    def up_to_date(self, stage: Stage, current: str) -> bool:
+        recorded = self.state.get(stage.name)
+        if recorded is None or "all" in self.force or stage.name in self.force:
+            return False
+        return recorded["inputs"] == current and recorded["outputs"] == stage.outputs()
+
+    def run(self) -> None:
+        for stage in self.stages.values():
+            current = self.fingerprint(stage)
+            if self.up_to_date(stage, current):
+                self.log(f"Stage '{stage.name}' is up to date, skipped (use --force {stage.name} to rerun).")
+                if self.metrics is not None:
+                    self.metrics.add(stage.name, status="skipped")
+                continue
+
+            # Drop the old state first so an interrupted stage is never taken for done.
+            self.state.pop(stage.name, None)
+            self._save()
+            if self.metrics is not None:
+                with self.metrics.stage(stage.name):
+                    stage.run()
+            else:
+                stage.run()
+            self.state[stage.name] = {"inputs": current, "outputs": stage.outputs(), "time": time.time()}
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,378 @@
+import os
+import sys
+import shutil
+import atexit
+import signal
+import asyncio
+import threading
+import itertools
+import subprocess
+from typing import NamedTuple
+from concurrent.futures import Future
+
+
+TERMINATE_GRACE = 10
+DISPLAY_INTERVAL = 0.5
+DRAIN_TIMEOUT = 1
+# Compilers and scancode can print very long lines, asyncio's default limit is 64 KiB.
+LINE_LIMIT = 16 * 1024**2
+# Every child leads its own process group, so stopping it also stops what it spawned (scancode -n
+# workers, the command of a shell). Terminal signals then no longer reach it, see forward_signals.
+if os.name != "posix":
+    GROUP_OPTIONS = {}
+elif sys.version_info >= (3, 11):
+    GROUP_OPTIONS = {"process_group": 0}
+else:
+    GROUP_OPTIONS = {"preexec_fn": os.setpgrp}
+
+
+def _stop_group(process, force: bool = False) -> None:
+    """Terminate, or with ``force`` kill, the process group of a child, just the child where there are no groups."""
+    if os.name != "posix":
+        if process.returncode is None:
+            process.kill() if force else process.terminate()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class ProcessResult(NamedTuple):
+    args: list[str] | str
+    returncode: int
+    stdout: str
+    stderr: str
+    # "timeout", "stall", "abort" or "cancel" when the supervisor stopped the process, None otherwise.
+    stopped: str | None
+
+    def check(self) -> "ProcessResult":
+        """Return the result, raise like ``subprocess.run(check=True)`` if the process failed.
+
+        Raises:
+            subprocess.TimeoutExpired: If the process was stopped by its timeout or the stall watchdog.
+            subprocess.CalledProcessError: If it exited non-zero for any other reason.
+        """
+        if self.stopped in ("timeout", "stall"):
+            raise subprocess.TimeoutExpired(self.args, None, self.stdout, self.stderr)
+        if self.returncode != 0:
+            raise subprocess.CalledProcessError(self.returncode, self.args, self.stdout, self.stderr)
+        return self
+
+
+class ProcessHandle:
+    """A child process run by the supervisor, usable from any thread."""
+
+    def __init__(self, supervisor: "ProcessSupervisor", args, description: str, live: bool = False) -> None:
+        self.supervisor = supervisor
+        self.args = args
+        self.description = description
+        self.live = live
+        self.future = Future()
+        self.started = None
+        self.last_output = None
+        self.pid = None
+        self.process = None
+        self._stop = None
+
+    def result(self, timeout: float = None) -> ProcessResult:
+        """Block until the process ended and return its result.
+
+        Raises:
+            OSError: If the process could not be started, e.g. ``FileNotFoundError``.
+        """
+        return self.future.result(timeout)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self) -> None:
+        """Terminate the process, it is killed if it is still alive after the grace period."""
+        self.supervisor.loop.call_soon_threadsafe(self._request_stop, "cancel")
+
+    def _request_stop(self, reason: str) -> None:
+        if self._stop is not None and not self._stop.done():
+            self._stop.set_result(reason)
+
+
+class ProcessSupervisor:
+    """Run and watch any number of child processes from one asyncio event loop.
+
+    The loop lives in a background thread, so synchronous code and thread pools submit
+    commands and block on their results as before, while all children are monitored
+    together: output is read as it arrives, timeouts are timers, an abort watcher or
+    ``cancel()`` stops a process the moment it fires. A single status line shows every
+    running command that has a description.
+
+    Args:
+        display: Show the status line of described commands on stderr when it is a terminal.
+    """
+
+    def __init__(self, display: bool = True) -> None:
+        self.display = display and sys.stderr.isatty()
+        self.running: dict[ProcessHandle, None] = {}
+        self.loop = asyncio.new_event_loop()
+        self._display_task = None
+        self.thread = threading.Thread(target=self.loop.run_forever, name="process-supervisor", daemon=True)
+        self.thread.start()
+
+    def submit(
+        self,
+        command: list[str] | str,
+        *,
+        shell: bool = False,
+        input: str = None,
+        cwd: str = None,
+        env: dict = None,
+        timeout: float = None,
+        stall_timeout: float = None,
+        merge_stderr: bool = True,
+        on_line: callable = None,
+        passthrough: bool = False,
+        abort_watcher=None,
+        abort_check: callable = None,
+        abort_check_interval: float = 10,
+        description: str = "",
+        live_output: bool = False,
+    ) -> ProcessHandle:
+        """Start ``command`` and return its handle without waiting for it.
+
+        Args:
+            input: Written to stdin, which is then closed. stdin is closed right away without it.
+            stall_timeout: Watchdog, stop the process once it printed nothing for this many seconds.
+            merge_stderr: Read stderr together with stdout, otherwise it is collected separately.
+            on_line: Called with every output line, the lines are then not kept in the result.
+            passthrough: Leave stdout and stderr on this process' terminal, for commands with a
+                progress display of their own. The result has no output then.
+            abort_watcher: Object with ``wait(stop, timeout)`` and ``wake()`` like ``OutputWatcher``,
+                the process is stopped once ``wait`` returns True.
+            abort_check: Polled every ``abort_check_interval`` seconds, stops the process on True.
+            description: Shown in the status line while the process runs.
+            live_output: ``on_line`` prints the output as it arrives. The status line is not
+                drawn while such a command or a ``passthrough`` one runs, it would garble the output.
+        """
+        handle = ProcessHandle(self, command, description, live_output or passthrough)
+        coroutine = self._supervise(
+            handle, command, shell, input, cwd, env, timeout, stall_timeout, merge_stderr, on_line, passthrough,
+            abort_watcher, abort_check, abort_check_interval,
+        )
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return handle
+
+    def run(self, command: list[str] | str, **kwargs) -> ProcessResult:
+        """Run ``command`` to completion, see ``submit`` for the arguments."""
+        return self.submit(command, **kwargs).result()
+
+    async def _supervise(
+        self, handle, command, shell, input, cwd, env, timeout, stall_timeout, merge_stderr, on_line, passthrough,
+        abort_watcher, abort_check, abort_check_interval,
+    ) -> None:
+        stdout = None if passthrough else subprocess.PIPE
+        stderr = None if passthrough else subprocess.STDOUT if merge_stderr else subprocess.PIPE
+        # Created first so a cancel() that arrives during the start is not lost.
+        handle._stop = self.loop.create_future()
+        try:
+            if shell:
+                process = await asyncio.create_subprocess_shell(
+                    command, stdin=subprocess.PIPE, stdout=stdout, stderr=stderr, cwd=cwd, env=env,
+                    limit=LINE_LIMIT, **GROUP_OPTIONS,
+                )
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *map(str, command), stdin=subprocess.PIPE, stdout=stdout, stderr=stderr, cwd=cwd, env=env,
+                    limit=LINE_LIMIT, **GROUP_OPTIONS,
+                )
+        except BaseException as e:
+            handle.future.set_exception(e)
+            return
+
+        handle.pid = process.pid
+        handle.process = process
+        handle.started = handle.last_output = self.loop.time()
+        self.running[handle] = None
+        self._start_display()
+
+        watchers = []
+        if timeout is not None:
+            watchers.append(self.loop.call_later(timeout, handle._request_stop, "timeout"))
+        stop_watching = threading.Event()
+        if abort_watcher is not None:
+            watchers.append(asyncio.ensure_future(self._watch(handle, abort_watcher, stop_watching)))
+        if abort_check is not None:
+            watchers.append(asyncio.ensure_future(self._poll(handle, abort_check, abort_check_interval)))
+        if stall_timeout is not None:
+            watchers.append(asyncio.ensure_future(self._watchdog(handle, stall_timeout)))
+
+        stdout_lines, stderr_lines = [], []
+        try:
+            if input:
+                process.stdin.write(input.encode("utf-8"))
+                try:
+                    await process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            process.stdin.close()
+
+            readers = [] if passthrough else [self._read(handle, process.stdout, on_line, stdout_lines)]
+            if not passthrough and not merge_stderr:
+                readers.append(self._read(handle, process.stderr, None, stderr_lines))
+            finished = asyncio.ensure_future(asyncio.gather(*readers, process.wait()))
+            await asyncio.wait([finished, handle._stop], return_when=asyncio.FIRST_COMPLETED)
+
+            stopped = None
+            drained = True
+            if not finished.done():
+                stopped = handle._stop.result()
+                drained = await self._terminate(process, finished)
+            if drained:
+                await finished
+        except BaseException as e:
+            _stop_group(process, force=True)
+            handle.future.set_exception(e)
+            return
+        finally:
+            stop_watching.set()
+            if abort_watcher is not None:
+                abort_watcher.wake()
+            for watcher in watchers:
+                watcher.cancel()
+            self.running.pop(handle, None)
+
+        handle.future.set_result(
+            ProcessResult(command, process.returncode, "".join(stdout_lines), "".join(stderr_lines), stopped)
+        )
+
+    async def _read(self, handle, stream, on_line, lines) -> None:
+        while line := await stream.readline():
+            handle.last_output = self.loop.time()
+            text = line.decode("utf-8", errors="replace")
+            if on_line is not None:
+                on_line(text)
+            else:
+                lines.append(text)
+
+    @staticmethod
+    async def _terminate(process, finished) -> bool:
+        """Stop the process, return False if its output could not be read to the end."""
+        _stop_group(process)
+        try:
+            await asyncio.wait_for(asyncio.shield(finished), TERMINATE_GRACE)
+            return True
+        except asyncio.TimeoutError:
+            _stop_group(process, force=True)
+        try:
+            await asyncio.wait_for(asyncio.shield(finished), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            # A grandchild still holds the pipe open, stop reading from it.
+            finished.cancel()
+            try:
+                await finished
+            except asyncio.CancelledError:
+                pass
+            return False
+        return True
+
+    async def _watch(self, handle, abort_watcher, stop_watching) -> None:
+        # The watcher blocks on file system events, it gets a thread and reports back once.
+        if await self.loop.run_in_executor(None, lambda: abort_watcher.wait(stop=stop_watching)):
+            handle._request_stop("abort")
+
+    @staticmethod
+    async def _poll(handle, abort_check, interval) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if abort_check():
+                handle._request_stop("abort")
+                return
+
+    async def _watchdog(self, handle, stall_timeout) -> None:
+        while True:
+            idle = self.loop.time() - handle.last_output
+            if idle >= stall_timeout:
+                handle._request_stop("stall")
+                return
+            await asyncio.sleep(stall_timeout - idle)
+
+    def _start_display(self) -> None:
+        if self.display and (self._display_task is None or self._display_task.done()):
+            self._display_task = asyncio.ensure_future(self._show_status())
+
+    async def _show_status(self) -> None:
+        spinner = itertools.cycle(["|", "/", "-", "\\"])
+        drawn = False
+        while self.running:
+            width = shutil.get_terminal_size().columns - 1
+            now = self.loop.time()
+            parts = [f"{h.description} {now - h.started:.0f}s" for h in self.running if h.description]
+            if any(h.live for h in self.running):
+                # Output printed to the terminal owns it, the status line would be mixed into it.
+                if drawn:
+                    self._clear_status()
+                    drawn = False
+            elif parts:
+                line = f"{next(spinner)} " + " | ".join(parts)
+                sys.stderr.write("\r" + line[:width].ljust(width))
+                sys.stderr.flush()
+                drawn = True
+            await asyncio.sleep(DISPLAY_INTERVAL)
+        if drawn:
+            self._clear_status()
+
+    @staticmethod
+    def _clear_status() -> None:
+        sys.stderr.write("\r" + " " * (shutil.get_terminal_size().columns - 1) + "\r")
+        sys.stderr.flush()
+
+
+# One supervisor per process, a process pool job started by fork gets its own.
+_supervisor: ProcessSupervisor | None = None
+_supervisor_pid = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor() -> ProcessSupervisor:
+    """Return this process' supervisor, starting it on first use."""
+    global _supervisor, _supervisor_pid
+    with _supervisor_lock:
+        if _supervisor is None or _supervisor_pid != os.getpid():
+            _supervisor = ProcessSupervisor()
+            _supervisor_pid = os.getpid()
+        return _supervisor
+
+
+@atexit.register
+def close_running() -> None:
+    """Terminate the children still running when the interpreter exits, e.g. after Ctrl-C."""
+    if _supervisor is not None and _supervisor_pid == os.getpid():
+        for handle in list(_supervisor.running):
+            if handle.process is not None:
+                _stop_group(handle.process)
+
+
+_previous_handlers = {}
+
+
+def _stop_and_forward(signum, frame) -> None:
+    close_running()
+    previous = _previous_handlers.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def forward_signals() -> None:
+    """Terminate the children's process groups on SIGINT and SIGTERM, then handle the signal as before.
+
+    Children lead their own process groups, a Ctrl-C in the terminal only reaches the Python
+    processes. Process pool workers exit without running atexit hooks, so every process that
+    runs children calls this from its main thread, pool workers through their initializer.
+    Signals that are ignored stay ignored.
+    """
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(signum)
+        if previous in (signal.SIG_IGN, _stop_and_forward):
+            continue
+        _previous_handlers[signum] = previous
+        signal.signal(signum, _stop_and_forward)
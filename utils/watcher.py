@@ -0,0 +1,200 @@
+import os
+import sys
+import time
+import ctypes
+import select
+import struct
+import threading
+import ctypes.util
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o0004000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+TAIL_SIZE = 64
+IDLE_WAIT = 30
+
+
+def json_document_complete(path: str) -> bool:
+    """Cheap check that a JSON object file has been written up to its closing brace."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - TAIL_SIZE))
+        return f.read().rstrip().endswith(b"}")
+
+
+class _Inotify:
+    """Minimal inotify binding through ctypes, one watch per directory."""
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def watch(self, directory: str) -> bool:
+        if directory in self.watches:
+            return True
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            return False
+        self.watches[directory] = wd
+        return True
+
+    def read(self, timeout: float, wake_fd: int = None) -> set[str]:
+        """Wait up to ``timeout`` seconds for changes, return the names of the changed files.
+
+        The wait also ends as soon as ``wake_fd`` becomes readable, what was written to it is consumed.
+        """
+        readable, _, _ = select.select([self.fd] if wake_fd is None else [self.fd, wake_fd], [], [], timeout)
+        if wake_fd is not None and wake_fd in readable:
+            os.read(wake_fd, 64)
+        names = set()
+        while self.fd in readable:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                names.add(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+                offset += length
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class OutputWatcher:
+    """Tell when a build output file is complete, at next to no cost while waiting.
+
+    The file counts as complete once it has stopped changing (size, mtime and inode) for
+    ``settle`` seconds and ``complete`` accepts it, or as soon as ``sentinel`` exists when the
+    build writes one. A file or sentinel left over from an earlier build is ignored until it
+    differs from what was there when the watcher was created. On Linux the parent directories are watched with inotify so nothing
+    runs until the build touches them, elsewhere the file is polled every ``poll_interval``.
+
+    Args:
+        path: Output file to wait for.
+        settle: Seconds the file must stay unchanged.
+        sentinel: File the build creates once ``path`` is final, skips the settle time.
+        poll_interval: Seconds between checks without inotify.
+        complete: Cheap content check run once the file has settled.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        settle: float = 2.0,
+        sentinel: str = None,
+        poll_interval: float = 1.0,
+        complete: callable = json_document_complete,
+    ) -> None:
+        self.path = os.path.abspath(path)
+        self.settle = settle
+        self.sentinel = os.path.abspath(sentinel) if sentinel else None
+        self.poll_interval = poll_interval
+        self.complete = complete
+        # What an earlier build left behind, the build has to replace or change it.
+        self._stale = self._stat(self.path)
+        self._stale_sentinel = self._stat(self.sentinel) if self.sentinel is not None else None
+        self._signature = None
+        self._since = None
+        self._lock = threading.Lock()
+        self._wake_fd = None
+
+    @staticmethod
+    def _stat(path: str):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def ready(self) -> bool:
+        """Check once whether the output is complete."""
+        if self.sentinel is not None and self._stat(self.sentinel) not in (None, self._stale_sentinel):
+            return os.path.exists(self.path)
+
+        signature = self._stat(self.path)
+        if signature is not None and signature == self._stale:
+            return False
+
+        now = time.monotonic()
+        if signature != self._signature:
+            self._signature, self._since = signature, now
+            return False
+        if signature is None or now - self._since < self.settle:
+            return False
+        try:
+            return self.complete is None or self.complete(self.path)
+        except OSError:
+            return False
+
+    def wake(self) -> None:
+        """Interrupt a ``wait`` blocked on inotify, call it after setting its ``stop`` event."""
+        with self._lock:
+            if self._wake_fd is not None:
+                os.write(self._wake_fd, b"\0")
+
+    def wait(self, stop: threading.Event = None, timeout: float = None) -> bool:
+        """Block until the output is complete, return False if ``stop`` is set or ``timeout`` passes first.
+
+        ``stop`` is looked at between checks, a wait on inotify only notices it right away after ``wake()``.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        directories = {os.path.dirname(self.path)}
+        if self.sentinel is not None:
+            directories.add(os.path.dirname(self.sentinel))
+
+        inotify = None
+        if sys.platform.startswith("linux"):
+            try:
+                inotify = _Inotify()
+            except (OSError, AttributeError):
+                inotify = None
+        if inotify is not None:
+            # Self-pipe, wake() writes to it and ends the select of the inotify read.
+            wake_read, wake_write = os.pipe()
+            with self._lock:
+                self._wake_fd = wake_write
+
+        try:
+            while not (stop is not None and stop.is_set()):
+                if self.ready():
+                    return True
+
+                # Directories that do not exist yet, e.g. out/<product>, are polled until they do.
+                watching = inotify is not None and all(inotify.watch(d) for d in directories)
+                # A settling file needs one more look after the settle time even without events.
+                if self._signature is not None:
+                    interval = self.settle
+                else:
+                    interval = IDLE_WAIT if watching else self.poll_interval
+                if deadline is not None:
+                    interval = min(interval, deadline - time.monotonic())
+                    if interval <= 0:
+                        return False
+
+                if watching:
+                    inotify.read(interval, wake_read)
+                else:
+                    time.sleep(interval)
+            return False
+        finally:
+            if inotify is not None:
+                inotify.close()
+                with self._lock:
+                    self._wake_fd = None
+                os.close(wake_read)
+                os.close(wake_write)
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import atexit
+import threading
+import subprocess
+
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scancode_worker.py")
+
+
+class WorkerUnavailable(RuntimeError):
+    """Raised when no warm worker can be started, callers fall back to the scancode CLI."""
+
+
+def toolkit_python(scancode_path: str) -> str | None:
+    """Return the interpreter of the virtualenv the scancode-toolkit release configures for itself."""
+    if sys.platform == "win32":
+        python = os.path.join(scancode_path, "venv", "Scripts", "python.exe")
+    else:
+        python = os.path.join(scancode_path, "venv", "bin", "python")
+    return python if os.path.exists(python) else None
+
+
+class WarmWorker:
+    """A scancode process that keeps its license index loaded between scans.
+
+    Speaks the JSON lines protocol of ``scancode_worker.py`` over its stdin and stdout.
+
+    Raises:
+        WorkerUnavailable: If the worker does not come up, e.g. scancode is not importable.
+    """
+
+    def __init__(self, python: str) -> None:
+        self.process = subprocess.Popen(
+            [python, WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        ready = self.process.stdout.readline()
+        if not ready:
+            self.close()
+            raise WorkerUnavailable(f"scancode worker failed to start with {python}")
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def scan(
+        self, input_path: str, output_path: str, processes: int, file_timeout: float = None, timeout: float = None
+    ) -> tuple[str, str]:
+        """Scan ``input_path`` into the scancode JSON ``output_path``, return stdout and stderr.
+
+        Args:
+            file_timeout: Seconds scancode may spend on one file.
+            timeout: Seconds the whole scan may take, the worker is killed after that.
+
+        Raises:
+            RuntimeError: If the scan failed or the worker died during it.
+            subprocess.TimeoutExpired: If the worker was killed because of ``timeout``.
+        """
+        request = {"input": os.path.abspath(input_path), "output": os.path.abspath(output_path), "processes": processes}
+        if file_timeout:
+            request["timeout"] = file_timeout
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+
+        killed = threading.Event()
+
+        def kill():
+            killed.set()
+            self.process.kill()
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer is not None:
+            timer.start()
+        line = self.process.stdout.readline()
+        if timer is not None:
+            timer.cancel()
+        if not line:
+            self.close()
+            if killed.is_set():
+                raise subprocess.TimeoutExpired(request["input"], timeout)
+            raise RuntimeError(f"scancode worker exited while scanning {input_path}")
+
+        response = json.loads(line)
+        # Files with scan errors, e.g. a per-file timeout, still leave a complete result.
+        if not response["ok"] and not response.get("complete"):
+            raise RuntimeError(f"scancode worker failed on {input_path}: {response['error']}")
+        return response["stdout"], response["stderr"]
+
+    def close(self) -> None:
+        if self.process.stdin and not self.process.stdin.closed:
+            self.process.stdin.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+# One warm worker per interpreter and process: every process pool job owns its own worker, the
+# worker exits by itself once its stdin closes with the job process.
+_workers: dict[str, WarmWorker] = {}
+_unavailable: set[str] = set()
+
+
+def get_worker(scancode_path: str) -> WarmWorker:
+    """Return this process' warm worker for a scancode-toolkit release, starting it if needed.
+
+    Raises:
+        WorkerUnavailable: If the toolkit has no configured interpreter or the worker can not start,
+            further calls fail fast for the same toolkit.
+    """
+    python = toolkit_python(scancode_path)
+    if python is None or python in _unavailable:
+        raise WorkerUnavailable(f"no usable scancode-toolkit interpreter in {scancode_path}")
+
+    worker = _workers.get(python)
+    if worker is None or not worker.alive:
+        try:
+            worker = _workers[python] = WarmWorker(python)
+        except (OSError, WorkerUnavailable):
+            _unavailable.add(python)
+            raise WorkerUnavailable(f"scancode worker failed to start with {python}")
+    return worker
+
+
+@atexit.register
+def close_workers() -> None:
+    for worker in _workers.values():
+        worker.close()
+    _workers.clear()